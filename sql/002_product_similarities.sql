@@ -0,0 +1,29 @@
+-- Project Heimdall Migration 002
+-- Description: Precomputed item-to-item similarities for /products/{id}/recommendations
+
+BEGIN;
+
+INSERT INTO schema_migrations (version, description)
+VALUES ('002', 'Precomputed product similarities')
+ON CONFLICT (version) DO NOTHING;
+
+-- ===================================================================
+-- Product Similarities Table
+-- ===================================================================
+-- One row per product; neighbor_ids is ordered by similarity (co-occurrence
+-- neighbours first, content-based fill after them with score 0).
+CREATE TABLE IF NOT EXISTS product_similarities (
+    product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    neighbor_ids INTEGER[] NOT NULL DEFAULT '{}',
+    scores REAL[] NOT NULL DEFAULT '{}',
+    computed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_product_similarities_computed_at ON product_similarities(computed_at);
+
+-- Keyset pagination used by the similarity job to stream the behavior log per user
+CREATE INDEX IF NOT EXISTS idx_user_behaviors_user_id_id ON user_behaviors(user_id, id);
+
+COMMENT ON TABLE product_similarities IS 'Top-N related products per product, refreshed by the item similarity job';
+
+COMMIT;
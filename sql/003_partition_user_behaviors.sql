@@ -0,0 +1,144 @@
+-- Project Heimdall Migration 003
+-- Description: Monthly range partitioning of user_behaviors on created_at, plus daily rollups
+--
+-- The existing heap table is renamed to user_behaviors_legacy and its rows are
+-- copied into a new table partitioned by month. After verifying row counts,
+-- drop the legacy table manually:
+--
+--     DROP TABLE user_behaviors_legacy;
+--
+-- Future partitions are created, and partitions older than the retention window
+-- are rolled up into user_behavior_rollups and dropped, by the partition
+-- maintenance job (src/heimdall/services/behavior_partitions.py).
+
+BEGIN;
+
+INSERT INTO schema_migrations (version, description)
+VALUES ('003', 'Monthly partitioned user_behaviors and daily rollups')
+ON CONFLICT (version) DO NOTHING;
+
+-- ===================================================================
+-- 1. Replace user_behaviors with a partitioned table
+-- ===================================================================
+ALTER TABLE user_behaviors RENAME TO user_behaviors_legacy;
+ALTER TABLE user_behaviors_legacy RENAME CONSTRAINT user_behaviors_pkey TO user_behaviors_legacy_pkey;
+
+-- Index names are schema-wide; the legacy table is only kept for verification
+DROP INDEX IF EXISTS idx_user_behaviors_user_id;
+DROP INDEX IF EXISTS idx_user_behaviors_session_id;
+DROP INDEX IF EXISTS idx_user_behaviors_behavior_type;
+DROP INDEX IF EXISTS idx_user_behaviors_timestamp;
+DROP INDEX IF EXISTS idx_user_behaviors_user_id_id;
+
+-- Keep the id sequence when the legacy table is dropped later
+ALTER SEQUENCE user_behaviors_id_seq OWNED BY NONE;
+
+-- Same columns and defaults as before (including columns added outside 001);
+-- the primary key must include the partition key.
+CREATE TABLE user_behaviors (
+    LIKE user_behaviors_legacy INCLUDING DEFAULTS
+) PARTITION BY RANGE (created_at);
+
+ALTER TABLE user_behaviors ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE user_behaviors ADD PRIMARY KEY (id, created_at);
+
+-- Rows outside every monthly partition (e.g. clock skew far in the future)
+CREATE TABLE user_behaviors_default PARTITION OF user_behaviors DEFAULT;
+
+-- One partition per month from the oldest row up to three months ahead.
+-- Bounds are UTC month starts; names are user_behaviors_pYYYYMM.
+DO $$
+DECLARE
+    first_month DATE;
+    last_month DATE := (date_trunc('month', now() AT TIME ZONE 'UTC') + INTERVAL '3 months')::date;
+    m DATE;
+BEGIN
+    SELECT COALESCE(
+        date_trunc('month', MIN(COALESCE(created_at, "timestamp")) AT TIME ZONE 'UTC')::date,
+        date_trunc('month', now() AT TIME ZONE 'UTC')::date
+    ) INTO first_month
+    FROM user_behaviors_legacy;
+
+    m := first_month;
+    WHILE m <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF user_behaviors FOR VALUES FROM (%L) TO (%L)',
+            'user_behaviors_p' || to_char(m, 'YYYYMM'),
+            m::timestamp AT TIME ZONE 'UTC',
+            (m + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC'
+        );
+        m := (m + INTERVAL '1 month')::date;
+    END LOOP;
+END $$;
+
+-- Copy every column the LIKE above created (including columns added outside 001,
+-- e.g. detected_intent / intent_confidence from the ORM model). Rows written
+-- before created_at was always set fall back to their event timestamp.
+DO $$
+DECLARE
+    has_timestamp BOOLEAN;
+    column_list TEXT;
+    select_list TEXT;
+BEGIN
+    SELECT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema()
+        AND table_name = 'user_behaviors_legacy'
+        AND column_name = 'timestamp'
+    ) INTO has_timestamp;
+
+    SELECT
+        string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position),
+        string_agg(
+            CASE
+                WHEN column_name <> 'created_at' THEN quote_ident(column_name)
+                WHEN has_timestamp THEN 'COALESCE(created_at, "timestamp", now())'
+                ELSE 'COALESCE(created_at, now())'
+            END,
+            ', ' ORDER BY ordinal_position
+        )
+    INTO column_list, select_list
+    FROM information_schema.columns
+    WHERE table_schema = current_schema()
+    AND table_name = 'user_behaviors_legacy';
+
+    EXECUTE format(
+        'INSERT INTO user_behaviors (%s) SELECT %s FROM user_behaviors_legacy',
+        column_list, select_list
+    );
+END $$;
+
+SELECT setval('user_behaviors_id_seq', COALESCE((SELECT MAX(id) FROM user_behaviors), 1));
+
+-- ===================================================================
+-- 2. Indexes (created on every partition automatically)
+-- ===================================================================
+-- Profile queries: one user's recent window
+CREATE INDEX IF NOT EXISTS idx_user_behaviors_user_created ON user_behaviors(user_id, created_at DESC);
+-- Keyset pagination of the behavior log per user (item similarity job)
+CREATE INDEX IF NOT EXISTS idx_user_behaviors_user_id_id ON user_behaviors(user_id, id);
+-- Incremental readers that follow the id watermark (popularity service)
+CREATE INDEX IF NOT EXISTS idx_user_behaviors_id ON user_behaviors(id);
+CREATE INDEX IF NOT EXISTS idx_user_behaviors_session_id ON user_behaviors(session_id);
+CREATE INDEX IF NOT EXISTS idx_user_behaviors_behavior_type ON user_behaviors(behavior_type);
+
+-- ===================================================================
+-- 3. Daily rollups of dropped partitions
+-- ===================================================================
+CREATE TABLE IF NOT EXISTS user_behavior_rollups (
+    day DATE NOT NULL,
+    user_id VARCHAR(255) NOT NULL,
+    behavior_type VARCHAR(50) NOT NULL,
+    product_id TEXT NOT NULL DEFAULT '',
+    category TEXT NOT NULL DEFAULT '',
+    brand TEXT NOT NULL DEFAULT '',
+    event_count INTEGER NOT NULL,
+    PRIMARY KEY (day, user_id, behavior_type, product_id, category, brand)
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_behavior_rollups_user_day ON user_behavior_rollups(user_id, day DESC);
+
+COMMENT ON TABLE user_behaviors IS 'Tracks user behavior events; partitioned by month on created_at';
+COMMENT ON TABLE user_behavior_rollups IS 'Daily per-user event counts kept after raw partitions pass the retention window';
+
+COMMIT;
@@ -0,0 +1,89 @@
+-- Project Heimdall Migration 004
+-- Description: Typed product_id / category / brand / price columns on user_behaviors
+--
+-- The columns are STORED generated columns derived from behavior_data, so every
+-- write path (single INSERT, batched INSERT, COPY) fills them without changes,
+-- and adding them rewrites the existing rows with their values (the backfill).
+-- The rewrite holds an ACCESS EXCLUSIVE lock on user_behaviors for its
+-- duration; run it in a low-traffic window. Applies after 003.
+--
+-- Values that do not fit the column type (e.g. a non-numeric product_id) are
+-- stored as NULL instead of failing the write. Existing plain columns with the
+-- same names are replaced if empty; if they hold data the migration aborts.
+
+BEGIN;
+
+INSERT INTO schema_migrations (version, description)
+VALUES ('004', 'Typed behavior columns and covering indexes')
+ON CONFLICT (version) DO NOTHING;
+
+-- ===================================================================
+-- 1. Generated columns (also added to every partition)
+-- ===================================================================
+-- ADD COLUMN IF NOT EXISTS would silently keep a plain column of the same name,
+-- which no write path fills. Plain columns that are entirely NULL are dropped
+-- and re-added as generated; plain columns holding data stop the migration.
+DO $$
+DECLARE
+    col TEXT;
+    has_data BOOLEAN;
+BEGIN
+    FOR col IN
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema()
+        AND table_name = 'user_behaviors'
+        AND column_name IN ('product_id', 'category', 'brand', 'price')
+        AND is_generated = 'NEVER'
+    LOOP
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM user_behaviors WHERE %I IS NOT NULL)', col)
+            INTO has_data;
+        IF has_data THEN
+            RAISE EXCEPTION 'user_behaviors.% is a plain column holding data; move its values into behavior_data or drop it, then rerun 004', col;
+        END IF;
+        RAISE NOTICE 'Replacing empty plain column user_behaviors.% with a generated column', col;
+        EXECUTE format('ALTER TABLE user_behaviors DROP COLUMN %I', col);
+    END LOOP;
+END $$;
+
+ALTER TABLE user_behaviors
+    ADD COLUMN IF NOT EXISTS product_id INTEGER GENERATED ALWAYS AS (
+        CASE WHEN behavior_data->>'product_id' ~ '^[0-9]{1,9}$'
+             THEN (behavior_data->>'product_id')::integer END
+    ) STORED,
+    ADD COLUMN IF NOT EXISTS category TEXT GENERATED ALWAYS AS (
+        behavior_data->>'category'
+    ) STORED,
+    ADD COLUMN IF NOT EXISTS brand TEXT GENERATED ALWAYS AS (
+        behavior_data->>'brand'
+    ) STORED,
+    ADD COLUMN IF NOT EXISTS price NUMERIC GENERATED ALWAYS AS (
+        CASE WHEN behavior_data->>'price' ~ '^-?[0-9]{1,12}(\.[0-9]+)?$'
+             THEN (behavior_data->>'price')::numeric END
+    ) STORED;
+
+-- ===================================================================
+-- 2. Covering indexes
+-- ===================================================================
+-- Per-user profile aggregation and /analytics/user-activity: index-only scans
+-- over one user's recent window (replaces the plain index from 003)
+CREATE INDEX IF NOT EXISTS idx_user_behaviors_user_created_covering
+    ON user_behaviors(user_id, created_at DESC)
+    INCLUDE (behavior_type, product_id, category, brand, price);
+DROP INDEX IF EXISTS idx_user_behaviors_user_created;
+
+-- Collaborative filtering: other users who interacted with the candidate products
+CREATE INDEX IF NOT EXISTS idx_user_behaviors_product_created
+    ON user_behaviors(product_id, created_at DESC)
+    INCLUDE (user_id, behavior_type)
+    WHERE product_id IS NOT NULL;
+
+-- Keyset pagination of the behavior log per user, without heap lookups
+-- (replaces the plain index from 002)
+CREATE INDEX IF NOT EXISTS idx_user_behaviors_user_id_id_covering
+    ON user_behaviors(user_id, id)
+    INCLUDE (product_id, created_at);
+DROP INDEX IF EXISTS idx_user_behaviors_user_id_id;
+
+ANALYZE user_behaviors;
+
+COMMIT;
@@ -12,7 +12,10 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel, Field
 
 from src.heimdall.services.llm_service import llm_service
+from src.heimdall.services.intent_cache import intent_cache, prompt_version
 from src.heimdall.services.session_service import session_service
+from src.heimdall.services.behavior_ingest import validate_event
+from src.heimdall.services.behavior_queue import behavior_write_queue
 from src.heimdall.tools.registry import tool_registry
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
@@ -108,14 +111,20 @@ async def analyze_user_intent(
                 {"role": "user", "content": request.user_input}
             ]
             
-            # 调用大模型进行意图分析
-            model_response = await llm_service.client.chat.completions.create(
-                model=settings.MODEL_NAME,
-                messages=messages,
-                temperature=0.3
-            )
+            async def request_intent_analysis() -> str:
+                # 调用大模型进行意图分析
+                model_response = await llm_service.client.chat.completions.create(
+                    model=settings.MODEL_NAME,
+                    messages=messages,
+                    temperature=0.3
+                )
+                return model_response.choices[0].message.content
             
-            analysis_result = model_response.choices[0].message.content
+            # 相同输入与提示词的分析结果走缓存，并发的相同请求只调用一次大模型
+            cache_key = intent_cache.make_key(
+                request.user_input, settings.MODEL_NAME, prompt_version(system_prompt), namespace="advertising"
+            )
+            analysis_result = await intent_cache.get_or_compute(cache_key, request_intent_analysis)
             
             # 解析分析结果
             intent_info = parse_intent_analysis(analysis_result)
@@ -175,36 +184,37 @@ async def record_user_behavior(
         extra={"request_id": request_id, "user_id": request.user_id}
     )
     
-    try:
-        # 这里可以添加数据库存储逻辑
-        # 目前只是记录日志
-        
-        behavior_data = {
-            "user_id": request.user_id,
-            "session_id": request.session_id,
-            "behavior_type": request.behavior_type,
-            "behavior_data": request.behavior_data,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        logger.info(
-            f"用户行为记录成功",
-            extra={"request_id": request_id, "behavior_data": behavior_data}
+    record, errors = validate_event(request, UserBehaviorRequest, datetime.now())
+    if record is None:
+        raise HTTPException(status_code=400, detail=f"无效的行为数据: {'; '.join(errors)}")
+    
+    # 只放入进程内队列，由后台协程批量写入数据库
+    if not behavior_write_queue.enqueue(record):
+        retry_after = behavior_write_queue.retry_after_seconds
+        logger.warning(
+            f"行为写入队列已满或未运行，拒绝记录",
+            extra={"request_id": request_id, "queue_depth": len(behavior_write_queue)}
         )
-        
-        return {
-            "request_id": request_id,
-            "message": "用户行为记录成功",
-            "behavior_data": behavior_data,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-    except Exception as e:
-        logger.error(
-            f"用户行为记录失败: {str(e)}",
-            extra={"request_id": request_id}
+        raise HTTPException(
+            status_code=503,
+            detail="行为写入队列繁忙，请稍后重试",
+            headers={"Retry-After": str(retry_after)}
         )
-        raise HTTPException(status_code=500, detail=f"行为记录失败: {str(e)}")
+    
+    behavior_data = {
+        "user_id": request.user_id,
+        "session_id": request.session_id,
+        "behavior_type": request.behavior_type,
+        "behavior_data": request.behavior_data,
+        "timestamp": record[4].isoformat()
+    }
+    
+    return {
+        "request_id": request_id,
+        "message": "用户行为记录成功",
+        "behavior_data": behavior_data,
+        "timestamp": datetime.now().isoformat()
+    }
 
 @router.post("/recommend_ads")
 async def recommend_ads(
@@ -3,14 +3,22 @@
 基于用户行为数据进行智能推荐
 """
 
+import json
 from typing import List, Dict, Any, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import text
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timedelta
 
+from src.heimdall.core.config import settings
 from src.heimdall.core.database import get_db
 from src.heimdall.services.recommendation_engine import recommendation_engine
+from src.heimdall.services.profile_worker import profile_rebuild_worker
+from src.heimdall.services.popularity import popularity_service
+from src.heimdall.services.behavior_ingest import VALID_BEHAVIOR_TYPES, StreamIngestAborted, behavior_ingestor
+from src.heimdall.services.behavior_queue import behavior_write_queue
+from src.heimdall.services.behavior_partitions import behavior_partition_manager
 from src.heimdall.services.memory_data_provider import memory_data_provider
 
 router = APIRouter(prefix="/api/v1", tags=["企业级推荐"])
@@ -30,7 +38,7 @@ class RecommendationRequest(BaseModel):
     user_id: str
     session_id: str
     limit: Optional[int] = 10
-    strategy: Optional[str] = "hybrid"  # collaborative, content, hybrid
+    strategy: Optional[str] = "hybrid"  # collaborative, content, factorized, hybrid
     context: Optional[Dict[str, Any]] = None
 
 class RecommendationResponse(BaseModel):
@@ -56,6 +64,10 @@ class UserBehaviorRequest(BaseModel):
     behavior_type: str  # search, view, click, purchase
     behavior_data: Dict[str, Any]
 
+class BehaviorBatchEvent(UserBehaviorRequest):
+    """批量记录中的单个事件：规则与 UserBehaviorRequest 相同，可带客户端记录的发生时间"""
+    created_at: Optional[datetime] = None
+
 class SimilarUsersRequest(BaseModel):
     user_id: str
     limit: Optional[int] = 10
@@ -158,7 +170,7 @@ async def record_user_behavior(
     """
     try:
         # 验证行为类型
-        valid_behavior_types = ['search', 'view', 'click', 'purchase']
+        valid_behavior_types = list(VALID_BEHAVIOR_TYPES)
         if request.behavior_type not in valid_behavior_types:
             raise HTTPException(
                 status_code=400, 
@@ -166,6 +178,7 @@ async def record_user_behavior(
             )
         
         # 记录行为
+        created_at = datetime.now()
         query = """
             INSERT INTO user_behaviors (user_id, session_id, behavior_type, behavior_data, created_at)
             VALUES (:user_id, :session_id, :behavior_type, :behavior_data, :created_at)
@@ -176,14 +189,19 @@ async def record_user_behavior(
             "session_id": request.session_id,
             "behavior_type": request.behavior_type,
             "behavior_data": request.behavior_data,
-            "created_at": datetime.now()
+            "created_at": created_at
         })
         
         await db.commit()
         
-        # 异步更新用户画像（不阻塞响应）
+        # 画像由后台队列增量更新，行为提交后立即返回；队列未运行时同步更新
         try:
-            await recommendation_engine.build_user_profile(request.user_id, db)
+            event = (request.behavior_type, request.behavior_data, created_at)
+            if not profile_rebuild_worker.mark_dirty(request.user_id, event):
+                await recommendation_engine.apply_behavior_event(
+                    request.user_id, request.behavior_type, request.behavior_data, db,
+                    occurred_at=created_at
+                )
         except Exception as e:
             # 不影响主流程，只记录日志
             print(f"更新用户画像失败: {e}")
@@ -201,6 +219,125 @@ async def record_user_behavior(
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"记录行为失败: {str(e)}")
 
+@router.post("/record-behaviors", summary="批量记录用户行为")
+async def record_user_behaviors(
+    http_request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """批量记录用户行为数据
+    
+    请求体为 {"events": [...]}，每个事件的字段与 /record-behavior 相同，另可带 created_at。
+    事件逐个校验，合格事件通过 COPY 一次写入并提交，不合格事件按下标返回拒绝原因。
+    """
+    try:
+        payload = json.loads(await http_request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"请求体不是有效的JSON: {e}")
+    events = payload.get("events") if isinstance(payload, dict) else None
+    if not isinstance(events, list):
+        raise HTTPException(status_code=400, detail="请求体必须为 {\"events\": [...]}")
+    if len(events) > settings.BEHAVIOR_INGEST_MAX_EVENTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"单次最多记录 {settings.BEHAVIOR_INGEST_MAX_EVENTS} 个事件，本次 {len(events)} 个"
+        )
+    
+    received_at = datetime.now()
+    try:
+        result = await behavior_ingestor.ingest(db, events, BehaviorBatchEvent)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量记录行为失败: {str(e)}")
+    
+    await _mark_recorded_profiles(result.records, received_at, db)
+    
+    return {
+        "accepted": result.accepted,
+        "rejected": result.rejected,
+        "rejects": [reject.to_dict() for reject in result.rejects],
+        "timestamp": datetime.now().isoformat()
+    }
+
+async def _mark_recorded_profiles(records, received_at: datetime, db: AsyncSession) -> None:
+    """
+    批量记录后更新画像（同一用户的多个事件合并为一次更新）
+
+    只有服务端打时间戳的事件（不早于 received_at）做增量更新；带客户端历史时间的事件可能早于画像
+    的时间戳，也可能不在对账窗口内，其用户改为全量重建。队列未运行时在当前请求中同步更新。
+    """
+    events_by_user: Dict[str, List[Any]] = {}
+    rebuild_users = set()
+    for user_id, _, behavior_type, behavior_data, created_at in records:
+        events_by_user.setdefault(user_id, []).append((behavior_type, behavior_data, created_at))
+        if created_at < received_at:
+            rebuild_users.add(user_id)
+    
+    for user_id, user_events in events_by_user.items():
+        if profile_rebuild_worker.running:
+            if user_id in rebuild_users:
+                profile_rebuild_worker.mark_dirty(user_id)
+            else:
+                for event in user_events:
+                    profile_rebuild_worker.mark_dirty(user_id, event)
+            continue
+        try:
+            if user_id in rebuild_users:
+                await recommendation_engine.build_user_profile(user_id, db)
+            else:
+                await recommendation_engine.apply_behavior_events(user_id, user_events, db)
+        except Exception as e:
+            # 不影响主流程，只记录日志
+            print(f"更新用户画像失败: {e}")
+
+def _mark_backfilled_profiles(records) -> None:
+    """回填的历史行为不在对账窗口内，为每批涉及的用户提交全量重建信号（按用户合并）"""
+    for user_id in {record[0] for record in records}:
+        profile_rebuild_worker.mark_dirty(user_id)
+
+@router.post("/record-behaviors/ndjson", summary="流式批量记录用户行为（NDJSON）")
+async def record_user_behaviors_ndjson(
+    http_request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """流式批量记录用户行为数据
+    
+    请求体为 NDJSON（每行一个与 /record-behaviors 中相同的事件），边读取边逐行解析，
+    每凑满一批即通过 COPY 写入并提交，适合从数据湖回填大量历史行为。
+    返回接收与拒绝的事件数，以及前若干个被拒绝事件的行号与原因。
+    """
+    try:
+        result = await behavior_ingestor.ingest_ndjson(
+            db, http_request.stream(), BehaviorBatchEvent, on_batch=_mark_backfilled_profiles
+        )
+    except StreamIngestAborted as e:
+        raise HTTPException(status_code=500, detail={
+            "message": f"流式记录行为失败: {str(e)}",
+            "accepted": e.result.accepted,
+            "rejected": e.result.rejected,
+            "lines": e.result.lines
+        })
+    
+    return {
+        "accepted": result.accepted,
+        "rejected": result.rejected,
+        "lines": result.lines,
+        "batches": result.batches,
+        "rejects": [reject.to_dict() for reject in result.reject_samples],
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/metrics", summary="推荐引擎后台任务指标")
+async def get_engine_metrics():
+    """获取画像后台更新队列、画像写缓冲、相似用户索引、产品热度、行为批量写入、行为写入队列与行为表分区维护的运行指标"""
+    return {
+        "profile_worker": profile_rebuild_worker.summary(),
+        "profile_write_buffer": recommendation_engine.profile_write_buffer.summary(),
+        "similar_user_index": recommendation_engine.similar_user_index.summary(),
+        "popularity": popularity_service.summary(),
+        "behavior_ingest": behavior_ingestor.summary(),
+        "behavior_write_queue": behavior_write_queue.summary(),
+        "behavior_partitions": behavior_partition_manager.summary()
+    }
+
 @router.post("/similar-users", response_model=SimilarUsersResponse, summary="获取相似用户")
 async def get_similar_users(
     request: SimilarUsersRequest,
@@ -211,24 +348,17 @@ async def get_similar_users(
     基于用户画像和行为特征，找到与指定用户最相似的其他用户。
     """
     try:
-        similar_users = await recommendation_engine.get_similar_users(
+        # 相似用户及相似度分数（索引查询时已计算，无需再逐个读取画像）
+        scored_users = await recommendation_engine.get_similar_users_with_scores(
             request.user_id, 
             db, 
             request.limit
         )
-        
-        # 计算相似度分数
-        current_profile = await recommendation_engine.get_user_profile(request.user_id, db)
-        similarity_scores = {}
-        
-        for similar_user in similar_users:
-            similar_profile = await recommendation_engine.get_user_profile(similar_user, db)
-            similarity_score = recommendation_engine.calculate_similarity(current_profile, similar_profile)
-            similarity_scores[similar_user] = similarity_score
+        similarity_scores = dict(scored_users)
         
         return {
             "user_id": request.user_id,
-            "similar_users": similar_users,
+            "similar_users": [similar_user for similar_user, _ in scored_users],
             "similarity_scores": similarity_scores,
             "timestamp": datetime.now().isoformat()
         }
@@ -244,8 +374,35 @@ async def get_trending_recommendations(
 ):
     """获取热门推荐
     
-    基于销量、评分、浏览量等指标，获取当前热门的产品推荐。
+    基于时间衰减的浏览、点击、购买行为热度获取当前热门的产品推荐（内存榜单）；
+    热度尚未加载时按评分、评价数查询。
     """
+    # 与数据库回退查询的 `if category_id` 一致：category_id=0 视为不过滤
+    ranked = popularity_service.top(limit, category_id or None)
+    if ranked is not None:
+        return {
+            "trending_products": [
+                {
+                    "id": product["id"],
+                    "name": product["name"],
+                    "description": product["description"],
+                    "price": product["price"],
+                    "category_id": product["category_id"],
+                    "brand": product["brand"],
+                    "image_url": product["image_url"],
+                    "tags": product["tags"],
+                    "attributes": product["attributes"],
+                    "rating": product["rating"],
+                    "review_count": product["review_count"],
+                    "recommendation_reason": "热门推荐"
+                }
+                for product in ranked
+            ],
+            "count": len(ranked),
+            "category_filter": category_id,
+            "timestamp": datetime.now().isoformat()
+        }
+    
     try:
         # 构建查询条件
         conditions = ["is_active = true"]
@@ -305,13 +462,24 @@ async def get_user_activity_analytics(
     分析指定用户在最近N天内的行为模式和偏好。
     """
     try:
-        # 获取用户行为数据
+        # 在数据库中按行为类型、类别、品牌、日期分别计数（一次查询，只读取类型化列）
         query = text("""
-            SELECT behavior_type, behavior_data, created_at
-            FROM user_behaviors 
-            WHERE user_id = :user_id 
-            AND created_at >= :cutoff_date
-            ORDER BY created_at DESC
+            SELECT
+                CASE
+                    WHEN GROUPING(behavior_type) = 0 THEN 'behavior_type'
+                    WHEN GROUPING(category) = 0 THEN 'category'
+                    WHEN GROUPING(brand) = 0 THEN 'brand'
+                    ELSE 'day'
+                END AS dimension,
+                COALESCE(behavior_type, category, brand, day::text) AS value,
+                COUNT(*)
+            FROM (
+                SELECT behavior_type, category, brand, (created_at AT TIME ZONE 'UTC')::date AS day
+                FROM user_behaviors 
+                WHERE user_id = :user_id 
+                AND created_at >= :cutoff_date
+            ) events
+            GROUP BY GROUPING SETS ((behavior_type), (category), (brand), (day))
         """)
         
         cutoff_date = datetime.now() - timedelta(days=days)
@@ -320,40 +488,20 @@ async def get_user_activity_analytics(
             "cutoff_date": cutoff_date
         })
         
-        behaviors = result.fetchall()
-        
-        # 分析行为统计
-        behavior_counts = {}
-        category_counts = {}
-        brand_counts = {}
-        daily_activity = {}
+        counts = {"behavior_type": {}, "category": {}, "brand": {}, "day": {}}
+        for dimension, value, count in result.fetchall():
+            if value is not None:
+                counts[dimension][value] = count
         
-        for behavior in behaviors:
-            behavior_type = behavior[0]
-            behavior_data = behavior[1]
-            created_at = behavior[2]
-            
-            # 行为类型统计
-            behavior_counts[behavior_type] = behavior_counts.get(behavior_type, 0) + 1
-            
-            # 类别统计
-            if 'category' in behavior_data:
-                category = behavior_data['category']
-                category_counts[category] = category_counts.get(category, 0) + 1
-            
-            # 品牌统计
-            if 'brand' in behavior_data:
-                brand = behavior_data['brand']
-                brand_counts[brand] = brand_counts.get(brand, 0) + 1
-            
-            # 日活统计
-            date_key = created_at.strftime('%Y-%m-%d')
-            daily_activity[date_key] = daily_activity.get(date_key, 0) + 1
+        behavior_counts = counts["behavior_type"]
+        category_counts = counts["category"]
+        brand_counts = counts["brand"]
+        daily_activity = dict(sorted(counts["day"].items(), reverse=True))
         
         return {
             "user_id": user_id,
             "analysis_period": f"{days}天",
-            "total_behaviors": len(behaviors),
+            "total_behaviors": sum(behavior_counts.values()),
             "behavior_counts": behavior_counts,
             "category_preferences": category_counts,
             "brand_preferences": brand_counts,
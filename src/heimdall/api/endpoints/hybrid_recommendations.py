@@ -12,6 +12,8 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel, Field
 
 from src.heimdall.services.hybrid_recommendation_engine import hybrid_recommendation_engine
+from src.heimdall.services.intent_keywords import offline_intent_analyzer
+from src.heimdall.core.config import settings
 from src.heimdall.core.database import get_db
 # from src.heimdall.core.structured_logging import get_request_id
 
@@ -78,26 +80,17 @@ async def get_hybrid_recommendations(
         # 生成会话ID
         session_id = request.session_id or f"session_{uuid.uuid4().hex[:8]}"
         
-        # 获取混合推荐
-        recommendations = await hybrid_recommendation_engine.get_hybrid_recommendations(
+        # 获取混合推荐（同时返回推荐过程中计算的用户行为画像与AI意图分析，避免重复计算）
+        result = await hybrid_recommendation_engine.get_hybrid_recommendations_with_context(
             user_id=request.user_id,
             user_input=request.user_input,
             db=db,
             limit=request.limit,
             strategy=request.strategy
         )
-        
-        # 获取用户行为画像
-        behavior_profile = await hybrid_recommendation_engine.get_user_behavior_profile(
-            request.user_id, db
-        )
-        
-        # AI意图分析（如果有用户输入）
-        intent_analysis = None
-        if request.user_input:
-            intent_analysis = await hybrid_recommendation_engine.analyze_user_intent(
-                request.user_input, request.user_id
-            )
+        recommendations = result.recommendations
+        behavior_profile = result.behavior_profile
+        intent_analysis = result.intent_analysis
         
         response = HybridRecommendationResponse(
             request_id=request_id,
@@ -237,15 +230,16 @@ async def get_recommendation_comparison(
         strategies = ["hybrid", "intent_based", "behavior_based"]
         comparison_results = {}
         
-        for strategy in strategies:
-            recommendations = await hybrid_recommendation_engine.get_hybrid_recommendations(
-                user_id=user_id,
-                user_input=user_input,
-                db=db,
-                limit=limit,
-                strategy=strategy
-            )
-            
+        # 一次计算全部分数分量，各策略在同一分数矩阵上排序
+        strategy_recommendations = await hybrid_recommendation_engine.compare_strategies(
+            user_id=user_id,
+            user_input=user_input,
+            db=db,
+            strategies=strategies,
+            limit=limit
+        )
+        
+        for strategy, recommendations in strategy_recommendations.items():
             comparison_results[strategy] = {
                 "recommendations": recommendations,
                 "count": len(recommendations),
@@ -266,4 +260,47 @@ async def get_recommendation_comparison(
             f"推荐策略对比失败: {str(e)}",
             extra={"request_id": request_id}
         )
-        raise HTTPException(status_code=500, detail=f"策略对比失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"策略对比失败: {str(e)}")
+
+@router.get("/metrics")
+async def get_engine_metrics(http_request: Request):
+    """
+    获取推荐引擎运行指标
+    
+    包括候选召回的候选集大小、召回率采样等，用于调优召回与打分的取舍
+    """
+    request_id = getattr(http_request.state, 'request_id', 'unknown')
+    
+    return {
+        "request_id": request_id,
+        "metrics": hybrid_recommendation_engine.get_metrics(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.post("/intent-keywords/reload")
+async def reload_intent_keywords(http_request: Request):
+    """
+    热更新离线意图分析关键词表
+    
+    从 INTENT_KEYWORDS_PATH 配置的JSON文件重新加载并编译关键词表，无需重启服务
+    """
+    request_id = getattr(http_request.state, 'request_id', 'unknown')
+    
+    if not settings.INTENT_KEYWORDS_PATH:
+        raise HTTPException(status_code=400, detail="未配置 INTENT_KEYWORDS_PATH")
+    
+    try:
+        version = offline_intent_analyzer.reload_from_file(settings.INTENT_KEYWORDS_PATH)
+    except (OSError, ValueError) as e:
+        logger.error(
+            f"离线意图关键词表加载失败: {str(e)}",
+            extra={"request_id": request_id}
+        )
+        raise HTTPException(status_code=400, detail=f"关键词表加载失败: {str(e)}")
+    
+    return {
+        "request_id": request_id,
+        "version": version,
+        "groups": {group: len(entries) for group, entries in offline_intent_analyzer.tables.items()},
+        "timestamp": datetime.now().isoformat()
+    }
@@ -11,6 +11,7 @@ from sqlalchemy import text
 
 from src.heimdall.models import schemas
 from src.heimdall.services.llm_service import llm_service
+from src.heimdall.services.intent_cache import intent_cache, prompt_version
 from src.heimdall.core.database import get_db
 from src.heimdall.core.config import settings
 
@@ -80,33 +81,39 @@ async def analyze_user_intent(
             logger.info(f"发送给大模型的系统提示词: {system_prompt}")
             logger.info(f"发送给大模型的消息: {messages}")
             
-            # 调用千问大模型进行意图分析
-            model_response = await llm_service.client.chat.completions.create(
-                model=settings.MODEL_NAME,
-                messages=messages,
-                temperature=0.3
-            )
-            
-            intent_result = model_response.choices[0].message.content
-            logger.info(f"千问大模型返回的意图分析结果: {intent_result}")
+            async def request_intent_analysis() -> Dict[str, Any]:
+                # 调用千问大模型进行意图分析
+                model_response = await llm_service.client.chat.completions.create(
+                    model=settings.MODEL_NAME,
+                    messages=messages,
+                    temperature=0.3
+                )
+                
+                intent_result = model_response.choices[0].message.content
+                logger.info(f"千问大模型返回的意图分析结果: {intent_result}")
+                
+                # 解析JSON结果（解析失败时抛出异常，结果不会被缓存）
+                return json.loads(intent_result)
             
-            # 解析JSON结果
-            try:
-                intent_analysis = json.loads(intent_result)
-            except json.JSONDecodeError:
-                # 如果JSON解析失败，使用默认值
-                logger.warning("意图分析结果JSON解析失败，使用默认值")
-                intent_analysis = {
-                    "intent_type": "产品购买",
-                    "confidence": 0.7,
-                    "urgency_level": 0.6,
-                    "product_categories": ["智能手表"],
-                    "price_range": "中等",
-                    "keywords": ["智能手表", "健康监测"],
-                    "analysis_summary": "用户对智能手表感兴趣",
-                    "recommendation_reason": "用户表现出对智能手表的购买兴趣，关注健康监测功能，预算适中。"
-                }
+            # 相同输入的意图分析结果走缓存，并发的相同请求只调用一次大模型
+            cache_key = intent_cache.make_key(
+                user_input, settings.MODEL_NAME, prompt_version(system_prompt), namespace="analyze"
+            )
+            intent_analysis = await intent_cache.get_or_compute(cache_key, request_intent_analysis)
                 
+        except json.JSONDecodeError:
+            # 如果JSON解析失败，使用默认值
+            logger.warning("意图分析结果JSON解析失败，使用默认值")
+            intent_analysis = {
+                "intent_type": "产品购买",
+                "confidence": 0.7,
+                "urgency_level": 0.6,
+                "product_categories": ["智能手表"],
+                "price_range": "中等",
+                "keywords": ["智能手表", "健康监测"],
+                "analysis_summary": "用户对智能手表感兴趣",
+                "recommendation_reason": "用户表现出对智能手表的购买兴趣，关注健康监测功能，预算适中。"
+            }
         except Exception as e:
             logger.error(f"千问大模型意图分析失败: {str(e)}")
             # 使用默认意图分析
@@ -6,12 +6,14 @@
 from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, text
+from sqlalchemy.exc import ProgrammingError
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 from datetime import datetime
 import logging
 
 from src.heimdall.core.database import get_db
+from src.heimdall.services.catalog_snapshot import catalog_snapshot_store
 
 logger = logging.getLogger(__name__)
 
@@ -97,6 +99,7 @@ async def create_product(
         })
         
         await db.commit()
+        catalog_snapshot_store.bump_version()
         
         product_data = result.fetchone()
         return ProductResponse(**dict(product_data._mapping))
@@ -264,6 +267,7 @@ async def update_product(
         
         result = await db.execute(query, params)
         await db.commit()
+        catalog_snapshot_store.bump_version()
         
         updated_product = result.fetchone()
         return ProductResponse(**dict(updated_product._mapping))
@@ -288,6 +292,7 @@ async def delete_product(
             raise HTTPException(status_code=404, detail="产品不存在")
         
         await db.commit()
+        catalog_snapshot_store.bump_version()
         
         return {"message": "产品删除成功", "product_id": product_id}
         
@@ -368,36 +373,75 @@ async def get_product_recommendations(
     limit: int = Query(5, ge=1, le=20, description="推荐数量"),
     db: AsyncSession = Depends(get_db)
 ):
-    """获取相关产品推荐"""
+    """获取相关产品推荐
+    
+    优先读取离线计算的 product_similarities（按主键查询）；尚未计算相似产品（或尚未执行迁移 002、
+    相似度表不存在）时回退为同类别或同品牌的高评分产品。
+    """
     try:
-        # 首先获取产品信息
-        product_query = text("SELECT category, brand, tags FROM products WHERE id = :product_id AND is_active = true")
-        product_result = await db.execute(product_query, {"product_id": product_id})
+        # 首先获取产品信息及预计算的相似产品
+        product_query = text("""
+            SELECT p.category, p.brand, p.tags, s.neighbor_ids
+            FROM products p
+            LEFT JOIN product_similarities s ON s.product_id = p.id
+            WHERE p.id = :product_id AND p.is_active = true
+        """)
+        try:
+            product_result = await db.execute(product_query, {"product_id": product_id})
+        except ProgrammingError as e:
+            # 42P01 undefined_table：相似度表尚未创建，只读取产品信息
+            if getattr(e.orig, "pgcode", None) != "42P01":
+                raise
+            await db.rollback()
+            product_result = await db.execute(text("""
+                SELECT category, brand, tags, NULL AS neighbor_ids
+                FROM products
+                WHERE id = :product_id AND is_active = true
+            """), {"product_id": product_id})
         product = product_result.fetchone()
         
         if not product:
             raise HTTPException(status_code=404, detail="产品不存在")
         
-        # 获取相关产品
-        query = text("""
-            SELECT id, name, description, price, category, brand, image_url, tags, attributes, stock_quantity, rating, review_count, is_active, created_at, updated_at
-            FROM products 
-            WHERE id != :product_id 
-            AND is_active = true 
-            AND (category = :category OR brand = :brand)
-            ORDER BY rating DESC, review_count DESC
-            LIMIT :limit
-        """)
-        
-        params = {
-            "product_id": product_id,
-            "category": product.category,
-            "brand": product.brand,
-            "limit": limit
-        }
-        
-        result = await db.execute(query, params)
-        recommendations = [ProductResponse(**dict(row._mapping)) for row in result.fetchall()]
+        if product.neighbor_ids:
+            # 按相似度顺序取出在售的相似产品
+            neighbor_ids = list(product.neighbor_ids)
+            query = text("""
+                SELECT id, name, description, price, category, brand, image_url, tags, attributes, stock_quantity, rating, review_count, is_active, created_at, updated_at
+                FROM products 
+                WHERE id = ANY(:neighbor_ids)
+                AND is_active = true
+            """)
+            result = await db.execute(query, {"neighbor_ids": neighbor_ids})
+            rows = {row.id: row for row in result.fetchall()}
+            recommendations = [
+                ProductResponse(**dict(rows[neighbor_id]._mapping))
+                for neighbor_id in neighbor_ids if neighbor_id in rows
+            ][:limit]
+        else:
+            recommendations = []
+        
+        if not recommendations:
+            # 获取相关产品
+            query = text("""
+                SELECT id, name, description, price, category, brand, image_url, tags, attributes, stock_quantity, rating, review_count, is_active, created_at, updated_at
+                FROM products 
+                WHERE id != :product_id 
+                AND is_active = true 
+                AND (category = :category OR brand = :brand)
+                ORDER BY rating DESC, review_count DESC
+                LIMIT :limit
+            """)
+            
+            params = {
+                "product_id": product_id,
+                "category": product.category,
+                "brand": product.brand,
+                "limit": limit
+            }
+            
+            result = await db.execute(query, params)
+            recommendations = [ProductResponse(**dict(row._mapping)) for row in result.fetchall()]
         
         return {
             "product_id": product_id,
@@ -5,6 +5,8 @@
 # 所有配置项都可以通过环境变量进行设置
 # ===================================================================
 
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -93,6 +95,172 @@ class Settings(BaseSettings):
     HEARTBEAT_ENABLED: bool = True
     """是否启用心跳任务"""
 
+    # --- 推荐引擎配置 ---
+    CATALOG_SNAPSHOT_MAX_STALENESS_SECONDS: float = 30.0
+    """产品目录快照的最大陈旧时间（秒），超过后读取时必须重新校验"""
+
+    HYBRID_MIN_CANDIDATES: int = 100
+    """混合推荐候选集最小规模，不足时按热门度回填"""
+
+    HYBRID_MAX_CANDIDATES: int = 1000
+    """混合推荐候选集最大规模，目录规模不超过该值时直接完整打分"""
+
+    HYBRID_RECALL_SAMPLE_RATE: float = 0.01
+    """对候选召回做完整打分对照、统计召回率的请求采样比例"""
+
+    HYBRID_PROFILE_TIMEOUT_SECONDS: float = 1.0
+    """混合推荐中加载用户行为画像的超时时间（秒），超时后使用空画像"""
+
+    HYBRID_INTENT_TIMEOUT_SECONDS: float = 3.0
+    """混合推荐中AI意图分析的超时时间（秒），超时后使用离线意图分析"""
+
+    HYBRID_CATALOG_TIMEOUT_SECONDS: float = 2.0
+    """混合推荐中加载产品目录快照的超时时间（秒），超时后使用已有快照"""
+
+    INTENT_KEYWORDS_PATH: Optional[str] = None
+    """离线意图分析关键词表JSON文件路径，未配置时使用内置关键词表"""
+
+    INTENT_CACHE_MAX_SIZE: int = 10000
+    """意图分析结果缓存的最大条目数，超出后按LRU淘汰"""
+
+    INTENT_CACHE_TTL_SECONDS: float = 600.0
+    """意图分析结果缓存的有效期（秒）"""
+
+    SIMILAR_USER_INDEX_REFRESH_SECONDS: float = 600.0
+    """相似用户LSH索引从 user_profiles 全量重新加载的周期（秒），用于同步其他工作进程保存的画像"""
+
+    PROFILE_RECONCILE_INTERVAL_SECONDS: float = 3600.0
+    """用户画像对账周期（秒），周期内有行为的用户会被全量重建画像"""
+
+    PROFILE_WORKER_CONCURRENCY: int = 4
+    """用户画像后台更新的最大并发数"""
+
+    PROFILE_WORKER_COALESCE_SECONDS: float = 0.5
+    """同一用户的画像更新信号合并窗口（秒）"""
+
+    PROFILE_WORKER_DRAIN_TIMEOUT_SECONDS: float = 10.0
+    """应用关闭时等待画像更新队列排空的最长时间（秒）"""
+
+    PROFILE_WRITE_FLUSH_SECONDS: float = 1.0
+    """用户画像写缓冲的定时刷写周期（秒）"""
+
+    PROFILE_WRITE_MAX_DIRTY: int = 1000
+    """写缓冲中脏画像达到该数量时立即刷写"""
+
+    PROFILE_WRITE_BATCH_SIZE: int = 500
+    """每条多行 upsert 语句写入的画像数"""
+
+    ITEM_SIMILARITY_TOP_N: int = 20
+    """每个产品保存的相似产品数"""
+
+    ITEM_SIMILARITY_CHUNK_SIZE: int = 5000
+    """产品相似度任务每次读取的行为日志行数"""
+
+    ITEM_SIMILARITY_WINDOW_DAYS: int = 90
+    """参与共现统计的行为日志时间窗口（天）"""
+
+    ITEM_SIMILARITY_MAX_ITEMS_PER_USER: int = 50
+    """单个用户最多计入共现统计的产品数（保留最近交互的产品）"""
+
+    ITEM_SIMILARITY_MAX_PAIRS: int = 2000000
+    """共现对数上限，超过时淘汰计数最低的共现对（保留上限的 90%）"""
+
+    ITEM_SIMILARITY_ENABLED: bool = False
+    """是否在本进程中周期计算产品相似度（多进程部署时只应在一个进程中开启）"""
+
+    ITEM_SIMILARITY_REFRESH_SECONDS: float = 86400.0
+    """产品相似度后台重新计算周期（秒）"""
+
+    MF_ARTIFACT_DIR: str = "data/matrix_factorization"
+    """矩阵分解模型产物目录（各版本子目录 + LATEST 指针）"""
+
+    MF_FACTORS: int = 32
+    """隐向量维度"""
+
+    MF_ITERATIONS: int = 10
+    """ALS 交替迭代轮数"""
+
+    MF_REGULARIZATION: float = 0.1
+    """ALS 正则化系数"""
+
+    MF_ALPHA: float = 2.0
+    """置信度系数：c = 1 + alpha * 行为权重之和"""
+
+    MF_WINDOW_DAYS: int = 90
+    """参与训练的行为数据时间窗口（天）"""
+
+    MF_TRAINER_ENABLED: bool = False
+    """是否在本进程中周期训练（多进程部署时只应在一个进程中开启）"""
+
+    MF_TRAIN_INTERVAL_SECONDS: float = 86400.0
+    """矩阵分解周期训练间隔（秒）"""
+
+    MF_RELOAD_CHECK_SECONDS: float = 60.0
+    """检查模型产物新版本的周期（秒）"""
+
+    ANN_MIN_VECTORS: int = 20000
+    """隐向量数达到该规模时训练阶段构建 IVF 近似最近邻索引，否则在线精确打分"""
+
+    ANN_N_PROBE: int = 16
+    """IVF 索引查询时探测的倒排列表数（越大召回越高、延迟越高）"""
+
+    SIMILAR_USERS_BACKEND: str = "lsh"
+    """相似用户召回方式：lsh（画像类别/品牌集合）或 ann（矩阵分解用户隐向量，用户不在模型中时回退 lsh）"""
+
+    POPULARITY_HALF_LIFE_HOURS: float = 72.0
+    """产品热度的衰减半衰期（小时）"""
+
+    POPULARITY_WINDOW_DAYS: int = 30
+    """全量加载产品热度时读取的行为日志时间窗口（天）"""
+
+    POPULARITY_REFRESH_SECONDS: float = 60.0
+    """产品热度后台增量刷新周期（秒）"""
+
+    POPULARITY_REBUILD_SECONDS: float = 86400.0
+    """产品热度全量重新加载周期（秒）"""
+
+    POPULARITY_TOP_N: int = 100
+    """内存中预先排好的热门榜单长度（总榜与每个类别）"""
+
+    POPULARITY_CHUNK_SIZE: int = 5000
+    """产品热度增量刷新每次读取的行为日志行数"""
+
+    POPULARITY_BEHAVIOR_WEIGHT: float = 0.5
+    """混合推荐热门度分数中行为热度所占比例（其余为评分），热度未加载时只用评分"""
+
+    BEHAVIOR_INGEST_MAX_EVENTS: int = 10000
+    """批量记录行为接口单次请求的最大事件数"""
+
+    BEHAVIOR_INGEST_COPY_BATCH_SIZE: int = 10000
+    """批量写入行为时每次 COPY 的行数"""
+
+    BEHAVIOR_NDJSON_MAX_LINE_BYTES: int = 1048576
+    """NDJSON 流式写入时单行的最大字节数，超过的行被拒绝"""
+
+    BEHAVIOR_QUEUE_MAX_SIZE: int = 50000
+    """行为写入队列容量，队列满时记录行为接口返回 503"""
+
+    BEHAVIOR_QUEUE_BATCH_SIZE: int = 1000
+    """行为写入队列每批写入的最大事件数"""
+
+    BEHAVIOR_QUEUE_FLUSH_SECONDS: float = 0.5
+    """行为写入队列凑批的最长等待时间（秒）"""
+
+    BEHAVIOR_QUEUE_DRAIN_TIMEOUT_SECONDS: float = 10.0
+    """关闭时等待行为写入队列排空的最长时间（秒）"""
+
+    BEHAVIOR_QUERY_WINDOW_DAYS: int = 90
+    """推荐查询读取用户行为的时间窗口（天），按 created_at 过滤以只扫描最近的分区"""
+
+    BEHAVIOR_PARTITION_MONTHS_AHEAD: int = 3
+    """行为表提前创建的未来月分区数"""
+
+    BEHAVIOR_RETENTION_MONTHS: int = 13
+    """原始行为日志保留的月数，更早的分区汇总到 user_behavior_rollups 后删除"""
+
+    BEHAVIOR_PARTITION_MAINTENANCE_SECONDS: float = 86400.0
+    """行为表分区维护周期（秒）"""
+
     # --- 日志配置 ---
     LOG_LEVEL: str = "INFO"
     """日志级别：DEBUG, INFO, WARNING, ERROR, CRITICAL"""
@@ -112,6 +112,64 @@ async def lifespan(app: FastAPI):
     heartbeat = asyncio.create_task(heartbeat_task())
     logger.info("✅ 心跳日志后台任务已启动。")
 
+    from src.heimdall.core.database import AsyncSessionLocal
+    from src.heimdall.services.catalog_snapshot import catalog_snapshot_store
+    catalog_refresher = asyncio.create_task(
+        catalog_snapshot_store.run_refresher(AsyncSessionLocal)
+    )
+    logger.info("✅ 产品目录快照后台刷新任务已启动。")
+
+    from src.heimdall.services.recommendation_engine import recommendation_engine
+    profile_reconciler = asyncio.create_task(
+        recommendation_engine.run_profile_reconciler(AsyncSessionLocal)
+    )
+    logger.info("✅ 用户画像对账后台任务已启动。")
+
+    similar_user_refresher = asyncio.create_task(
+        recommendation_engine.similar_user_index.run_refresher(AsyncSessionLocal)
+    )
+    logger.info("✅ 相似用户索引后台刷新任务已启动。")
+
+    from src.heimdall.core.config import settings
+    from src.heimdall.services.item_similarity import item_similarity_job
+    item_similarity_refresher = None
+    if settings.ITEM_SIMILARITY_ENABLED:
+        item_similarity_refresher = asyncio.create_task(
+            item_similarity_job.run_refresher(AsyncSessionLocal)
+        )
+        logger.info("✅ 产品相似度后台计算任务已启动。")
+
+    from src.heimdall.services.popularity import popularity_service
+    popularity_refresher = asyncio.create_task(
+        popularity_service.run_refresher(AsyncSessionLocal)
+    )
+    logger.info("✅ 产品热度后台刷新任务已启动。")
+
+    from src.heimdall.services.behavior_partitions import behavior_partition_manager
+    partition_maintainer = asyncio.create_task(
+        behavior_partition_manager.run_scheduler(AsyncSessionLocal)
+    )
+    logger.info("✅ 行为表分区维护任务已启动。")
+
+    from src.heimdall.services.matrix_factorization import MatrixFactorizationTrainer
+    mf_trainer = None
+    if settings.MF_TRAINER_ENABLED:
+        mf_trainer = asyncio.create_task(
+            MatrixFactorizationTrainer(recommendation_engine.behavior_weights).run_trainer(AsyncSessionLocal)
+        )
+        logger.info("✅ 矩阵分解周期训练任务已启动。")
+
+    recommendation_engine.profile_write_buffer.start(AsyncSessionLocal)
+    logger.info("✅ 用户画像写缓冲已启动。")
+
+    from src.heimdall.services.profile_worker import profile_rebuild_worker
+    profile_rebuild_worker.start()
+    logger.info("✅ 用户画像后台更新队列已启动。")
+
+    from src.heimdall.services.behavior_queue import behavior_write_queue
+    behavior_write_queue.start(AsyncSessionLocal)
+    logger.info("✅ 行为写入队列已启动。")
+
     logger.info("🎉 企业级海姆达尔应用启动完成！")
     
     yield  # FastAPI应用在此处运行
@@ -120,11 +178,66 @@ async def lifespan(app: FastAPI):
     logger.info("🔄 正在关闭企业级海姆达尔应用...")
     
     # 1. 停止后台任务
+    # 先写完行为队列中的事件（写入后会通知画像更新队列），再排空画像更新队列
+    await behavior_write_queue.close()
+    logger.info("✅ 行为写入队列已排空。")
+
+    await profile_rebuild_worker.drain()
+    logger.info("✅ 用户画像后台更新队列已排空。")
+
+    # 画像更新队列排空后再刷写写缓冲，保证排空期间保存的画像也能落库
+    await recommendation_engine.profile_write_buffer.close()
+    logger.info("✅ 用户画像写缓冲已刷写。")
+
     heartbeat.cancel()
     try:
         await heartbeat
     except asyncio.CancelledError:
         logger.info("✅ 心跳日志后台任务已成功取消。")
+
+    catalog_refresher.cancel()
+    try:
+        await catalog_refresher
+    except asyncio.CancelledError:
+        logger.info("✅ 产品目录快照后台刷新任务已成功取消。")
+
+    profile_reconciler.cancel()
+    try:
+        await profile_reconciler
+    except asyncio.CancelledError:
+        logger.info("✅ 用户画像对账后台任务已成功取消。")
+
+    similar_user_refresher.cancel()
+    try:
+        await similar_user_refresher
+    except asyncio.CancelledError:
+        logger.info("✅ 相似用户索引后台刷新任务已成功取消。")
+
+    if item_similarity_refresher is not None:
+        item_similarity_refresher.cancel()
+        try:
+            await item_similarity_refresher
+        except asyncio.CancelledError:
+            logger.info("✅ 产品相似度后台计算任务已成功取消。")
+
+    popularity_refresher.cancel()
+    try:
+        await popularity_refresher
+    except asyncio.CancelledError:
+        logger.info("✅ 产品热度后台刷新任务已成功取消。")
+
+    partition_maintainer.cancel()
+    try:
+        await partition_maintainer
+    except asyncio.CancelledError:
+        logger.info("✅ 行为表分区维护任务已成功取消。")
+
+    if mf_trainer is not None:
+        mf_trainer.cancel()
+        try:
+            await mf_trainer
+        except asyncio.CancelledError:
+            logger.info("✅ 矩阵分解周期训练任务已成功取消。")
     
     # 2. 生成错误报告
     try:
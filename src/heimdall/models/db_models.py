@@ -1,7 +1,7 @@
 # --- START OF FILE heimdall/models/db_models.py (针对广告推荐场景优化) ---
 
 import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, JSON, func
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Numeric, JSON, Computed, func
 from src.heimdall.core.database import Base
 
 
@@ -47,6 +47,18 @@ class UserBehavior(Base):
     # 行为类型和内容
     behavior_type = Column(String(50), nullable=False)  # 'view', 'search', 'click', 'purchase'
     behavior_data = Column(JSON, nullable=False)  # 行为的具体数据
+
+    # 从 behavior_data 派生的类型化列（数据库生成列，见 sql/004_typed_behavior_columns.sql）
+    product_id = Column(Integer, Computed(
+        "CASE WHEN behavior_data->>'product_id' ~ '^[0-9]{1,9}$' "
+        "THEN (behavior_data->>'product_id')::integer END", persisted=True
+    ))
+    category = Column(Text, Computed("behavior_data->>'category'", persisted=True))
+    brand = Column(Text, Computed("behavior_data->>'brand'", persisted=True))
+    price = Column(Numeric, Computed(
+        "CASE WHEN behavior_data->>'price' ~ '^-?[0-9]{1,12}(\\.[0-9]+)?$' "
+        "THEN (behavior_data->>'price')::numeric END", persisted=True
+    ))
     
     # 意图分析结果
     detected_intent = Column(String(255), nullable=True)
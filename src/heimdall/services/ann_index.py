@@ -0,0 +1,247 @@
+"""
+近似最近邻索引（IVF-flat）
+用 k-means 把向量划分到 n_lists 个倒排列表，查询时只扫描与查询向量最接近的 n_probe 个列表；
+纯 NumPy 实现，支持构建、增量添加以及保存后内存映射加载
+"""
+
+import json
+import logging
+import os
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("heimdall.ann_index")
+
+# 分块计算向量到质心的打分，约束内存占用
+ASSIGN_CHUNK = 65536
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def kmeans(
+    vectors: np.ndarray,
+    n_clusters: int,
+    iterations: int = 10,
+    sample_size: int = 50000,
+    seed: int = 0
+) -> np.ndarray:
+    """在采样后的向量上做 k-means（L2），返回质心；空簇用随机样本重新初始化"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = assign(vectors, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """每个向量最近（L2）的质心下标：argmax(x·c - |c|²/2)"""
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK], dtype=np.float32)
+        labels[start:start + ASSIGN_CHUNK] = np.argmax(chunk @ centroids.T - half_norms, axis=1)
+    return labels
+
+
+class IVFFlatIndex:
+    """
+    IVF-flat 索引（内积打分）
+
+    - 向量按所属列表连续存放（offsets 为各列表的起止位置），保存后可以内存映射加载
+    - add 添加的向量先放入增量区，查询时一并扫描增量区中属于被探测列表的向量；compact 合并增量区
+    - normalize=True 时向量与查询先归一化，内积即余弦相似度
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        vectors: np.ndarray,
+        ids: np.ndarray,
+        offsets: np.ndarray,
+        n_probe: int = 16,
+        normalize: bool = False
+    ):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.n_probe = n_probe
+        self.normalize = normalize
+        self._pending_vectors: List[np.ndarray] = []
+        self._pending_ids: List[np.ndarray] = []
+        self._pending_lists: List[np.ndarray] = []
+        self._pending_cache: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.ids) + sum(len(ids) for ids in self._pending_ids)
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        ids: Optional[Sequence[int]] = None,
+        n_lists: Optional[int] = None,
+        n_probe: int = 16,
+        normalize: bool = False,
+        kmeans_iterations: int = 10,
+        seed: int = 0
+    ) -> "IVFFlatIndex":
+        """构建索引；n_lists 默认取 sqrt(N)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if normalize:
+            vectors = _normalize(vectors)
+        ids = np.arange(len(vectors), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(vectors))))
+        centroids = kmeans(vectors, n_lists, iterations=kmeans_iterations, seed=seed)
+        labels = assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=len(centroids)), out=offsets[1:])
+        return cls(centroids, vectors[order], ids[order], offsets, n_probe=n_probe, normalize=normalize)
+
+    def add(self, vectors: np.ndarray, ids: Sequence[int]) -> None:
+        """增量添加向量（分配到已有的质心，不重新聚类）"""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if self.normalize:
+            vectors = _normalize(vectors)
+        self._pending_vectors.append(vectors)
+        self._pending_ids.append(np.asarray(ids, dtype=np.int64))
+        self._pending_lists.append(assign(vectors, self.centroids))
+        self._pending_cache = None
+
+    def _pending(self) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        if not self._pending_ids:
+            return None
+        if self._pending_cache is None:
+            self._pending_cache = (
+                np.concatenate(self._pending_vectors),
+                np.concatenate(self._pending_ids),
+                np.concatenate(self._pending_lists),
+            )
+        return self._pending_cache
+
+    def compact(self) -> None:
+        """把增量区合并进按列表连续存放的主存储"""
+        pending = self._pending()
+        if pending is None:
+            return
+        pending_vectors, pending_ids, pending_lists = pending
+        main_lists = np.repeat(np.arange(self.n_lists), np.diff(self.offsets))
+        labels = np.concatenate([main_lists, pending_lists])
+        order = np.argsort(labels, kind="stable")
+        self.vectors = np.concatenate([np.asarray(self.vectors), pending_vectors])[order]
+        self.ids = np.concatenate([np.asarray(self.ids), pending_ids])[order]
+        np.cumsum(np.bincount(labels, minlength=self.n_lists), out=self.offsets[1:])
+        self._pending_vectors, self._pending_ids, self._pending_lists = [], [], []
+        self._pending_cache = None
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        n_probe: Optional[int] = None,
+        exclude: Sequence[int] = ()
+    ) -> List[Tuple[int, float]]:
+        """返回内积最大的 k 个 (id, 分数)，分数降序、同分按 id 升序"""
+        query = np.asarray(query, dtype=np.float32)
+        if self.normalize:
+            query = _normalize(query)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        probed = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+
+        scores_parts, id_parts = [], []
+        for list_id in probed:
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if end > start:
+                scores_parts.append(self.vectors[start:end] @ query)
+                id_parts.append(self.ids[start:end])
+        pending = self._pending()
+        if pending is not None:
+            in_probed = np.isin(pending[2], probed)
+            if in_probed.any():
+                scores_parts.append(pending[0][in_probed] @ query)
+                id_parts.append(pending[1][in_probed])
+        if not scores_parts:
+            return []
+
+        scores = np.concatenate(scores_parts)
+        ids = np.concatenate(id_parts)
+        if len(exclude):
+            keep = ~np.isin(ids, np.asarray(exclude, dtype=np.int64))
+            scores, ids = scores[keep], ids[keep]
+        k = min(k, len(ids))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((ids[top], -scores[top]))]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def save(self, directory: str) -> None:
+        """保存到目录（先合并增量区）"""
+        self.compact()
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+        np.save(os.path.join(directory, "vectors.npy"), np.asarray(self.vectors))
+        np.save(os.path.join(directory, "ids.npy"), np.asarray(self.ids))
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+        with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"type": "ivf_flat", "n_probe": self.n_probe, "normalize": self.normalize}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "IVFFlatIndex":
+        """从目录加载；mmap=True 时向量与 id 以内存映射方式只读访问"""
+        with open(os.path.join(directory, "index.json"), "r", encoding="utf-8") as f:
+            meta: Dict[str, Any] = json.load(f)
+        mmap_mode = "r" if mmap else None
+        return cls(
+            centroids=np.load(os.path.join(directory, "centroids.npy")),
+            vectors=np.load(os.path.join(directory, "vectors.npy"), mmap_mode=mmap_mode),
+            ids=np.load(os.path.join(directory, "ids.npy"), mmap_mode=mmap_mode),
+            offsets=np.load(os.path.join(directory, "offsets.npy")),
+            n_probe=meta.get("n_probe", 16),
+            normalize=meta.get("normalize", False),
+        )
+
+
+def brute_force_search(
+    vectors: np.ndarray,
+    query: np.ndarray,
+    k: int,
+    normalize: bool = False
+) -> List[Tuple[int, float]]:
+    """精确 top-k（用于评估索引召回率）"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    query = np.asarray(query, dtype=np.float32)
+    if normalize:
+        vectors, query = _normalize(vectors), _normalize(query)
+    scores = vectors @ query
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.lexsort((top, -scores[top]))]
+    return [(int(i), float(scores[i])) for i in top]
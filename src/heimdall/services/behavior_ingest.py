@@ -0,0 +1,349 @@
+"""
+用户行为批量写入
+客户端 SDK 缓冲的一批行为事件在一次请求中整体校验，合格的事件通过 asyncpg 的 COPY 协议
+一次性写入 user_behaviors，不合格的事件按下标返回拒绝原因；
+大批量回填使用 NDJSON 流式写入，边读取请求体边逐行解析、凑满一批即 COPY，内存占用与上传大小无关
+"""
+
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Type, AsyncIterator, Callable
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import text
+
+from src.heimdall.core.config import settings
+
+logger = logging.getLogger("heimdall.behavior_ingest")
+
+# 有效的行为类型（与单条 /record-behavior 的校验规则一致）
+VALID_BEHAVIOR_TYPES = ('search', 'view', 'click', 'purchase')
+
+# COPY 写入的列，与单条记录行为的 INSERT 一致
+COPY_COLUMNS = ('user_id', 'session_id', 'behavior_type', 'behavior_data', 'created_at')
+
+# user_id / session_id 列宽
+MAX_ID_LENGTH = 255
+
+BehaviorRecord = Tuple[str, str, str, Dict[str, Any], datetime]
+
+
+@dataclass
+class IngestReject:
+    """被拒绝的事件：在请求中的下标与原因"""
+    index: int
+    errors: List[str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"index": self.index, "errors": self.errors}
+
+
+@dataclass
+class IngestResult:
+    """一次批量写入的结果"""
+    accepted: int
+    rejects: List[IngestReject]
+    records: List[BehaviorRecord]
+    validate_seconds: float = 0.0
+    write_seconds: float = 0.0
+
+    @property
+    def rejected(self) -> int:
+        return len(self.rejects)
+
+
+@dataclass
+class IngestStats:
+    """批量写入指标"""
+    batches: int = 0
+    accepted: int = 0
+    rejected: int = 0
+    copy_batches: int = 0
+    insert_batches: int = 0
+    write_seconds: float = 0.0
+
+
+@dataclass
+class StreamIngestResult:
+    """一次流式写入的结果：只保留计数与前若干个拒绝样例"""
+    lines: int = 0
+    accepted: int = 0
+    rejected: int = 0
+    batches: int = 0
+    reject_samples: List[IngestReject] = field(default_factory=list)
+
+
+class StreamIngestAborted(Exception):
+    """流式写入中途失败；result 为失败前已提交的统计"""
+
+    def __init__(self, message: str, result: StreamIngestResult):
+        super().__init__(message)
+        self.result = result
+
+
+def _format_errors(error: ValidationError) -> List[str]:
+    return [
+        f"{'.'.join(str(part) for part in item['loc']) or 'event'}: {item['msg']}"
+        for item in error.errors(include_url=False)
+    ]
+
+
+def validate_event(
+    raw: Any,
+    model: Type[BaseModel],
+    received_at: datetime
+) -> Tuple[Optional[BehaviorRecord], List[str]]:
+    """
+    按 model（UserBehaviorRequest 及其子类）的字段规则校验单个事件，返回 (写入记录, 错误列表)
+
+    除模型字段外还检查行为类型与 ID 长度；事件未带 created_at 时使用 received_at。
+    """
+    try:
+        event = model.model_validate(raw)
+    except ValidationError as e:
+        return None, _format_errors(e)
+
+    errors = []
+    if event.behavior_type not in VALID_BEHAVIOR_TYPES:
+        errors.append(f"behavior_type: 无效的行为类型 {event.behavior_type!r}，有效类型: {list(VALID_BEHAVIOR_TYPES)}")
+    if not event.user_id or len(event.user_id) > MAX_ID_LENGTH:
+        errors.append(f"user_id: 长度必须在 1~{MAX_ID_LENGTH} 之间")
+    if len(event.session_id) > MAX_ID_LENGTH:
+        errors.append(f"session_id: 长度不能超过 {MAX_ID_LENGTH}")
+    if errors:
+        return None, errors
+
+    created_at = getattr(event, "created_at", None) or received_at
+    if created_at.tzinfo is not None:
+        # 与单条记录行为一致，统一为本地时间的 naive datetime
+        created_at = created_at.astimezone().replace(tzinfo=None)
+    return (
+        event.user_id,
+        event.session_id,
+        event.behavior_type,
+        event.behavior_data,
+        created_at,
+    ), []
+
+
+def encode_record(record: BehaviorRecord) -> Tuple[str, str, str, str, datetime]:
+    """行为数据序列化为 JSON 文本（COPY 与 INSERT 都以文本写入 JSONB 列）"""
+    user_id, session_id, behavior_type, behavior_data, created_at = record
+    return user_id, session_id, behavior_type, json.dumps(behavior_data, ensure_ascii=False, default=str), created_at
+
+
+def validate_events(
+    raw_events: Sequence[Any],
+    model: Type[BaseModel],
+    received_at: Optional[datetime] = None,
+    start_index: int = 0
+) -> Tuple[List[BehaviorRecord], List[IngestReject]]:
+    """整批校验，返回 (合格记录, 拒绝列表)；下标从 start_index 开始计"""
+    received_at = received_at or datetime.now()
+    records: List[BehaviorRecord] = []
+    rejects: List[IngestReject] = []
+    for offset, raw in enumerate(raw_events):
+        record, errors = validate_event(raw, model, received_at)
+        if record is None:
+            rejects.append(IngestReject(start_index + offset, errors))
+        else:
+            records.append(record)
+    return records, rejects
+
+
+async def iter_ndjson_lines(
+    chunks: AsyncIterator[bytes],
+    max_line_bytes: int
+) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """
+    把字节流按换行切分为 (行号, 行内容)，行号从1开始
+
+    只缓存当前未结束的一行；超过 max_line_bytes 的行丢弃其内容并以 None 产出。
+    """
+    buffer = bytearray()
+    line_no = 0
+    oversized = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                if not oversized:
+                    buffer += chunk[start:]
+                    if len(buffer) > max_line_bytes:
+                        oversized = True
+                        buffer.clear()
+                break
+            line_no += 1
+            if not oversized:
+                buffer += chunk[start:end]
+            if oversized or len(buffer) > max_line_bytes:
+                yield line_no, None
+            else:
+                yield line_no, bytes(buffer)
+            buffer.clear()
+            oversized = False
+            start = end + 1
+    if buffer or oversized:
+        yield line_no + 1, None if oversized else bytes(buffer)
+
+
+async def _driver_connection(db: Any) -> Optional[Any]:
+    """取得会话底层的 asyncpg 连接；不是 asyncpg 驱动时返回 None"""
+    try:
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+    except AttributeError:
+        return None
+    driver = getattr(raw, "driver_connection", None)
+    if driver is None or not hasattr(driver, "copy_records_to_table"):
+        return None
+    return driver
+
+
+class BehaviorIngestor:
+    """
+    行为事件批量写入器
+
+    - asyncpg 驱动下用 COPY（copy_records_to_table）写入，其他驱动回退为 executemany 批量 INSERT
+    - 写入与提交由调用方的会话完成，一批事件一次提交
+    """
+
+    def __init__(self, copy_batch_size: Optional[int] = None):
+        self.copy_batch_size = (
+            copy_batch_size if copy_batch_size is not None else settings.BEHAVIOR_INGEST_COPY_BATCH_SIZE
+        )
+        self.stats = IngestStats()
+
+    async def write(self, db: Any, records: Sequence[BehaviorRecord]) -> None:
+        """写入已校验的记录（不提交）"""
+        if not records:
+            return
+        started = time.perf_counter()
+        driver = await _driver_connection(db)
+        for start in range(0, len(records), self.copy_batch_size):
+            batch = [encode_record(record) for record in records[start:start + self.copy_batch_size]]
+            if driver is not None:
+                await driver.copy_records_to_table('user_behaviors', records=batch, columns=COPY_COLUMNS)
+                self.stats.copy_batches += 1
+            else:
+                await db.execute(text("""
+                    INSERT INTO user_behaviors (user_id, session_id, behavior_type, behavior_data, created_at)
+                    VALUES (:user_id, :session_id, :behavior_type, CAST(:behavior_data AS JSONB), :created_at)
+                """), [dict(zip(COPY_COLUMNS, record)) for record in batch])
+                self.stats.insert_batches += 1
+        self.stats.write_seconds += time.perf_counter() - started
+
+    async def ingest(
+        self,
+        db: Any,
+        raw_events: Sequence[Any],
+        model: Type[BaseModel]
+    ) -> IngestResult:
+        """校验并写入一批事件，合格事件一次提交；写入失败时回滚并抛出异常"""
+        started = time.perf_counter()
+        records, rejects = validate_events(raw_events, model)
+        validated = time.perf_counter()
+        try:
+            await self.write(db, records)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        self.stats.batches += 1
+        self.stats.accepted += len(records)
+        self.stats.rejected += len(rejects)
+        return IngestResult(
+            accepted=len(records),
+            rejects=rejects,
+            records=records,
+            validate_seconds=validated - started,
+            write_seconds=time.perf_counter() - validated,
+        )
+
+    async def ingest_ndjson(
+        self,
+        db: Any,
+        chunks: AsyncIterator[bytes],
+        model: Type[BaseModel],
+        max_line_bytes: Optional[int] = None,
+        max_reject_samples: int = 100,
+        on_batch: Optional[Callable[[List[BehaviorRecord]], None]] = None
+    ) -> StreamIngestResult:
+        """
+        流式写入 NDJSON：逐行解析与校验，每凑满 copy_batch_size 条写入并提交一次
+
+        空行忽略；拒绝原因只保留前 max_reject_samples 个（下标为行号）。
+        写入失败时回滚当前批次并抛出 StreamIngestAborted（此前的批次已提交）。
+        """
+        max_line_bytes = (
+            max_line_bytes if max_line_bytes is not None else settings.BEHAVIOR_NDJSON_MAX_LINE_BYTES
+        )
+        result = StreamIngestResult()
+        received_at = datetime.now()
+        records: List[BehaviorRecord] = []
+
+        def reject(line_no: int, errors: List[str]) -> None:
+            result.rejected += 1
+            if len(result.reject_samples) < max_reject_samples:
+                result.reject_samples.append(IngestReject(line_no, errors))
+
+        async def flush() -> None:
+            try:
+                await self.write(db, records)
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                raise StreamIngestAborted(f"第 {result.batches + 1} 批写入失败: {e}", result) from e
+            result.accepted += len(records)
+            result.batches += 1
+            self.stats.accepted += len(records)
+            if on_batch is not None:
+                on_batch(records)
+
+        async for line_no, line in iter_ndjson_lines(chunks, max_line_bytes):
+            result.lines = line_no
+            if line is None:
+                reject(line_no, [f"line: 超过最大长度 {max_line_bytes} 字节"])
+                continue
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw = json.loads(line)
+            except ValueError as e:
+                reject(line_no, [f"line: 不是有效的JSON: {e}"])
+                continue
+            record, errors = validate_event(raw, model, received_at)
+            if record is None:
+                reject(line_no, errors)
+                continue
+            records.append(record)
+            if len(records) >= self.copy_batch_size:
+                await flush()
+                records = []
+
+        if records:
+            await flush()
+        self.stats.batches += 1
+        self.stats.rejected += result.rejected
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        """导出指标摘要"""
+        return {
+            "batches": self.stats.batches,
+            "accepted": self.stats.accepted,
+            "rejected": self.stats.rejected,
+            "copy_batches": self.stats.copy_batches,
+            "insert_batches": self.stats.insert_batches,
+            "write_events_per_second": round(self.stats.accepted / self.stats.write_seconds, 1)
+            if self.stats.write_seconds else 0.0,
+        }
+
+
+# 全局行为批量写入器
+behavior_ingestor = BehaviorIngestor()
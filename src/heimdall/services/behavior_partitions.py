@@ -0,0 +1,237 @@
+"""
+用户行为表分区维护
+user_behaviors 按 created_at 以月为单位做范围分区（见 sql/003_partition_user_behaviors.sql），
+后台任务提前创建未来几个月的分区；超过保留期的分区先按天汇总到 user_behavior_rollups，
+再在同一事务中摘除并删除，原始行为日志的大小只与保留期有关
+"""
+
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional, Callable, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+
+from src.heimdall.core.config import settings
+
+logger = logging.getLogger("heimdall.behavior_partitions")
+
+PARENT_TABLE = "user_behaviors"
+ROLLUP_TABLE = "user_behavior_rollups"
+
+# 月分区命名：user_behaviors_pYYYYMM
+PARTITION_NAME_PATTERN = re.compile(r"^user_behaviors_p(\d{4})(\d{2})$")
+
+# 多实例部署时只有一个实例执行维护（事务级 advisory lock 的键）
+MAINTENANCE_LOCK_KEY = 7_302_024_003
+
+
+def behavior_window_start(days: Optional[int] = None, now: Optional[datetime] = None) -> datetime:
+    """
+    推荐查询读取行为日志的起始时间（默认 BEHAVIOR_QUERY_WINDOW_DAYS 天前）
+
+    查询带上 created_at >= 该时间后，分区表只扫描最近的几个月分区。
+    """
+    days = days if days is not None else settings.BEHAVIOR_QUERY_WINDOW_DAYS
+    return (now or datetime.now()) - timedelta(days=days)
+
+
+def month_start(value: Union[date, datetime]) -> date:
+    """所在月份的第一天"""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    """月份加减（结果为当月第一天）"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    """月份对应的分区表名"""
+    return f"{PARENT_TABLE}_p{month.year:04d}{month.month:02d}"
+
+
+def parse_partition_month(name: str) -> Optional[date]:
+    """从分区表名解析月份；不是月分区（如默认分区）时返回 None"""
+    match = PARTITION_NAME_PATTERN.match(name)
+    if match is None:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def partition_ddl(month: date) -> str:
+    """创建月分区的语句，分区边界为 UTC 月初（与迁移脚本一致）"""
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT_TABLE} "
+        f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+        f"TO ('{add_months(month, 1).isoformat()} 00:00:00+00')"
+    )
+
+
+def rollup_sql(partition: str) -> str:
+    """把一个分区按 (天, 用户, 行为类型, 产品, 类别, 品牌) 汇总并累加到汇总表"""
+    return f"""
+        INSERT INTO {ROLLUP_TABLE} (day, user_id, behavior_type, product_id, category, brand, event_count)
+        SELECT
+            (created_at AT TIME ZONE 'UTC')::date,
+            user_id,
+            behavior_type,
+            COALESCE(behavior_data->>'product_id', ''),
+            COALESCE(behavior_data->>'category', ''),
+            COALESCE(behavior_data->>'brand', ''),
+            COUNT(*)
+        FROM {partition}
+        GROUP BY 1, 2, 3, 4, 5, 6
+        ON CONFLICT (day, user_id, behavior_type, product_id, category, brand)
+        DO UPDATE SET event_count = {ROLLUP_TABLE}.event_count + EXCLUDED.event_count
+    """
+
+
+@dataclass
+class PartitionMaintenanceStats:
+    """分区维护指标"""
+    runs: int = 0
+    skipped: int = 0
+    failures: int = 0
+    partitions_created: int = 0
+    partitions_dropped: int = 0
+    rollup_rows: int = 0
+    last_run_seconds: float = 0.0
+
+
+class BehaviorPartitionManager:
+    """
+    user_behaviors 月分区维护
+
+    - ensure_partitions: 创建当月到 months_ahead 个月之后的分区（已存在的跳过）
+    - rollup_and_drop: 早于保留期的分区先汇总到 user_behavior_rollups，再摘除并删除
+    - run_maintenance: 在一个事务中完成以上两步；表未分区（未执行迁移 003）或其他实例正在维护时跳过
+    """
+
+    def __init__(self, months_ahead: Optional[int] = None, retention_months: Optional[int] = None):
+        self.months_ahead = (
+            months_ahead if months_ahead is not None else settings.BEHAVIOR_PARTITION_MONTHS_AHEAD
+        )
+        self.retention_months = (
+            retention_months if retention_months is not None else settings.BEHAVIOR_RETENTION_MONTHS
+        )
+        self.stats = PartitionMaintenanceStats()
+        self.last_run_at: Optional[datetime] = None
+
+    async def is_partitioned(self, db: AsyncSession) -> bool:
+        """user_behaviors 是否已是分区表"""
+        result = await db.execute(text("""
+            SELECT 1 FROM pg_partitioned_table
+            WHERE partrelid = to_regclass(:table)
+        """), {"table": PARENT_TABLE})
+        return result.fetchone() is not None
+
+    async def list_partitions(self, db: AsyncSession) -> List[date]:
+        """现有月分区的月份（升序，不含默认分区）"""
+        result = await db.execute(text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:table)
+        """), {"table": PARENT_TABLE})
+        months = [parse_partition_month(row[0]) for row in result.fetchall()]
+        return sorted(month for month in months if month is not None)
+
+    async def ensure_partitions(self, db: AsyncSession, today: date, existing: List[date]) -> List[date]:
+        """创建缺失的当前及未来月分区，返回新建的月份（不提交）"""
+        current = month_start(today)
+        existing_set = set(existing)
+        created = []
+        for offset in range(self.months_ahead + 1):
+            month = add_months(current, offset)
+            if month in existing_set:
+                continue
+            await db.execute(text(partition_ddl(month)))
+            created.append(month)
+        return created
+
+    async def rollup_and_drop(self, db: AsyncSession, today: date, existing: List[date]) -> List[date]:
+        """汇总并删除早于保留期的分区，返回删除的月份（不提交）"""
+        cutoff = add_months(month_start(today), -self.retention_months)
+        dropped = []
+        for month in existing:
+            if month >= cutoff:
+                break
+            name = partition_name(month)
+            result = await db.execute(text(rollup_sql(name)))
+            self.stats.rollup_rows += max(result.rowcount or 0, 0)
+            await db.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+            await db.execute(text(f"DROP TABLE {name}"))
+            dropped.append(month)
+        return dropped
+
+    async def run_maintenance(self, db: AsyncSession, today: Optional[date] = None) -> Dict[str, Any]:
+        """执行一次分区维护（一个事务），失败时回滚并抛出异常"""
+        started = time.perf_counter()
+        today = today or datetime.now().date()
+        try:
+            acquired = (await db.execute(
+                text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}
+            )).scalar()
+            if not acquired or not await self.is_partitioned(db):
+                await db.rollback()
+                self.stats.skipped += 1
+                return {"skipped": True, "created": [], "dropped": []}
+
+            existing = await self.list_partitions(db)
+            created = await self.ensure_partitions(db, today, existing)
+            dropped = await self.rollup_and_drop(db, today, existing)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            self.stats.failures += 1
+            raise
+
+        self.stats.runs += 1
+        self.stats.partitions_created += len(created)
+        self.stats.partitions_dropped += len(dropped)
+        self.stats.last_run_seconds = time.perf_counter() - started
+        self.last_run_at = datetime.now()
+        return {
+            "skipped": False,
+            "created": [partition_name(month) for month in created],
+            "dropped": [partition_name(month) for month in dropped],
+        }
+
+    async def run_scheduler(self, session_factory: Callable[[], Any]) -> None:
+        """后台任务：启动后立即维护一次，之后按 BEHAVIOR_PARTITION_MAINTENANCE_SECONDS 周期执行"""
+        while True:
+            try:
+                async with session_factory() as session:
+                    result = await self.run_maintenance(session)
+                if result["created"] or result["dropped"]:
+                    logger.info(
+                        f"行为表分区维护完成: 新建 {result['created']}，汇总并删除 {result['dropped']}"
+                    )
+            except Exception as e:
+                logger.error(f"行为表分区维护失败: {e}")
+            await asyncio.sleep(settings.BEHAVIOR_PARTITION_MAINTENANCE_SECONDS)
+
+    def summary(self) -> Dict[str, Any]:
+        """导出指标摘要"""
+        return {
+            "months_ahead": self.months_ahead,
+            "retention_months": self.retention_months,
+            "runs": self.stats.runs,
+            "skipped": self.stats.skipped,
+            "failures": self.stats.failures,
+            "partitions_created": self.stats.partitions_created,
+            "partitions_dropped": self.stats.partitions_dropped,
+            "rollup_rows": self.stats.rollup_rows,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_run_seconds": round(self.stats.last_run_seconds, 4),
+        }
+
+
+# 全局行为表分区维护器（在应用 lifespan 中启动周期任务）
+behavior_partition_manager = BehaviorPartitionManager()
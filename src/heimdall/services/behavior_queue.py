@@ -0,0 +1,207 @@
+"""
+用户行为异步写入队列
+记录行为的请求只把校验后的事件放入进程内有界队列，后台刷写协程按批量大小或时间间隔
+把事件批量写入 user_behaviors；队列满时由调用方拒绝请求，关闭时写完队列中剩余的事件
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Callable
+
+from src.heimdall.core.config import settings
+from src.heimdall.services.behavior_ingest import BehaviorIngestor, BehaviorRecord, behavior_ingestor
+from src.heimdall.services.profile_worker import profile_rebuild_worker
+
+logger = logging.getLogger("heimdall.behavior_queue")
+
+
+@dataclass
+class BehaviorQueueStats:
+    """行为写入队列指标"""
+    enqueued: int = 0
+    rejected_full: int = 0
+    flushes: int = 0
+    rows_written: int = 0
+    failures: int = 0
+    dropped: int = 0
+    last_flush_seconds: float = 0.0
+
+
+class BehaviorWriteQueue:
+    """
+    有界的行为写入队列
+
+    - enqueue 只做 put_nowait，队列满或未运行时返回 False，请求路径不访问数据库
+    - 刷写协程取到第一个事件后，继续收集到 batch_size 个或等满 flush_seconds 再写入，
+      每批使用独立会话写入并提交一次
+    - 写入失败的批次最多重试 max_retries 次，仍失败则丢弃并计数
+    - on_written 在每批提交后调用（用于通知画像后台更新）
+    """
+
+    def __init__(
+        self,
+        ingestor: Optional[BehaviorIngestor] = None,
+        max_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_seconds: Optional[float] = None,
+        max_retries: int = 3,
+        on_written: Optional[Callable[[List[BehaviorRecord]], None]] = None
+    ):
+        self.ingestor = ingestor or BehaviorIngestor()
+        self.max_size = max_size if max_size is not None else settings.BEHAVIOR_QUEUE_MAX_SIZE
+        self.batch_size = batch_size if batch_size is not None else settings.BEHAVIOR_QUEUE_BATCH_SIZE
+        self.flush_seconds = (
+            flush_seconds if flush_seconds is not None else settings.BEHAVIOR_QUEUE_FLUSH_SECONDS
+        )
+        self.max_retries = max_retries
+        self.on_written = on_written
+        self.stats = BehaviorQueueStats()
+        self.session_factory: Optional[Callable[[], Any]] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._accepting = False
+
+    @property
+    def running(self) -> bool:
+        """是否在接收事件"""
+        return self._accepting
+
+    def __len__(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def retry_after_seconds(self) -> int:
+        """队列满时建议客户端的重试等待时间（秒）"""
+        return max(1, int(round(self.flush_seconds * 2)))
+
+    def start(self, session_factory: Callable[[], Any]) -> None:
+        """启动后台刷写协程（需在事件循环中调用）"""
+        if self._task is not None:
+            return
+        self.session_factory = session_factory
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._task = asyncio.create_task(self._run(), name="behavior-write-queue")
+        self._accepting = True
+        logger.info(
+            f"行为写入队列已启动: 容量 {self.max_size}，每 {self.batch_size} 个或 {self.flush_seconds}s 刷写一次"
+        )
+
+    def enqueue(self, record: BehaviorRecord) -> bool:
+        """放入一个已校验的事件；队列满或未运行时返回 False"""
+        if not self._accepting:
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.stats.rejected_full += 1
+            return False
+        self.stats.enqueued += 1
+        return True
+
+    async def _collect(self) -> List[BehaviorRecord]:
+        """等待第一个事件，再收集到 batch_size 个或等到 flush_seconds 截止"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            try:
+                await self._write_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_with_retry(self, batch: List[BehaviorRecord]) -> bool:
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._write(batch)
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats.failures += 1
+                logger.error(f"行为批量写入失败（第 {attempt + 1} 次）: {e}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(min(0.1 * 2 ** attempt, 2.0))
+        self.stats.dropped += len(batch)
+        logger.error(f"行为批量写入重试耗尽，丢弃 {len(batch)} 个事件")
+        return False
+
+    async def _write(self, batch: List[BehaviorRecord]) -> None:
+        started = time.perf_counter()
+        async with self.session_factory() as session:
+            try:
+                await self.ingestor.write(session, batch)
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+        self.stats.flushes += 1
+        self.stats.rows_written += len(batch)
+        self.stats.last_flush_seconds = time.perf_counter() - started
+        if self.on_written is not None:
+            try:
+                self.on_written(batch)
+            except Exception as e:
+                logger.warning(f"行为写入回调失败: {e}")
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """停止接收事件，等待队列中的事件全部写入后停止刷写协程"""
+        self._accepting = False
+        if self._task is None:
+            return
+        timeout = timeout if timeout is not None else settings.BEHAVIOR_QUEUE_DRAIN_TIMEOUT_SECONDS
+        started_at = time.monotonic()
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"行为写入队列排空超时，{self._queue.qsize()} 个事件未写入")
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info(
+            f"行为写入队列已关闭: 共写入 {self.stats.rows_written} 个事件，"
+            f"排空耗时 {time.monotonic() - started_at:.3f}s"
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        """导出指标摘要（含当前队列深度）"""
+        return {
+            "running": self.running,
+            "depth": len(self),
+            "max_size": self.max_size,
+            "enqueued": self.stats.enqueued,
+            "rejected_full": self.stats.rejected_full,
+            "flushes": self.stats.flushes,
+            "rows_written": self.stats.rows_written,
+            "failures": self.stats.failures,
+            "dropped": self.stats.dropped,
+            "last_flush_seconds": round(self.stats.last_flush_seconds, 4),
+        }
+
+
+def _mark_profiles_dirty(records: List[BehaviorRecord]) -> None:
+    """写入后通知画像后台更新队列（同一用户的多个事件合并为一次更新）"""
+    for user_id, _, behavior_type, behavior_data, created_at in records:
+        profile_rebuild_worker.mark_dirty(user_id, (behavior_type, behavior_data, created_at))
+
+
+# 全局行为写入队列（在应用 lifespan 中启动与排空）
+behavior_write_queue = BehaviorWriteQueue(ingestor=behavior_ingestor, on_written=_mark_profiles_dirty)
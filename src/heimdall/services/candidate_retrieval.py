@@ -0,0 +1,183 @@
+"""
+混合推荐候选召回
+基于类别、品牌、价格区间倒排索引生成有界候选集，只有候选集进入完整的混合打分
+"""
+
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+
+import numpy as np
+
+from src.heimdall.services.hybrid_scoring import ColumnarCatalog
+
+logger = logging.getLogger("heimdall.candidate_retrieval")
+
+# 价格区间划分，与意图打分中的价格匹配规则一致
+PRICE_BUCKETS = ("低", "中", "高")
+
+
+def price_bucket_masks(prices: np.ndarray) -> Dict[str, np.ndarray]:
+    """按意图分析的价格区间划分产品"""
+    return {
+        "低": prices < 1000,
+        "中": (prices >= 1000) & (prices <= 5000),
+        "高": prices > 5000,
+    }
+
+
+@dataclass(frozen=True)
+class CatalogIndex:
+    """
+    目录倒排索引
+
+    各倒排列表中的产品下标按目录顺序升序排列；
+    popularity_order 为按热门度降序的下标，用于候选不足时回填。
+    """
+    by_category: Dict[str, np.ndarray]
+    by_brand: Dict[str, np.ndarray]
+    by_price_bucket: Dict[str, np.ndarray]
+    popularity_order: np.ndarray
+
+    @classmethod
+    def build(cls, catalog: ColumnarCatalog) -> "CatalogIndex":
+        """由列式目录构建倒排索引"""
+        by_category: Dict[str, List[np.ndarray]] = {}
+        for code, category in enumerate(catalog.categories):
+            # 类别键统一小写，兼容意图分析中不区分大小写的类别匹配
+            by_category.setdefault(category.lower(), []).append(
+                np.flatnonzero(catalog.category_codes == code)
+            )
+
+        by_brand = {
+            brand: np.flatnonzero(catalog.brand_codes == code)
+            for code, brand in enumerate(catalog.brands)
+        }
+
+        return cls(
+            by_category={
+                key: np.sort(np.concatenate(postings)) for key, postings in by_category.items()
+            },
+            by_brand=by_brand,
+            by_price_bucket={
+                bucket: np.flatnonzero(mask) for bucket, mask in price_bucket_masks(catalog.prices).items()
+            },
+            popularity_order=np.argsort(-catalog.ratings, kind="stable"),
+        )
+
+
+@dataclass
+class RetrievalStats:
+    """候选召回指标：候选集大小与相对完整打分的召回率"""
+    requests: int = 0
+    full_scans: int = 0
+    backfilled: int = 0
+    candidate_sizes: deque = field(default_factory=lambda: deque(maxlen=1000))
+    recall_samples: deque = field(default_factory=lambda: deque(maxlen=1000))
+
+    def summary(self) -> Dict[str, Any]:
+        """导出指标摘要"""
+        sizes = list(self.candidate_sizes)
+        recalls = list(self.recall_samples)
+        return {
+            "requests": self.requests,
+            "full_scans": self.full_scans,
+            "backfilled": self.backfilled,
+            "avg_candidate_size": sum(sizes) / len(sizes) if sizes else 0.0,
+            "max_candidate_size": max(sizes) if sizes else 0,
+            "recall_samples": len(recalls),
+            "avg_recall": sum(recalls) / len(recalls) if recalls else None,
+            "min_recall": min(recalls) if recalls else None,
+        }
+
+
+class CandidateRetriever:
+    """
+    候选召回器
+
+    用户的 category_preferences / brand_preferences 与意图中的 product_categories /
+    brand_preferences 作为召回键；超过 max_candidates 时优先保留意图价格区间内的产品，
+    不足 min_candidates 时按热门度回填。
+    """
+
+    def __init__(self, min_candidates: int, max_candidates: int):
+        self.min_candidates = min_candidates
+        self.max_candidates = max_candidates
+        self.stats = RetrievalStats()
+        self._cached: Optional[Tuple[ColumnarCatalog, CatalogIndex]] = None
+
+    def index_for(self, catalog: ColumnarCatalog) -> CatalogIndex:
+        """获取目录对应的倒排索引（每个目录快照只构建一次）"""
+        cached = self._cached
+        if cached is not None and cached[0] is catalog:
+            return cached[1]
+        index = CatalogIndex.build(catalog)
+        self._cached = (catalog, index)
+        return index
+
+    def retrieve(
+        self,
+        catalog: ColumnarCatalog,
+        behavior_profile: Dict[str, Any],
+        intent_analysis: Optional[Dict[str, Any]]
+    ) -> Optional[np.ndarray]:
+        """
+        生成候选产品下标（按目录顺序升序）
+
+        目录规模不超过 max_candidates 时返回 None，表示直接完整打分。
+        """
+        self.stats.requests += 1
+        if len(catalog) <= self.max_candidates:
+            self.stats.full_scans += 1
+            self.stats.candidate_sizes.append(len(catalog))
+            return None
+
+        index = self.index_for(catalog)
+        intent_analysis = intent_analysis or {}
+
+        category_keys = [str(c).lower() for c in behavior_profile.get("category_preferences", {})]
+        category_keys += [str(c).lower() for c in intent_analysis.get("product_categories", []) or []]
+        brand_keys = list(behavior_profile.get("brand_preferences", {}))
+        brand_keys += list(intent_analysis.get("brand_preferences", []) or [])
+
+        postings = list(self._postings(index.by_category, category_keys))
+        postings += list(self._postings(index.by_brand, brand_keys))
+        candidates = np.unique(np.concatenate(postings)) if postings else np.empty(0, dtype=np.int64)
+
+        # 候选过多时优先保留意图价格区间内的产品
+        if len(candidates) > self.max_candidates:
+            price_range = intent_analysis.get("price_range")
+            if price_range in PRICE_BUCKETS:
+                bucket = index.by_price_bucket[price_range]
+                in_bucket = np.isin(candidates, bucket)
+                candidates = np.concatenate([candidates[in_bucket], candidates[~in_bucket]])
+            candidates = np.sort(candidates[:self.max_candidates])
+
+        # 候选不足时按热门度回填
+        if len(candidates) < self.min_candidates:
+            self.stats.backfilled += 1
+            missing = index.popularity_order[~np.isin(index.popularity_order, candidates)]
+            candidates = np.sort(np.concatenate([
+                candidates, missing[:self.min_candidates - len(candidates)]
+            ]))
+
+        self.stats.candidate_sizes.append(len(candidates))
+        return candidates
+
+    def record_recall(self, candidate_top: Iterable[int], full_top: Iterable[int]) -> float:
+        """记录一次候选集相对完整打分的 top-k 召回率"""
+        full = set(full_top)
+        recall = len(full.intersection(candidate_top)) / len(full) if full else 1.0
+        self.stats.recall_samples.append(recall)
+        return recall
+
+    @staticmethod
+    def _postings(table: Dict[Any, np.ndarray], keys: Iterable[Any]) -> Iterable[np.ndarray]:
+        for key in keys:
+            try:
+                posting = table.get(key)
+            except TypeError:
+                continue
+            if posting is not None:
+                yield posting
@@ -0,0 +1,208 @@
+"""
+产品目录快照服务
+每个工作进程加载一次只读的产品目录快照并在后台刷新，推荐请求在目录未变化时不做任何目录I/O
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+
+from src.heimdall.core.config import settings
+from src.heimdall.services.hybrid_scoring import ColumnarCatalog
+
+logger = logging.getLogger("heimdall.catalog_snapshot")
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """
+    不可变的产品目录快照
+
+    version 为加载时的目录版本号；products 中的字典由所有请求共享，只能读取不能修改。
+    """
+    version: int
+    products: Tuple[Dict[str, Any], ...]
+    catalog: ColumnarCatalog
+    fingerprint: Optional[Tuple[Any, ...]]
+    loaded_at: float
+
+
+async def load_products(db: AsyncSession) -> List[Dict[str, Any]]:
+    """从数据库读取全部产品并转换为字典"""
+    query = text("""
+        SELECT id, name, category, brand, price, description, rating, image_url
+        FROM products
+        ORDER BY rating DESC
+    """)
+    result = await db.execute(query)
+    products = []
+
+    for row in result:
+        try:
+            product = {
+                "id": int(row[0]) if row[0] is not None else 0,
+                "name": str(row[1]) if row[1] is not None else "",
+                "category": str(row[2]) if row[2] is not None else "",
+                "brand": str(row[3]) if row[3] is not None else "",
+                "price": float(row[4]) if row[4] is not None else 0.0,
+                "description": str(row[5]) if row[5] is not None else "",
+                "rating": float(row[6]) if row[6] is not None else 0.0,
+                "image_url": str(row[7]) if row[7] is not None else ""
+            }
+            products.append(product)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"跳过无效产品数据: {row}, 错误: {e}")
+            continue
+
+    return products
+
+
+async def load_fingerprint(db: AsyncSession) -> Tuple[Any, ...]:
+    """读取目录指纹（行数 + 最近更新时间），用于低成本判断目录是否变化"""
+    result = await db.execute(text("SELECT COUNT(*), MAX(updated_at) FROM products"))
+    row = result.fetchone()
+    return tuple(row) if row else ()
+
+
+class CatalogSnapshotStore:
+    """
+    带版本号失效机制的目录快照存储
+
+    - 产品增删改后调用 bump_version()，下一次读取即重新加载
+    - 快照存在时间超过 max_staleness_seconds 后必须重新校验，
+      从而约束其他工作进程写入造成的最大陈旧时间
+    - run_refresher() 在后台按陈旧上限的一半周期校验指纹，使读路径通常无需I/O
+    """
+
+    def __init__(self, max_staleness_seconds: Optional[float] = None):
+        self.max_staleness_seconds = (
+            max_staleness_seconds
+            if max_staleness_seconds is not None
+            else settings.CATALOG_SNAPSHOT_MAX_STALENESS_SECONDS
+        )
+        self._version = 0
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def version(self) -> int:
+        """当前目录版本号"""
+        return self._version
+
+    @property
+    def snapshot(self) -> Optional[CatalogSnapshot]:
+        """当前快照（可能为空）"""
+        return self._snapshot
+
+    def bump_version(self) -> int:
+        """目录发生变化时调用，使当前快照失效"""
+        self._version += 1
+        logger.debug(f"产品目录版本已更新: {self._version}")
+        return self._version
+
+    def _is_fresh(self, snapshot: Optional[CatalogSnapshot]) -> bool:
+        return (
+            snapshot is not None
+            and snapshot.version == self._version
+            and time.monotonic() - snapshot.loaded_at <= self.max_staleness_seconds
+        )
+
+    async def get_snapshot(self, db: AsyncSession) -> CatalogSnapshot:
+        """获取最新快照；快照有效时不访问数据库"""
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            return snapshot
+        return await self.refresh(db)
+
+    async def refresh(
+        self, 
+        db: AsyncSession, 
+        force: bool = False, 
+        revalidate: bool = False
+    ) -> CatalogSnapshot:
+        """
+        校验并在需要时重新加载快照
+
+        force 为True时无条件重新加载；revalidate 为True时即使快照未过期也校验目录指纹。
+        """
+        async with self._lock:
+            snapshot = self._snapshot
+            if not force and not revalidate and self._is_fresh(snapshot):
+                return snapshot
+
+            try:
+                fingerprint = await load_fingerprint(db)
+
+                if (
+                    not force
+                    and snapshot is not None
+                    and snapshot.version == self._version
+                    and snapshot.fingerprint == fingerprint
+                ):
+                    # 目录未变化，仅延长快照有效期
+                    snapshot = CatalogSnapshot(
+                        version=snapshot.version,
+                        products=snapshot.products,
+                        catalog=snapshot.catalog,
+                        fingerprint=fingerprint,
+                        loaded_at=time.monotonic()
+                    )
+                else:
+                    if (
+                        snapshot is not None
+                        and snapshot.version == self._version
+                        and snapshot.fingerprint != fingerprint
+                    ):
+                        # 其他工作进程修改了目录
+                        self._version += 1
+                    # 加载前记下版本：加载期间 bump_version 时，快照按旧版本标记，下次读取会重新加载
+                    version = self._version
+                    products = await load_products(db)
+                    snapshot = CatalogSnapshot(
+                        version=version,
+                        products=tuple(products),
+                        catalog=ColumnarCatalog.from_products(products),
+                        fingerprint=fingerprint,
+                        loaded_at=time.monotonic()
+                    )
+                    logger.info(f"产品目录快照已加载: 版本 {snapshot.version}, {len(products)} 个产品")
+
+                self._snapshot = snapshot
+                return snapshot
+
+            except Exception as e:
+                logger.error(f"获取产品数据失败: {e}")
+                # 数据库不可用时继续使用旧快照
+                return self.current_or_empty()
+
+    def current_or_empty(self) -> CatalogSnapshot:
+        """返回当前快照（即使已过期）；尚未加载过时返回空快照"""
+        if self._snapshot is not None:
+            return self._snapshot
+        return CatalogSnapshot(
+            version=self._version,
+            products=(),
+            catalog=ColumnarCatalog.from_products([]),
+            fingerprint=None,
+            loaded_at=time.monotonic()
+        )
+
+    async def run_refresher(self, session_factory) -> None:
+        """后台刷新任务：按陈旧上限的一半周期校验目录指纹"""
+        interval = max(self.max_staleness_seconds / 2, 1.0)
+        while True:
+            try:
+                async with session_factory() as session:
+                    await self.refresh(session, revalidate=True)
+            except Exception as e:
+                logger.error(f"产品目录快照后台刷新失败: {e}")
+            await asyncio.sleep(interval)
+
+
+# 全局目录快照存储（每个工作进程一份）
+catalog_snapshot_store = CatalogSnapshotStore()
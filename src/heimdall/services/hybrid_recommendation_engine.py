@@ -3,8 +3,11 @@
 结合AI意图识别和用户行为分析的混合推荐系统
 """
 
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional, Tuple
+import random
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable, Sequence
 from datetime import datetime, timedelta
 import json
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -12,14 +15,88 @@ from sqlalchemy import text, select
 import numpy as np
 
 from src.heimdall.services.llm_service import llm_service
+from src.heimdall.services.hybrid_scoring import (
+    ColumnarCatalog, ScoreComponents, score_components, combine_strategy, rank_indices, blend_popularity
+)
+from src.heimdall.services.candidate_retrieval import CandidateRetriever
+from src.heimdall.services.intent_keywords import offline_intent_analyzer
+from src.heimdall.services.intent_cache import intent_cache, prompt_version
+from src.heimdall.services.catalog_snapshot import CatalogSnapshot, CatalogSnapshotStore, catalog_snapshot_store
+from src.heimdall.services.popularity import PopularityService, popularity_service
+from src.heimdall.services.behavior_partitions import behavior_window_start
 from src.heimdall.core.config import settings
+from src.heimdall.core.database import AsyncSessionLocal
 
 logger = logging.getLogger("heimdall.hybrid_recommendation")
 
+# 意图分析提示词
+INTENT_SYSTEM_PROMPT = """
+            你是一个专业的电商意图分析助手。请分析用户输入，识别其购买意图，
+            并提取关键的产品需求、价格偏好、品牌偏好等信息。
+            
+            请按照以下JSON格式返回：
+            {
+                "intent_type": "产品购买/价格比较/信息查询/品牌了解/售后服务",
+                "confidence": 0.0-1.0,
+                "product_categories": ["类别1", "类别2"],
+                "price_range": "低/中/高",
+                "brand_preferences": ["品牌1", "品牌2"],
+                "urgency_level": 0.0-1.0,
+                "keywords": ["关键词1", "关键词2"],
+                "analysis_summary": "分析总结"
+            }
+            """
+INTENT_PROMPT_VERSION = prompt_version(INTENT_SYSTEM_PROMPT)
+
+
+@dataclass
+class HybridRecommendationResult:
+    """一次混合推荐请求的结果及其中间产物（每个请求只计算一次）"""
+    recommendations: List[Dict[str, Any]]
+    behavior_profile: Dict[str, Any]
+    intent_analysis: Optional[Dict[str, Any]]
+
+
+@dataclass
+class ScoredCandidates:
+    """一次请求中与推荐策略无关的中间结果：候选集及其全部分数分量"""
+    behavior_profile: Dict[str, Any]
+    intent_analysis: Optional[Dict[str, Any]]
+    snapshot: CatalogSnapshot
+    catalog: ColumnarCatalog
+    retrieved: bool
+    collaborative_scores: Dict[int, float]
+    components: ScoreComponents
+
+
 class HybridRecommendationEngine:
     """混合推荐引擎 - 结合AI意图分析和用户行为分析"""
     
-    def __init__(self):
+    def __init__(
+        self, 
+        catalog_store: Optional[CatalogSnapshotStore] = None,
+        session_factory: Optional[Callable[[], AsyncSession]] = None,
+        popularity: Optional[PopularityService] = None
+    ):
+        # 产品目录快照（未指定时使用实例私有的快照存储）
+        self.catalog_store = catalog_store or CatalogSnapshotStore()
+        
+        # 产品行为热度（未指定时使用实例私有的热度服务，未加载前热门度只用评分）
+        self.popularity_service = popularity or PopularityService()
+        
+        # 数据库会话工厂：指定时画像与目录阶段各自使用独立的连接池会话并发执行，
+        # 未指定时两者在请求会话上串行执行（仍与AI意图分析并发）
+        self.session_factory = session_factory
+        
+        # 各阶段超时降级次数
+        self.stage_timeouts = {"profile": 0, "intent": 0, "catalog": 0}
+        
+        # 候选召回（两阶段：召回 -> 完整打分）
+        self.candidate_retriever = CandidateRetriever(
+            min_candidates=settings.HYBRID_MIN_CANDIDATES,
+            max_candidates=settings.HYBRID_MAX_CANDIDATES
+        )
+        
         # 行为权重配置
         self.behavior_weights = {
             'purchase': 3.0,    # 购买权重最高
@@ -49,48 +126,16 @@ class HybridRecommendationEngine:
     async def analyze_user_intent(self, user_input: str, user_id: str = None) -> Dict[str, Any]:
         """
         使用AI分析用户意图
+        
+        相同（规范化后）输入的分析结果会被缓存，并发的相同请求只调用一次大模型
         """
         try:
-            # 构建意图分析提示词
-            system_prompt = """
-            你是一个专业的电商意图分析助手。请分析用户输入，识别其购买意图，
-            并提取关键的产品需求、价格偏好、品牌偏好等信息。
-            
-            请按照以下JSON格式返回：
-            {
-                "intent_type": "产品购买/价格比较/信息查询/品牌了解/售后服务",
-                "confidence": 0.0-1.0,
-                "product_categories": ["类别1", "类别2"],
-                "price_range": "低/中/高",
-                "brand_preferences": ["品牌1", "品牌2"],
-                "urgency_level": 0.0-1.0,
-                "keywords": ["关键词1", "关键词2"],
-                "analysis_summary": "分析总结"
-            }
-            """
-            
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_input}
-            ]
-            
-            # 调用大模型进行意图分析
-            model_response = await llm_service.client.chat.completions.create(
-                model=settings.MODEL_NAME,
-                messages=messages,
-                temperature=0.3
+            cache_key = intent_cache.make_key(
+                user_input, settings.MODEL_NAME, INTENT_PROMPT_VERSION, namespace="hybrid"
+            )
+            return await intent_cache.get_or_compute(
+                cache_key, lambda: self._request_intent_analysis(user_input)
             )
-            
-            intent_result = model_response.choices[0].message.content
-            
-            # 解析JSON结果
-            try:
-                intent_data = json.loads(intent_result)
-                logger.info(f"AI意图分析完成: {intent_data.get('intent_type', '未知')}")
-                return intent_data
-            except json.JSONDecodeError:
-                # 如果JSON解析失败，使用简单的文本解析
-                return self._parse_intent_text(intent_result)
                 
         except Exception as e:
             error_msg = str(e)
@@ -113,6 +158,31 @@ class HybridRecommendationEngine:
                 "analysis_summary": "意图分析失败，使用默认配置"
             }
     
+    async def _request_intent_analysis(self, user_input: str) -> Dict[str, Any]:
+        """调用大模型进行意图分析（异常由调用方处理，失败结果不会被缓存）"""
+        messages = [
+            {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+            {"role": "user", "content": user_input}
+        ]
+        
+        # 调用大模型进行意图分析
+        model_response = await llm_service.client.chat.completions.create(
+            model=settings.MODEL_NAME,
+            messages=messages,
+            temperature=0.3
+        )
+        
+        intent_result = model_response.choices[0].message.content
+        
+        # 解析JSON结果
+        try:
+            intent_data = json.loads(intent_result)
+            logger.info(f"AI意图分析完成: {intent_data.get('intent_type', '未知')}")
+            return intent_data
+        except json.JSONDecodeError:
+            # 如果JSON解析失败，使用简单的文本解析
+            return self._parse_intent_text(intent_result)
+    
     def _parse_intent_text(self, intent_text: str) -> Dict[str, Any]:
         """文本解析备用方案"""
         lines = intent_text.split('\n')
@@ -145,73 +215,9 @@ class HybridRecommendationEngine:
         """离线意图分析 - 当AI服务不可用时使用"""
         logger.info(f"执行离线意图分析: {user_input[:50]}...")
         
-        # 简单的关键词匹配
-        input_lower = user_input.lower()
-        
-        # 意图类型关键词
-        intent_keywords = {
-            "产品购买": ["买", "购买", "要", "想买", "订购", "下单", "获取"],
-            "价格比较": ["价格", "多少钱", "贵", "便宜", "对比", "比较", "性价比"],
-            "信息查询": ["什么", "怎么样", "如何", "介绍", "了解", "说明"],
-            "品牌了解": ["品牌", "牌子", "哪个好", "推荐", "评价"],
-            "售后服务": ["保修", "售后", "服务", "维修", "退换"]
-        }
-        
-        # 确定意图类型
-        intent_type = "信息查询"
-        max_matches = 0
-        
-        for intent, keywords in intent_keywords.items():
-            matches = sum(1 for keyword in keywords if keyword in input_lower)
-            if matches > max_matches:
-                max_matches = matches
-                intent_type = intent
-        
-        # 产品类别关键词
-        category_keywords = {
-            "手机": ["手机", "iphone", "华为", "小米", "oppo", "vivo"],
-            "笔记本": ["笔记本", "电脑", "macbook", "联想", "戴尔", "惠普"],
-            "耳机": ["耳机", "airpods", "蓝牙", "音响"],
-            "平板": ["平板", "ipad", "tablet"],
-            "相机": ["相机", "摄像机", "单反"]
-        }
-        
-        matched_categories = []
-        for category, keywords in category_keywords.items():
-            if any(keyword in input_lower for keyword in keywords):
-                matched_categories.append(category)
-        
-        # 价格范围分析
-        price_range = "中"
-        if any(word in input_lower for word in ["便宜", "经济", "低价", "预算"]):
-            price_range = "低"
-        elif any(word in input_lower for word in ["贵", "高端", "旗舰", "最好"]):
-            price_range = "高"
-        
-        # 紧急程度
-        urgency_level = 0.5
-        if any(word in input_lower for word in ["马上", "立即", "现在", "急"]):
-            urgency_level = 0.8
-        elif any(word in input_lower for word in ["看看", "了解", "考虑"]):
-            urgency_level = 0.3
-        
-        # 提取关键词
-        keywords = []
-        for category, category_keys in category_keywords.items():
-            for key in category_keys:
-                if key in input_lower and key not in keywords:
-                    keywords.append(key)
-        
-        result = {
-            "intent_type": intent_type,
-            "confidence": min(0.6 + max_matches * 0.1, 0.9),
-            "product_categories": matched_categories,
-            "price_range": price_range,
-            "brand_preferences": [],
-            "urgency_level": urgency_level,
-            "keywords": keywords[:5],  # 最多5个关键词
-            "analysis_summary": f"离线分析识别为{intent_type}意图"
-        }
+        # 关键词表已在启动时编译为多模式匹配器，一次扫描完成全部关键词匹配
+        result = offline_intent_analyzer.analyze(user_input)
+        intent_type = result["intent_type"]
         
         logger.info(f"离线意图分析完成: {intent_type}")
         return result
@@ -219,71 +225,144 @@ class HybridRecommendationEngine:
     async def get_user_behavior_profile(self, user_id: str, db: AsyncSession) -> Dict[str, Any]:
         """获取用户行为画像"""
         try:
-            # 查询用户最近行为
+            # 与原实现一致：取最近30天内频次最高的 50 个 (行为类型, 产品, 类别, 品牌) 组，
+            # 再在数据库中按行为类型、类别、品牌分别汇总加权分数（一次查询，只读取类型化列）
             query = text("""
-                SELECT behavior_type, product_id, category, brand, 
-                       COUNT(*) as frequency, MAX(timestamp) as last_action
-                FROM user_behaviors 
-                WHERE user_id = :user_id 
-                AND timestamp > :cutoff_date
-                GROUP BY behavior_type, product_id, category, brand
-                ORDER BY frequency DESC
-                LIMIT 50
+                WITH top_groups AS (
+                    SELECT behavior_type, product_id, category, brand, COUNT(*) AS frequency
+                    FROM user_behaviors
+                    WHERE user_id = :user_id 
+                    AND created_at >= :cutoff_date
+                    GROUP BY behavior_type, product_id, category, brand
+                    ORDER BY frequency DESC
+                    LIMIT 50
+                )
+                SELECT GROUPING(g.behavior_type, g.category, g.brand) AS level,
+                       g.behavior_type, g.category, g.brand,
+                       SUM(g.frequency * COALESCE(w.weight, 1.0)) AS score,
+                       SUM(g.frequency) AS frequency,
+                       COUNT(*) AS group_count
+                FROM top_groups g
+                LEFT JOIN unnest(CAST(:weight_types AS TEXT[]), CAST(:weight_values AS FLOAT8[]))
+                    AS w(behavior_type, weight) ON w.behavior_type = g.behavior_type
+                GROUP BY GROUPING SETS ((g.behavior_type), (g.category), (g.brand))
             """)
             
             cutoff_date = datetime.now() - timedelta(days=30)
             result = await db.execute(query, {
                 "user_id": user_id,
-                "cutoff_date": cutoff_date
+                "cutoff_date": cutoff_date,
+                "weight_types": list(self.behavior_weights.keys()),
+                "weight_values": [float(weight) for weight in self.behavior_weights.values()]
             })
             
-            behaviors = result.fetchall()
-            
-            # 分析用户偏好
+            # 分析用户偏好（level 3 为行为类型行，5 为类别行，6 为品牌行）
             category_scores = {}
             brand_scores = {}
             behavior_scores = {}
+            # 读取到的分组数（每个分组只属于一个行为类型行）
+            total_groups = 0
             
-            for behavior in behaviors:
-                behavior_type = behavior[0]
-                product_id = behavior[1]
-                category = behavior[2]
-                brand = behavior[3]
-                frequency = behavior[4]
-                
-                weight = self.behavior_weights.get(behavior_type, 1.0)
-                score = frequency * weight
-                
-                # 类别偏好
-                if category:
-                    category_scores[category] = category_scores.get(category, 0) + score
-                
-                # 品牌偏好
-                if brand:
-                    brand_scores[brand] = brand_scores.get(brand, 0) + score
-                
-                # 行为模式
-                behavior_scores[behavior_type] = behavior_scores.get(behavior_type, 0) + frequency
+            for level, behavior_type, category, brand, score, frequency, group_count in result.fetchall():
+                if level == 3:
+                    behavior_scores[behavior_type] = frequency
+                    total_groups += group_count
+                elif level == 5 and category:
+                    category_scores[category] = float(score)
+                elif level == 6 and brand:
+                    brand_scores[brand] = float(score)
             
             return {
                 "user_id": user_id,
                 "category_preferences": dict(sorted(category_scores.items(), key=lambda x: float(x[1]), reverse=True)),
                 "brand_preferences": dict(sorted(brand_scores.items(), key=lambda x: float(x[1]), reverse=True)),
                 "behavior_patterns": behavior_scores,
-                "total_behaviors": len(behaviors),
+                "total_behaviors": total_groups,
                 "analysis_date": datetime.now().isoformat()
             }
             
         except Exception as e:
             logger.error(f"获取用户行为画像失败: {e}")
-            return {
-                "user_id": user_id,
-                "category_preferences": {},
-                "brand_preferences": {},
-                "behavior_patterns": {},
-                "total_behaviors": 0,
-                "analysis_date": datetime.now().isoformat()
-            }
+            return self._empty_behavior_profile(user_id)
+    
+    def _empty_behavior_profile(self, user_id: str) -> Dict[str, Any]:
+        """无行为数据（或画像加载失败）时的默认画像"""
+        return {
+            "user_id": user_id,
+            "category_preferences": {},
+            "brand_preferences": {},
+            "behavior_patterns": {},
+            "total_behaviors": 0,
+            "analysis_date": datetime.now().isoformat()
+        }
+    
+    async def _run_stage(
+        self, 
+        stage: str, 
+        awaitable: Awaitable[Any], 
+        timeout: float, 
+        fallback: Callable[[], Any]
+    ) -> Any:
+        """在超时预算内执行一个加载阶段，超时则记录并降级为 fallback() 的结果"""
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            self.stage_timeouts[stage] += 1
+            logger.warning(f"混合推荐阶段 {stage} 超时（{timeout}s），使用降级结果")
+            return fallback()
+    
+    async def _with_session(
+        self, 
+        db: AsyncSession, 
+        db_lock: asyncio.Lock, 
+        work: Callable[[AsyncSession], Awaitable[Any]]
+    ) -> Any:
+        """在独立的连接池会话上执行 work；未配置会话工厂时在请求会话上串行执行"""
+        if self.session_factory is None:
+            # 同一个 AsyncSession 不支持并发执行查询
+            async with db_lock:
+                return await work(db)
+        async with self.session_factory() as session:
+            return await work(session)
+    
+    async def _load_request_context(
+        self, 
+        user_id: str, 
+        user_input: Optional[str], 
+        db: AsyncSession
+    ) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], Any]:
+        """
+        并发加载用户行为画像、AI意图分析与产品目录快照
+        
+        三个阶段相互独立，请求延迟约等于最慢阶段而非三者之和；
+        任一阶段超时都会降级：画像 -> 空画像，意图 -> 离线意图分析，目录 -> 已有（可能过期的）快照。
+        """
+        db_lock = asyncio.Lock()
+        
+        profile_stage = self._run_stage(
+            "profile",
+            self._with_session(db, db_lock, lambda session: self.get_user_behavior_profile(user_id, session)),
+            settings.HYBRID_PROFILE_TIMEOUT_SECONDS,
+            lambda: self._empty_behavior_profile(user_id)
+        )
+        catalog_stage = self._run_stage(
+            "catalog",
+            self._with_session(db, db_lock, self.catalog_store.get_snapshot),
+            settings.HYBRID_CATALOG_TIMEOUT_SECONDS,
+            self.catalog_store.current_or_empty
+        )
+        
+        if not user_input:
+            behavior_profile, snapshot = await asyncio.gather(profile_stage, catalog_stage)
+            return behavior_profile, None, snapshot
+        
+        intent_stage = self._run_stage(
+            "intent",
+            self.analyze_user_intent(user_input, user_id),
+            settings.HYBRID_INTENT_TIMEOUT_SECONDS,
+            lambda: self._offline_intent_analysis(user_input)
+        )
+        return await asyncio.gather(profile_stage, intent_stage, catalog_stage)
     
     async def get_hybrid_recommendations(
         self, 
@@ -296,90 +375,184 @@ class HybridRecommendationEngine:
         """
         生成混合推荐结果
         """
+        result = await self.get_hybrid_recommendations_with_context(
+            user_id=user_id,
+            user_input=user_input,
+            db=db,
+            limit=limit,
+            strategy=strategy
+        )
+        return result.recommendations
+    
+    async def get_hybrid_recommendations_with_context(
+        self, 
+        user_id: str, 
+        user_input: str = None,
+        db: AsyncSession = None,
+        limit: int = 10,
+        strategy: str = "hybrid"
+    ) -> "HybridRecommendationResult":
+        """
+        生成混合推荐结果，并返回本次请求计算出的用户行为画像与AI意图分析
+        
+        调用方（如API端点）可直接复用这些中间结果，避免重复的数据库聚合与大模型调用。
+        """
+        behavior_profile = self._empty_behavior_profile(user_id)
+        intent_analysis = None
         try:
-            # 1. 获取用户行为画像
-            behavior_profile = await self.get_user_behavior_profile(user_id, db)
+            scored = await self._score_request(user_id, user_input, db)
+            behavior_profile = scored.behavior_profile
+            intent_analysis = scored.intent_analysis
             
-            # 2. AI意图分析（如果有用户输入）
-            intent_analysis = None
-            if user_input:
-                intent_analysis = await self.analyze_user_intent(user_input, user_id)
-            
-            # 3. 获取基础产品数据
-            products = await self._get_all_products(db)
-            
-            # 4. 计算多种推荐分数
-            recommendations = []
-            
-            for product in products:
-                # 意图相关分数
-                intent_score = 0.0
-                if intent_analysis:
-                    intent_score = self._calculate_intent_score(product, intent_analysis)
-                
-                # 行为相关分数
-                behavior_score = self._calculate_behavior_score(product, behavior_profile)
-                
-                # 协同过滤分数
-                collaborative_score = await self._calculate_collaborative_score(product, user_id, db)
-                
-                # 内容过滤分数
-                content_score = self._calculate_content_score(product, behavior_profile)
-                
-                # 热门度分数
-                popularity_score = self._calculate_popularity_score(product, db)
-                
-                # 混合分数计算
-                if strategy == "hybrid":
-                    final_score = (
-                        intent_score * self.strategy_weights['intent_based'] +
-                        behavior_score * self.strategy_weights['collaborative'] +
-                        content_score * self.strategy_weights['content_based'] +
-                        popularity_score * self.strategy_weights['popularity']
-                    )
-                elif strategy == "intent_based":
-                    final_score = intent_score
-                elif strategy == "behavior_based":
-                    final_score = behavior_score
-                else:
-                    final_score = (intent_score + behavior_score + content_score) / 3
-                
-                if final_score > 0.1:  # 只返回有意义的推荐
-                    recommendations.append({
-                        "product_id": product["id"],
-                        "name": product["name"],
-                        "category": product["category"],
-                        "brand": product["brand"],
-                        "price": product["price"],
-                        "image_url": product.get("image_url", ""),
-                        "final_score": round(final_score, 3),
-                        "intent_score": round(intent_score, 3),
-                        "behavior_score": round(behavior_score, 3),
-                        "collaborative_score": round(collaborative_score, 3),
-                        "content_score": round(content_score, 3),
-                        "popularity_score": round(popularity_score, 3),
-                        "recommendation_reason": self._generate_recommendation_reason(
-                            product, intent_analysis, behavior_profile, final_score
-                        )
-                    })
-            
-            # 确保final_score是数值类型，然后排序
-            for rec in recommendations:
-                if isinstance(rec["final_score"], str):
-                    try:
-                        rec["final_score"] = float(rec["final_score"])
-                    except (ValueError, TypeError):
-                        rec["final_score"] = 0.0
-                elif not isinstance(rec["final_score"], (int, float)):
-                    rec["final_score"] = 0.0
-            
-            # 排序并返回结果
-            recommendations.sort(key=lambda x: float(x["final_score"]), reverse=True)
-            return recommendations[:limit]
+            return HybridRecommendationResult(
+                recommendations=self._rank_strategy(scored, strategy, limit),
+                behavior_profile=behavior_profile,
+                intent_analysis=intent_analysis
+            )
             
         except Exception as e:
             logger.error(f"混合推荐生成失败: {e}")
-            return []
+            return HybridRecommendationResult(
+                recommendations=[],
+                behavior_profile=behavior_profile,
+                intent_analysis=intent_analysis
+            )
+    
+    async def compare_strategies(
+        self, 
+        user_id: str, 
+        user_input: str = None,
+        db: AsyncSession = None,
+        strategies: Sequence[str] = ("hybrid", "intent_based", "behavior_based"),
+        limit: int = 10
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        对比多种推荐策略
+        
+        画像、意图分析、目录与各项分数分量只计算一次，各策略仅在同一分数矩阵上重新合成与排序，
+        对比K种策略的代价与生成一次推荐基本相同。
+        """
+        try:
+            scored = await self._score_request(user_id, user_input, db)
+            return {strategy: self._rank_strategy(scored, strategy, limit) for strategy in strategies}
+        except Exception as e:
+            logger.error(f"推荐策略对比失败: {e}")
+            return {strategy: [] for strategy in strategies}
+    
+    async def _score_request(
+        self, 
+        user_id: str, 
+        user_input: Optional[str], 
+        db: AsyncSession
+    ) -> "ScoredCandidates":
+        """计算一次请求中与推荐策略无关的全部中间结果"""
+        # 1-3. 并发获取用户行为画像、AI意图分析（如果有用户输入）与产品目录快照
+        behavior_profile, intent_analysis, snapshot = await self._load_request_context(
+            user_id, user_input, db
+        )
+        catalog = snapshot.catalog
+        
+        # 4. 候选召回：只有有界候选集进入完整打分
+        candidate_indices = self.candidate_retriever.retrieve(
+            catalog, behavior_profile, intent_analysis
+        )
+        if candidate_indices is not None:
+            catalog = catalog.take(candidate_indices)
+        
+        # 5. 批量计算协同过滤分数（一次分组查询，避免每个产品一次往返）
+        collaborative_scores = await self._calculate_collaborative_scores(
+            [int(pid) for pid in catalog.product_ids], user_id, db
+        )
+        
+        # 6. 以列式目录向量化计算候选集的多种推荐分数
+        components = score_components(
+            catalog, intent_analysis, behavior_profile, collaborative_scores, self.intent_weights,
+            self.popularity_service.score_column(catalog.product_ids), settings.POPULARITY_BEHAVIOR_WEIGHT
+        )
+        
+        return ScoredCandidates(
+            behavior_profile=behavior_profile,
+            intent_analysis=intent_analysis,
+            snapshot=snapshot,
+            catalog=catalog,
+            retrieved=candidate_indices is not None,
+            collaborative_scores=collaborative_scores,
+            components=components
+        )
+    
+    def _rank_strategy(self, scored: "ScoredCandidates", strategy: str, limit: int) -> List[Dict[str, Any]]:
+        """按推荐策略合成最终分数并生成排序后的推荐列表"""
+        catalog = scored.catalog
+        components = scored.components
+        intent_analysis = scored.intent_analysis
+        behavior_profile = scored.behavior_profile
+        final_scores = combine_strategy(components, strategy, self.strategy_weights)
+        
+        if scored.retrieved and random.random() < settings.HYBRID_RECALL_SAMPLE_RATE:
+            self._sample_candidate_recall(
+                scored.snapshot.catalog, catalog, final_scores, intent_analysis,
+                behavior_profile, scored.collaborative_scores, strategy, limit
+            )
+        
+        recommendations = []
+        
+        # 只为最终的 top-k 生成推荐结果与推荐理由（分数超过0.1才有意义）
+        for index in rank_indices(final_scores, limit):
+            product = catalog.products[index]
+            final_score = float(final_scores[index])
+            recommendations.append({
+                "product_id": product["id"],
+                "name": product["name"],
+                "category": product["category"],
+                "brand": product["brand"],
+                "price": product["price"],
+                "image_url": product.get("image_url", ""),
+                "final_score": round(final_score, 3),
+                "intent_score": round(float(components.intent[index]), 3),
+                "behavior_score": round(float(components.behavior[index]), 3),
+                "collaborative_score": round(float(components.collaborative[index]), 3),
+                "content_score": round(float(components.content[index]), 3),
+                "popularity_score": round(float(components.popularity[index]), 3),
+                "recommendation_reason": self._generate_recommendation_reason(
+                    product, intent_analysis, behavior_profile, final_score
+                )
+            })
+        
+        return recommendations
+    
+    def _sample_candidate_recall(
+        self,
+        full_catalog,
+        candidate_catalog,
+        candidate_scores,
+        intent_analysis: Optional[Dict[str, Any]],
+        behavior_profile: Dict[str, Any],
+        collaborative_scores: Dict[int, float],
+        strategy: str,
+        limit: int
+    ) -> None:
+        """对照完整打分，记录候选集的 top-k 召回率"""
+        try:
+            full_components = score_components(
+                full_catalog, intent_analysis, behavior_profile, collaborative_scores, self.intent_weights,
+                self.popularity_service.score_column(full_catalog.product_ids), settings.POPULARITY_BEHAVIOR_WEIGHT
+            )
+            full_scores = combine_strategy(full_components, strategy, self.strategy_weights)
+            full_top = full_catalog.product_ids[rank_indices(full_scores, limit)]
+            candidate_top = candidate_catalog.product_ids[rank_indices(candidate_scores, limit)]
+            recall = self.candidate_retriever.record_recall(candidate_top.tolist(), full_top.tolist())
+            logger.debug(f"候选召回率采样: {recall:.3f}, 候选集 {len(candidate_catalog)}/{len(full_catalog)}")
+        except Exception as e:
+            logger.warning(f"候选召回率采样失败: {e}")
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """导出推荐引擎运行指标"""
+        return {
+            "candidate_retrieval": self.candidate_retriever.stats.summary(),
+            "intent_cache": intent_cache.summary(),
+            "popularity": self.popularity_service.summary(),
+            "stage_timeouts": dict(self.stage_timeouts)
+        }
     
     def _calculate_intent_score(self, product: Dict[str, Any], intent_analysis: Dict[str, Any]) -> float:
         """计算意图相关分数"""
@@ -433,31 +606,57 @@ class HybridRecommendationEngine:
         return min(score, 1.0)
     
     async def _calculate_collaborative_score(self, product: Dict[str, Any], user_id: str, db: AsyncSession) -> float:
-        """计算协同过滤分数"""
+        """计算单个产品的协同过滤分数"""
+        scores = await self._calculate_collaborative_scores([product["id"]], user_id, db)
+        return scores.get(product["id"], 0.0)
+    
+    async def _calculate_collaborative_scores(
+        self, 
+        product_ids: List[int], 
+        user_id: str, 
+        db: AsyncSession
+    ) -> Dict[int, float]:
+        """
+        批量计算协同过滤分数
+        
+        一次分组查询得到所有候选产品的共现次数，返回 {product_id: score}，
+        数据库往返次数与产品目录大小无关。未出现在结果中的产品分数为0。
+        """
+        if not product_ids:
+            return {}
+        
         try:
-            # 查找相似用户对产品的偏好
+            # 查找相似用户对候选产品的偏好，按产品分组统计共现次数；
+            # 用户本人交互过的产品读取保留期内的全部行为，只有其他用户的行为按时间窗口裁剪分区
             query = text("""
-                SELECT COUNT(*) as similar_users
+                SELECT ub2.product_id, COUNT(*) as similar_users
                 FROM user_behaviors ub1
                 JOIN user_behaviors ub2 ON ub1.product_id = ub2.product_id 
                     AND ub1.user_id != ub2.user_id
                 WHERE ub1.user_id = :user_id 
-                AND ub2.product_id = :product_id
+                AND ub2.product_id = ANY(:product_ids)
+                AND ub2.created_at >= :since
                 AND ub1.behavior_type IN ('purchase', 'click')
                 AND ub2.behavior_type IN ('purchase', 'click')
+                GROUP BY ub2.product_id
             """)
             
             result = await db.execute(query, {
                 "user_id": user_id,
-                "product_id": product["id"]
+                "product_ids": list(product_ids),
+                "since": behavior_window_start()
             })
             
-            similar_users = result.fetchone()[0]
-            return min(similar_users / 5, 1.0)  # 归一化分数
+            scores = {}
+            for row in result.fetchall():
+                if row[0] is None:
+                    continue
+                scores[int(row[0])] = min(row[1] / 5, 1.0)  # 归一化分数
+            return scores
             
         except Exception as e:
             logger.error(f"协同过滤计算失败: {e}")
-            return 0.0
+            return {}
     
     def _calculate_content_score(self, product: Dict[str, Any], behavior_profile: Dict[str, Any]) -> float:
         """计算内容过滤分数"""
@@ -484,12 +683,13 @@ class HybridRecommendationEngine:
         return min(score, 1.0)
     
     def _calculate_popularity_score(self, product: Dict[str, Any], db: AsyncSession) -> float:
-        """计算热门度分数"""
+        """计算热门度分数：评分与行为热度加权，热度未加载时只用评分"""
         try:
-            # 这里可以添加产品热度计算逻辑
-            # 目前使用简单的评分作为热度指标
             rating = product.get("rating", 4.0)
-            return rating / 5.0
+            behavior_popularity = self.popularity_service.score(product["id"])
+            if behavior_popularity is None:
+                return rating / 5.0
+            return blend_popularity(rating / 5.0, behavior_popularity, settings.POPULARITY_BEHAVIOR_WEIGHT)
         except Exception:
             return 0.5
     
@@ -549,38 +749,13 @@ class HybridRecommendationEngine:
         return "；".join(reasons[:2])  # 最多显示两个理由
     
     async def _get_all_products(self, db: AsyncSession) -> List[Dict[str, Any]]:
-        """获取所有产品数据"""
-        try:
-            query = text("""
-                SELECT id, name, category, brand, price, description, rating, image_url 
-                FROM products 
-                ORDER BY rating DESC
-            """)
-            result = await db.execute(query)
-            products = []
-            
-            for row in result:
-                try:
-                    product = {
-                        "id": int(row[0]) if row[0] is not None else 0,
-                        "name": str(row[1]) if row[1] is not None else "",
-                        "category": str(row[2]) if row[2] is not None else "",
-                        "brand": str(row[3]) if row[3] is not None else "",
-                        "price": float(row[4]) if row[4] is not None else 0.0,
-                        "description": str(row[5]) if row[5] is not None else "",
-                        "rating": float(row[6]) if row[6] is not None else 0.0,
-                        "image_url": str(row[7]) if row[7] is not None else ""
-                    }
-                    products.append(product)
-                except (ValueError, TypeError) as e:
-                    logger.warning(f"跳过无效产品数据: {row}, 错误: {e}")
-                    continue
-            
-            return products
-            
-        except Exception as e:
-            logger.error(f"获取产品数据失败: {e}")
-            return []
+        """获取所有产品数据（来自目录快照）"""
+        snapshot = await self.catalog_store.get_snapshot(db)
+        return list(snapshot.products)
 
 # 创建全局推荐引擎实例
-hybrid_recommendation_engine = HybridRecommendationEngine()
\ No newline at end of file
+hybrid_recommendation_engine = HybridRecommendationEngine(
+    catalog_store=catalog_snapshot_store,
+    session_factory=AsyncSessionLocal,
+    popularity=popularity_service
+)
\ No newline at end of file
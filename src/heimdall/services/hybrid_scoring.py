@@ -0,0 +1,278 @@
+"""
+混合推荐向量化打分内核
+将产品目录转换为列式表示，用NumPy数组运算一次性计算整个目录的各项推荐分数
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Sequence, Callable
+
+import numpy as np
+
+logger = logging.getLogger("heimdall.hybrid_scoring")
+
+
+@dataclass(frozen=True)
+class ColumnarCatalog:
+    """
+    列式产品目录
+
+    类别与品牌按词表进行整数编码，价格、评分为float64列；
+    products 保留原始产品字典，用于构建最终的推荐响应。
+    """
+    products: tuple
+    product_ids: np.ndarray
+    category_codes: np.ndarray
+    brand_codes: np.ndarray
+    prices: np.ndarray
+    ratings: np.ndarray
+    categories: tuple
+    brands: tuple
+
+    @classmethod
+    def from_products(cls, products: Sequence[Dict[str, Any]]) -> "ColumnarCatalog":
+        """由 _get_all_products 返回的产品字典列表构建列式目录"""
+        category_index: Dict[str, int] = {}
+        brand_index: Dict[str, int] = {}
+        category_codes = np.empty(len(products), dtype=np.int32)
+        brand_codes = np.empty(len(products), dtype=np.int32)
+
+        for i, product in enumerate(products):
+            category_codes[i] = category_index.setdefault(product["category"], len(category_index))
+            brand_codes[i] = brand_index.setdefault(product["brand"], len(brand_index))
+
+        return cls(
+            products=tuple(products),
+            product_ids=np.array([product["id"] for product in products], dtype=np.int64),
+            category_codes=category_codes,
+            brand_codes=brand_codes,
+            prices=np.array([product["price"] for product in products], dtype=np.float64),
+            ratings=np.array([product.get("rating", 4.0) for product in products], dtype=np.float64),
+            categories=tuple(category_index),
+            brands=tuple(brand_index),
+        )
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def take(self, indices: np.ndarray) -> "ColumnarCatalog":
+        """按下标取子目录（保持词表不变，下标顺序即子目录顺序）"""
+        return ColumnarCatalog(
+            products=tuple(self.products[i] for i in indices),
+            product_ids=self.product_ids[indices],
+            category_codes=self.category_codes[indices],
+            brand_codes=self.brand_codes[indices],
+            prices=self.prices[indices],
+            ratings=self.ratings[indices],
+            categories=self.categories,
+            brands=self.brands,
+        )
+
+    def category_values(self, value_of: Callable[[str], float]) -> np.ndarray:
+        """按类别词表计算取值，再广播到每个产品"""
+        table = np.array([value_of(category) for category in self.categories], dtype=np.float64)
+        return table[self.category_codes] if len(table) else np.zeros(len(self), dtype=np.float64)
+
+    def brand_values(self, value_of: Callable[[str], float]) -> np.ndarray:
+        """按品牌词表计算取值，再广播到每个产品"""
+        table = np.array([value_of(brand) for brand in self.brands], dtype=np.float64)
+        return table[self.brand_codes] if len(table) else np.zeros(len(self), dtype=np.float64)
+
+
+@dataclass(frozen=True)
+class ScoreComponents:
+    """整个目录的各项分数列"""
+    intent: np.ndarray
+    behavior: np.ndarray
+    collaborative: np.ndarray
+    content: np.ndarray
+    popularity: np.ndarray
+
+
+def intent_scores(
+    catalog: ColumnarCatalog,
+    intent_analysis: Optional[Dict[str, Any]],
+    intent_weights: Dict[str, float]
+) -> np.ndarray:
+    """向量化的意图相关分数，与 _calculate_intent_score 逐元素一致"""
+    score = np.zeros(len(catalog), dtype=np.float64)
+    if not intent_analysis:
+        return score
+
+    intent_type = intent_analysis.get("intent_type", "信息查询")
+    intent_weight = intent_weights.get(intent_type, 0.5)
+
+    # 类别匹配（不区分大小写）
+    preferred_categories = [cat.lower() for cat in intent_analysis.get("product_categories", [])]
+    score = score + catalog.category_values(
+        lambda category: 0.5 if category.lower() in preferred_categories else 0.0
+    )
+
+    # 价格范围匹配
+    price_range = intent_analysis.get("price_range", "中")
+    prices = catalog.prices
+    if price_range == "低":
+        price_hit = prices < 1000
+    elif price_range == "中":
+        price_hit = (prices >= 1000) & (prices <= 5000)
+    elif price_range == "高":
+        price_hit = prices > 5000
+    else:
+        price_hit = np.zeros(len(catalog), dtype=bool)
+    score = score + np.where(price_hit, 0.3, 0.0)
+
+    # 品牌偏好匹配
+    brand_preferences = intent_analysis.get("brand_preferences", [])
+    score = score + catalog.brand_values(lambda brand: 0.4 if brand in brand_preferences else 0.0)
+
+    # 紧急程度调整分数
+    urgency = intent_analysis.get("urgency_level", 0.5)
+    score = score * (0.5 + urgency * 0.5)
+
+    return score * intent_weight
+
+
+def behavior_scores(catalog: ColumnarCatalog, behavior_profile: Dict[str, Any]) -> np.ndarray:
+    """向量化的行为相关分数，与 _calculate_behavior_score 逐元素一致"""
+    category_prefs = behavior_profile.get("category_preferences", {})
+    brand_prefs = behavior_profile.get("brand_preferences", {})
+
+    score = np.zeros(len(catalog), dtype=np.float64)
+    score = score + catalog.category_values(
+        lambda category: min(category_prefs[category] / 10, 1.0) if category in category_prefs else 0.0
+    )
+    score = score + catalog.brand_values(
+        lambda brand: min(brand_prefs[brand] / 5, 1.0) if brand in brand_prefs else 0.0
+    )
+    return np.minimum(score, 1.0)
+
+
+def content_scores(catalog: ColumnarCatalog, behavior_profile: Dict[str, Any]) -> np.ndarray:
+    """向量化的内容过滤分数，与 _calculate_content_score 逐元素一致"""
+    category_prefs = behavior_profile.get("category_preferences", {})
+
+    score = np.zeros(len(catalog), dtype=np.float64)
+    score = score + catalog.category_values(
+        lambda category: 0.5 if category in category_prefs else 0.0
+    )
+
+    behavior_patterns = behavior_profile.get("behavior_patterns", {})
+    if behavior_patterns:
+        if behavior_patterns.get('purchase', 0) > 0:
+            # 有购买行为的用户，价格敏感度较低
+            score = score + 0.3
+        else:
+            # 无购买行为的用户，价格敏感度较高
+            score = score + np.where(catalog.prices < 3000, 0.3, 0.0)
+
+    return np.minimum(score, 1.0)
+
+
+def blend_popularity(rating_score, behavior_score, behavior_weight: float):
+    """评分与行为热度加权合成热门度分数（标量与数组逐元素运算顺序一致）"""
+    return (1.0 - behavior_weight) * rating_score + behavior_weight * behavior_score
+
+
+def popularity_scores(
+    catalog: ColumnarCatalog,
+    behavior_popularity: Optional[np.ndarray] = None,
+    behavior_weight: float = 0.5
+) -> np.ndarray:
+    """
+    向量化的热门度分数，与 _calculate_popularity_score 逐元素一致
+
+    behavior_popularity 为与目录对齐的归一化行为热度列；为空（热度未加载）时只用评分。
+    """
+    rating_scores = catalog.ratings / 5.0
+    if behavior_popularity is None:
+        return rating_scores
+    return blend_popularity(rating_scores, behavior_popularity, behavior_weight)
+
+
+def collaborative_scores_column(
+    catalog: ColumnarCatalog,
+    collaborative_scores: Dict[int, float]
+) -> np.ndarray:
+    """将 {product_id: score} 映射展开为与目录对齐的分数列"""
+    if not collaborative_scores:
+        return np.zeros(len(catalog), dtype=np.float64)
+    return np.array(
+        [collaborative_scores.get(int(pid), 0.0) for pid in catalog.product_ids],
+        dtype=np.float64
+    )
+
+
+def score_components(
+    catalog: ColumnarCatalog,
+    intent_analysis: Optional[Dict[str, Any]],
+    behavior_profile: Dict[str, Any],
+    collaborative_scores: Dict[int, float],
+    intent_weights: Dict[str, float],
+    behavior_popularity: Optional[np.ndarray] = None,
+    popularity_weight: float = 0.5
+) -> ScoreComponents:
+    """一次性计算整个目录的全部分数分量"""
+    return ScoreComponents(
+        intent=intent_scores(catalog, intent_analysis, intent_weights),
+        behavior=behavior_scores(catalog, behavior_profile),
+        collaborative=collaborative_scores_column(catalog, collaborative_scores),
+        content=content_scores(catalog, behavior_profile),
+        popularity=popularity_scores(catalog, behavior_popularity, popularity_weight),
+    )
+
+
+def combine_strategy(
+    components: ScoreComponents,
+    strategy: str,
+    strategy_weights: Dict[str, float]
+) -> np.ndarray:
+    """按推荐策略将分数分量合成为最终分数"""
+    if strategy == "hybrid":
+        return (
+            components.intent * strategy_weights['intent_based'] +
+            components.behavior * strategy_weights['collaborative'] +
+            components.content * strategy_weights['content_based'] +
+            components.popularity * strategy_weights['popularity']
+        )
+    elif strategy == "intent_based":
+        return components.intent
+    elif strategy == "behavior_based":
+        return components.behavior
+    return (components.intent + components.behavior + components.content) / 3
+
+
+def round_scores(scores: np.ndarray, ndigits: int = 3) -> np.ndarray:
+    """
+    与 Python round(x, ndigits) 逐元素一致的四舍五入
+
+    np.round 先放大再取整，放大后恰好落在 .5 附近时可能与 Python 的精确舍入方向不同，
+    这部分元素改用 Python round 重新计算。
+    """
+    scale = 10.0 ** ndigits
+    rounded = np.round(scores, ndigits)
+    scaled = scores * scale
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_half):
+        rounded[i] = round(float(scores[i]), ndigits)
+    return rounded
+
+
+def rank_indices(final_scores: np.ndarray, limit: int, threshold: float = 0.1) -> np.ndarray:
+    """
+    选出按四舍五入到3位小数后的最终分数降序排列的前 limit 个下标（同分保持目录顺序）
+
+    先用 np.partition 找到第 limit 大的分数，只对不低于它的下标排序，
+    排序规模与 limit 相关而不是与目录规模相关。
+    """
+    survivors = np.flatnonzero(final_scores > threshold)
+    if limit <= 0 or len(survivors) == 0:
+        return survivors[:0]
+
+    keys = round_scores(final_scores[survivors])
+    if len(survivors) > limit:
+        kth = np.partition(keys, len(keys) - limit)[len(keys) - limit]
+        keep = keys >= kth
+        survivors, keys = survivors[keep], keys[keep]
+
+    order = np.lexsort((survivors, -keys))
+    return survivors[order][:limit]
@@ -0,0 +1,153 @@
+"""
+意图分析结果缓存
+以"规范化输入文本 + 模型名称 + 提示词版本"为键缓存大模型意图分析结果，
+支持容量上限（LRU淘汰）、TTL过期，以及相同输入并发请求的合并（single-flight）
+"""
+
+import asyncio
+import copy
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable
+
+from src.heimdall.core.config import settings
+
+logger = logging.getLogger("heimdall.intent_cache")
+
+_WHITESPACE = re.compile(r"\s+")
+
+CacheKey = Tuple[str, str, str, str]
+
+
+def normalize_intent_input(user_input: str) -> str:
+    """规范化用户输入：全半角统一、小写、合并空白"""
+    text = unicodedata.normalize("NFKC", user_input or "")
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def prompt_version(system_prompt: str) -> str:
+    """提示词版本：提示词文本的摘要，提示词变化后旧缓存自然失效"""
+    return hashlib.sha1((system_prompt or "").encode("utf-8")).hexdigest()[:12]
+
+
+@dataclass
+class IntentCacheStats:
+    """意图缓存指标"""
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+
+class IntentCache:
+    """
+    带TTL与LRU淘汰的意图分析结果缓存
+
+    未命中时在独立任务中执行一次计算，相同键的并发请求共享该任务的结果；
+    调用方超时或被取消不会中断计算，完成后的结果仍会写入缓存。
+    计算抛出的异常会传递给所有等待方，且不会被缓存。
+    """
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_size = max_size if max_size is not None else settings.INTENT_CACHE_MAX_SIZE
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.INTENT_CACHE_TTL_SECONDS
+        self.stats = IntentCacheStats()
+        self._clock = clock
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[CacheKey, asyncio.Future] = {}
+
+    @staticmethod
+    def make_key(user_input: str, model_name: str, version: str, namespace: str = "intent") -> CacheKey:
+        """构建缓存键"""
+        return (namespace, model_name, version, normalize_intent_input(user_input))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: CacheKey) -> Optional[Any]:
+        """读取未过期的缓存结果（命中时刷新LRU顺序）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.stats.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: CacheKey, value: Any) -> None:
+        """写入缓存结果，超出容量时淘汰最久未使用的条目"""
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (self._clock() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    async def get_or_compute(self, key: CacheKey, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """读取缓存，未命中时执行 compute()；返回结果的副本，调用方可以自由修改"""
+        value = self.get(key)
+        if value is not None:
+            self.stats.hits += 1
+            return copy.deepcopy(value)
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats.misses += 1
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.stats.coalesced += 1
+
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def _finish(self, key: CacheKey, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            logger.debug(f"意图分析计算失败，结果不缓存: {error}")
+            return
+        if task.result() is not None:
+            self.put(key, task.result())
+
+    def clear(self) -> None:
+        """清空缓存（不影响进行中的计算）"""
+        self._entries.clear()
+
+    def summary(self) -> Dict[str, Any]:
+        """导出指标摘要"""
+        lookups = self.stats.hits + self.stats.misses + self.stats.coalesced
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "in_flight": len(self._inflight),
+            "hits": self.stats.hits,
+            "misses": self.stats.misses,
+            "coalesced": self.stats.coalesced,
+            "evictions": self.stats.evictions,
+            "expirations": self.stats.expirations,
+            "hit_rate": self.stats.hits / lookups if lookups else 0.0,
+        }
+
+
+# 全局意图分析缓存（每个工作进程一份）
+intent_cache = IntentCache()
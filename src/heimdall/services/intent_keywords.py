@@ -0,0 +1,220 @@
+"""
+离线意图分析关键词匹配
+启动时将意图、类别、价格、紧急程度关键词表编译为一个去重的多关键词匹配器，每个输入只计算一次关键词命中集合；
+关键词表支持热更新（从字典或JSON文件重新加载）
+"""
+
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple, FrozenSet
+
+from src.heimdall.core.config import settings
+
+logger = logging.getLogger("heimdall.intent_keywords")
+
+# 默认关键词表
+# - intent / category：按字典顺序参与匹配，平局时先出现的意图优先
+# - price：low 先于 high 判断
+# - urgency：high（0.8）先于 low（0.3）判断
+DEFAULT_KEYWORD_TABLES: Dict[str, Dict[str, List[str]]] = {
+    "intent": {
+        "产品购买": ["买", "购买", "要", "想买", "订购", "下单", "获取"],
+        "价格比较": ["价格", "多少钱", "贵", "便宜", "对比", "比较", "性价比"],
+        "信息查询": ["什么", "怎么样", "如何", "介绍", "了解", "说明"],
+        "品牌了解": ["品牌", "牌子", "哪个好", "推荐", "评价"],
+        "售后服务": ["保修", "售后", "服务", "维修", "退换"]
+    },
+    "category": {
+        "手机": ["手机", "iphone", "华为", "小米", "oppo", "vivo"],
+        "笔记本": ["笔记本", "电脑", "macbook", "联想", "戴尔", "惠普"],
+        "耳机": ["耳机", "airpods", "蓝牙", "音响"],
+        "平板": ["平板", "ipad", "tablet"],
+        "相机": ["相机", "摄像机", "单反"]
+    },
+    "price": {
+        "low": ["便宜", "经济", "低价", "预算"],
+        "high": ["贵", "高端", "旗舰", "最好"]
+    },
+    "urgency": {
+        "high": ["马上", "立即", "现在", "急"],
+        "low": ["看看", "了解", "考虑"]
+    }
+}
+
+KEYWORD_GROUPS = ("intent", "category", "price", "urgency")
+
+KeywordTables = Dict[str, Dict[str, Tuple[str, ...]]]
+
+
+def normalize_keyword_tables(tables: Dict[str, Any]) -> KeywordTables:
+    """
+    校验并规范化关键词表，格式错误时抛出 ValueError
+
+    输入在匹配前会转为小写，关键词同样转为小写，并在转换后去重（保留首次出现的顺序）。
+    """
+    normalized: KeywordTables = {}
+    for group in KEYWORD_GROUPS:
+        entries = tables.get(group)
+        if not isinstance(entries, dict):
+            raise ValueError(f"关键词表缺少分组: {group}")
+        normalized[group] = {}
+        for label, keywords in entries.items():
+            if not isinstance(keywords, (list, tuple)) or not all(
+                isinstance(keyword, str) and keyword for keyword in keywords
+            ):
+                raise ValueError(f"关键词表 {group}.{label} 必须是非空字符串列表")
+            normalized[group][str(label)] = tuple(dict.fromkeys(keyword.lower() for keyword in keywords))
+    return normalized
+
+
+class KeywordMatcher:
+    """
+    编译后的多关键词匹配器
+
+    编译时合并所有分组中的关键词并去重，并预先计算关键词之间的包含关系；
+    匹配时每个不同关键词只做一次C层子串查找（找到首次出现即停止），
+    被已命中的更长关键词包含的关键词直接判定命中，不再扫描。
+    """
+
+    def __init__(self, keywords: List[str]):
+        # 长关键词优先，以便其包含的短关键词可以直接由包含关系推出
+        self._keywords: Tuple[str, ...] = tuple(
+            sorted(set(keywords), key=lambda keyword: (-len(keyword), keyword))
+        )
+        self._contained: Dict[str, Tuple[str, ...]] = {
+            keyword: tuple(other for other in self._keywords if other != keyword and other in keyword)
+            for keyword in self._keywords
+        }
+
+    def find(self, text: str) -> FrozenSet[str]:
+        """返回 text 中出现的全部关键词"""
+        found = set()
+        for keyword in self._keywords:
+            if keyword in found:
+                continue
+            if keyword in text:
+                found.add(keyword)
+                found.update(self._contained[keyword])
+        return frozenset(found)
+
+
+@dataclass(frozen=True)
+class CompiledKeywordTables:
+    """关键词表及其编译后的匹配器（整体替换以支持热更新）"""
+    version: int
+    tables: KeywordTables
+    matcher: KeywordMatcher
+
+
+class OfflineIntentAnalyzer:
+    """基于关键词的离线意图分析器，当AI服务不可用时使用"""
+
+    def __init__(self, tables: Optional[Dict[str, Any]] = None):
+        self._lock = threading.Lock()
+        self._compiled = self._compile(tables or DEFAULT_KEYWORD_TABLES, version=1)
+
+    @staticmethod
+    def _compile(tables: Dict[str, Any], version: int) -> CompiledKeywordTables:
+        normalized = normalize_keyword_tables(tables)
+        keywords = [
+            keyword
+            for group in normalized.values()
+            for label_keywords in group.values()
+            for keyword in label_keywords
+        ]
+        return CompiledKeywordTables(version=version, tables=normalized, matcher=KeywordMatcher(keywords))
+
+    @property
+    def version(self) -> int:
+        """关键词表版本号，每次重新加载后递增"""
+        return self._compiled.version
+
+    @property
+    def tables(self) -> KeywordTables:
+        """当前生效的关键词表"""
+        return self._compiled.tables
+
+    def reload(self, tables: Dict[str, Any]) -> int:
+        """热更新关键词表；校验失败时抛出 ValueError 并保留原关键词表"""
+        with self._lock:
+            compiled = self._compile(tables, version=self._compiled.version + 1)
+            self._compiled = compiled
+        logger.info(f"离线意图关键词表已更新: 版本 {compiled.version}")
+        return compiled.version
+
+    def reload_from_file(self, path: str) -> int:
+        """从JSON文件热更新关键词表"""
+        with open(path, "r", encoding="utf-8") as f:
+            tables = json.load(f)
+        return self.reload(tables)
+
+    def analyze(self, user_input: str) -> Dict[str, Any]:
+        """对用户输入做一次扫描，按关键词命中结果生成意图分析"""
+        compiled = self._compiled
+        tables = compiled.tables
+        found = compiled.matcher.find(user_input.lower())
+
+        # 确定意图类型
+        intent_type = "信息查询"
+        max_matches = 0
+
+        for intent, keywords in tables["intent"].items():
+            matches = sum(1 for keyword in keywords if keyword in found)
+            if matches > max_matches:
+                max_matches = matches
+                intent_type = intent
+
+        # 产品类别
+        matched_categories = [
+            category for category, keywords in tables["category"].items()
+            if any(keyword in found for keyword in keywords)
+        ]
+
+        # 价格范围分析
+        price_range = "中"
+        if any(word in found for word in tables["price"].get("low", ())):
+            price_range = "低"
+        elif any(word in found for word in tables["price"].get("high", ())):
+            price_range = "高"
+
+        # 紧急程度
+        urgency_level = 0.5
+        if any(word in found for word in tables["urgency"].get("high", ())):
+            urgency_level = 0.8
+        elif any(word in found for word in tables["urgency"].get("low", ())):
+            urgency_level = 0.3
+
+        # 提取关键词
+        keywords = []
+        for category_keys in tables["category"].values():
+            for key in category_keys:
+                if key in found and key not in keywords:
+                    keywords.append(key)
+
+        return {
+            "intent_type": intent_type,
+            "confidence": min(0.6 + max_matches * 0.1, 0.9),
+            "product_categories": matched_categories,
+            "price_range": price_range,
+            "brand_preferences": [],
+            "urgency_level": urgency_level,
+            "keywords": keywords[:5],  # 最多5个关键词
+            "analysis_summary": f"离线分析识别为{intent_type}意图"
+        }
+
+
+def create_offline_intent_analyzer(path: Optional[str] = None) -> OfflineIntentAnalyzer:
+    """创建离线意图分析器；配置的关键词文件不可用时使用默认关键词表"""
+    analyzer = OfflineIntentAnalyzer()
+    if path:
+        try:
+            analyzer.reload_from_file(path)
+        except (OSError, ValueError) as e:
+            logger.error(f"加载离线意图关键词表失败，使用默认关键词表: {e}")
+    return analyzer
+
+
+# 全局离线意图分析器
+offline_intent_analyzer = create_offline_intent_analyzer(settings.INTENT_KEYWORDS_PATH)
@@ -0,0 +1,315 @@
+"""
+产品相似度离线计算
+按用户分块流式读取行为日志，统计产品共现并计算余弦相似度，为每个产品保留前N个相似产品；
+共现不足的冷门产品用类别、品牌内容特征补齐，结果写入 product_similarities 表供主键查询
+"""
+
+import asyncio
+import heapq
+import logging
+import math
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple, Iterable, Callable, Set
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+
+from src.heimdall.core.config import settings
+
+logger = logging.getLogger("heimdall.item_similarity")
+
+Neighbors = List[Tuple[int, float]]
+
+
+class CooccurrenceAccumulator:
+    """
+    产品共现计数器
+
+    每次加入一个用户交互过的产品（最近交互的在前）；单个用户最多计入最近的 max_items_per_user 个产品，
+    共现对数超过 max_pairs 时淘汰计数最低的共现对，直到只剩 prune_to 个（默认 max_pairs 的 90%，
+    留出余量避免之后每个用户都触发淘汰），内存占用与行为日志长度无关。
+    """
+
+    def __init__(self, max_items_per_user: int = 50, max_pairs: int = 2_000_000, prune_to: Optional[int] = None):
+        self.max_items_per_user = max_items_per_user
+        self.max_pairs = max_pairs
+        self.prune_to = prune_to if prune_to is not None else max_pairs * 9 // 10
+        self.item_counts: Counter = Counter()
+        self.pair_counts: Counter = Counter()
+        self.users = 0
+        self.pruned = 0
+
+    def add_user(self, items: Iterable[int]) -> None:
+        """加入一个用户的交互产品（按最近交互在前排列，重复的产品只计一次）"""
+        items = sorted(list(dict.fromkeys(items))[:self.max_items_per_user])
+        if not items:
+            return
+        self.users += 1
+        self.item_counts.update(items)
+        for i, a in enumerate(items):
+            for b in items[i + 1:]:
+                self.pair_counts[(a, b)] += 1
+        if len(self.pair_counts) > self.max_pairs:
+            self._prune()
+
+    def add_users(self, users: Iterable[Iterable[int]]) -> None:
+        """依次加入多个用户（供 asyncio.to_thread 整批调用）"""
+        for items in users:
+            self.add_user(items)
+
+    def _prune(self) -> None:
+        """淘汰计数最低的共现对（同计数任取），直到只剩 prune_to 个"""
+        excess = len(self.pair_counts) - self.prune_to
+        evicted = heapq.nsmallest(excess, self.pair_counts, key=self.pair_counts.__getitem__)
+        for pair in evicted:
+            del self.pair_counts[pair]
+        self.pruned += len(evicted)
+
+    def top_neighbors(self, top_n: int) -> Dict[int, Neighbors]:
+        """按余弦相似度 c(a,b) / sqrt(n(a) * n(b)) 为每个产品取前 top_n 个相似产品（同分按产品ID升序）"""
+        candidates: Dict[int, List[Tuple[float, int]]] = defaultdict(list)
+        for (a, b), count in self.pair_counts.items():
+            score = count / math.sqrt(self.item_counts[a] * self.item_counts[b])
+            candidates[a].append((score, b))
+            candidates[b].append((score, a))
+        return {
+            item: [
+                (other, round(score, 6))
+                for score, other in heapq.nsmallest(top_n, scored, key=lambda entry: (-entry[0], entry[1]))
+            ]
+            for item, scored in candidates.items()
+        }
+
+
+@dataclass(frozen=True)
+class CatalogItem:
+    """内容补齐所需的产品字段"""
+    id: int
+    category: str
+    brand: str
+    rating: float
+    review_count: int
+
+
+def content_neighbors(
+    catalog: List[CatalogItem],
+    top_n: int,
+    exclude: Optional[Dict[int, Set[int]]] = None,
+    needed: Optional[Iterable[int]] = None
+) -> Dict[int, List[int]]:
+    """
+    基于内容特征的相似产品：同类别或同品牌的产品，按评分、评价数降序
+
+    与原 /products/{id}/recommendations 的回退查询排序一致；
+    类别、品牌各自预先排好序，每个产品只归并两个有序列表的前若干项。
+    """
+    def rank(item: CatalogItem) -> Tuple[float, int, int]:
+        return (-item.rating, -item.review_count, item.id)
+
+    by_category: Dict[str, List[CatalogItem]] = defaultdict(list)
+    by_brand: Dict[str, List[CatalogItem]] = defaultdict(list)
+    for item in sorted(catalog, key=rank):
+        by_category[item.category].append(item)
+        if item.brand:
+            by_brand[item.brand].append(item)
+
+    exclude = exclude or {}
+    wanted = set(needed) if needed is not None else None
+    result: Dict[int, List[int]] = {}
+    for item in catalog:
+        if wanted is not None and item.id not in wanted:
+            continue
+        skip = exclude.get(item.id, set())
+        neighbors: List[int] = []
+        seen = {item.id}
+        streams = [by_category[item.category]]
+        if item.brand:
+            streams.append(by_brand[item.brand])
+        for other in heapq.merge(*streams, key=rank):
+            if len(neighbors) >= top_n:
+                break
+            if other.id in seen or other.id in skip:
+                continue
+            seen.add(other.id)
+            neighbors.append(other.id)
+        result[item.id] = neighbors
+    return result
+
+
+class ItemSimilarityJob:
+    """
+    产品相似度离线任务
+
+    行为日志按 (user_id, id) 键集分页，每次只读取 chunk_size 行；共现计数与排序在工作线程中执行，
+    不阻塞事件循环。共现相似产品不足 top_n 个时用内容相似产品补齐（分数记为0，排在共现产品之后）。
+    """
+
+    def __init__(
+        self,
+        top_n: Optional[int] = None,
+        chunk_size: Optional[int] = None,
+        window_days: Optional[int] = None,
+        write_batch_size: int = 500
+    ):
+        self.top_n = top_n if top_n is not None else settings.ITEM_SIMILARITY_TOP_N
+        self.chunk_size = chunk_size if chunk_size is not None else settings.ITEM_SIMILARITY_CHUNK_SIZE
+        self.window_days = window_days if window_days is not None else settings.ITEM_SIMILARITY_WINDOW_DAYS
+        self.write_batch_size = write_batch_size
+
+    async def stream_user_items(self, db: AsyncSession, since: datetime):
+        """按用户分块产出 (user_id, 交互产品列表)，产品按最近一次交互从新到旧排列"""
+        query = text("""
+            SELECT id, user_id, product_id
+            FROM user_behaviors
+            WHERE created_at >= :since
+            AND product_id IS NOT NULL
+            AND product_id != 0
+            AND (user_id, id) > (:last_user_id, :last_id)
+            ORDER BY user_id, id
+            LIMIT :chunk_size
+        """)
+        last_user_id, last_id = "", 0
+        current_user: Optional[str] = None
+        items: Dict[int, None] = {}
+
+        while True:
+            result = await db.execute(query, {
+                "since": since,
+                "last_user_id": last_user_id,
+                "last_id": last_id,
+                "chunk_size": self.chunk_size
+            })
+            rows = result.fetchall()
+            for row_id, user_id, product_id in rows:
+                if user_id != current_user:
+                    if current_user is not None:
+                        yield current_user, list(reversed(items))
+                    current_user, items = user_id, {}
+                try:
+                    product = int(product_id)
+                except (TypeError, ValueError):
+                    continue
+                # id 升序即时间顺序：重复交互的产品移到末尾
+                items.pop(product, None)
+                items[product] = None
+            if len(rows) < self.chunk_size:
+                break
+            last_id, last_user_id = rows[-1][0], rows[-1][1]
+
+        if current_user is not None:
+            yield current_user, list(reversed(items))
+
+    async def load_catalog(self, db: AsyncSession) -> List[CatalogItem]:
+        """读取在售产品的内容特征"""
+        result = await db.execute(text("""
+            SELECT id, category, brand, rating, review_count
+            FROM products
+            WHERE is_active = true
+        """))
+        return [
+            CatalogItem(
+                id=int(row[0]),
+                category=str(row[1] or ""),
+                brand=str(row[2] or ""),
+                rating=float(row[3] or 0.0),
+                review_count=int(row[4] or 0),
+            )
+            for row in result.fetchall()
+        ]
+
+    def merge_neighbors(
+        self,
+        catalog: List[CatalogItem],
+        cooccurrence: Dict[int, Neighbors]
+    ) -> Dict[int, Neighbors]:
+        """共现相似产品在前，不足 top_n 时用内容相似产品补齐；只保留在售产品"""
+        active = {item.id for item in catalog}
+        merged: Dict[int, Neighbors] = {
+            item.id: [
+                (other, score) for other, score in cooccurrence.get(item.id, []) if other in active
+            ][:self.top_n]
+            for item in catalog
+        }
+        needed = [item_id for item_id, neighbors in merged.items() if len(neighbors) < self.top_n]
+        exclude = {item_id: {other for other, _ in merged[item_id]} for item_id in needed}
+        for item_id, fill in content_neighbors(catalog, self.top_n, exclude, needed).items():
+            merged[item_id].extend((other, 0.0) for other in fill[:self.top_n - len(merged[item_id])])
+        return merged
+
+    async def write(self, db: AsyncSession, neighbors: Dict[int, Neighbors], computed_at: datetime) -> None:
+        """多行 upsert 写入结果，并删除本次未计算到的产品（已下架或已删除）"""
+        entries = list(neighbors.items())
+        for start in range(0, len(entries), self.write_batch_size):
+            batch = entries[start:start + self.write_batch_size]
+            params: Dict[str, Any] = {"computed_at": computed_at}
+            values = []
+            for i, (product_id, product_neighbors) in enumerate(batch):
+                params[f"product_id_{i}"] = product_id
+                params[f"neighbor_ids_{i}"] = [other for other, _ in product_neighbors]
+                params[f"scores_{i}"] = [score for _, score in product_neighbors]
+                values.append(f"(:product_id_{i}, :neighbor_ids_{i}, :scores_{i}, :computed_at)")
+            await db.execute(text(f"""
+                INSERT INTO product_similarities (product_id, neighbor_ids, scores, computed_at)
+                VALUES {", ".join(values)}
+                ON CONFLICT (product_id)
+                DO UPDATE SET
+                    neighbor_ids = EXCLUDED.neighbor_ids,
+                    scores = EXCLUDED.scores,
+                    computed_at = EXCLUDED.computed_at
+            """), params)
+        await db.execute(
+            text("DELETE FROM product_similarities WHERE computed_at < :computed_at"),
+            {"computed_at": computed_at}
+        )
+        await db.commit()
+
+    async def run(self, db: AsyncSession) -> Dict[str, Any]:
+        """完整执行一次计算并写入结果，返回统计信息"""
+        computed_at = datetime.now()
+        accumulator = CooccurrenceAccumulator(
+            max_items_per_user=settings.ITEM_SIMILARITY_MAX_ITEMS_PER_USER,
+            max_pairs=settings.ITEM_SIMILARITY_MAX_PAIRS
+        )
+        since = computed_at - timedelta(days=self.window_days)
+        # 约每读取 chunk_size 个交互产品，把这批用户交给工作线程计数一次
+        pending: List[List[int]] = []
+        pending_items = 0
+        async for _, items in self.stream_user_items(db, since):
+            pending.append(items)
+            pending_items += len(items)
+            if pending_items >= self.chunk_size:
+                await asyncio.to_thread(accumulator.add_users, pending)
+                pending, pending_items = [], 0
+        if pending:
+            await asyncio.to_thread(accumulator.add_users, pending)
+
+        catalog = await self.load_catalog(db)
+        neighbors = await asyncio.to_thread(
+            lambda: self.merge_neighbors(catalog, accumulator.top_neighbors(self.top_n))
+        )
+        await self.write(db, neighbors, computed_at)
+
+        stats = {
+            "users": accumulator.users,
+            "products": len(neighbors),
+            "pairs": len(accumulator.pair_counts),
+            "pruned_pairs": accumulator.pruned,
+        }
+        logger.info(f"产品相似度计算完成: {stats}")
+        return stats
+
+    async def run_refresher(self, session_factory: Callable[[], Any]) -> None:
+        """后台任务：启动后立即计算一次，之后按 ITEM_SIMILARITY_REFRESH_SECONDS 周期重新计算"""
+        while True:
+            try:
+                async with session_factory() as session:
+                    await self.run(session)
+            except Exception as e:
+                logger.error(f"产品相似度计算失败: {e}")
+            await asyncio.sleep(settings.ITEM_SIMILARITY_REFRESH_SECONDS)
+
+
+# 全局产品相似度任务
+item_similarity_job = ItemSimilarityJob()
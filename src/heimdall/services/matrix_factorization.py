@@ -0,0 +1,434 @@
+"""
+隐式反馈矩阵分解（ALS）
+离线从 user_behaviors 训练用户、产品隐向量（行为权重作为置信度），写入带版本号的磁盘产物；
+在线以内存映射方式加载产物，一次矩阵向量乘法即可为用户打分全部产品
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Callable
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+
+from src.heimdall.core.config import settings
+from src.heimdall.services.ann_index import IVFFlatIndex
+
+logger = logging.getLogger("heimdall.matrix_factorization")
+
+LATEST_FILE = "LATEST"
+
+
+@dataclass(frozen=True)
+class InteractionMatrix:
+    """
+    用户-产品置信度矩阵（CSR 形式，按用户、按产品各保存一份）
+
+    weights 为同一 (用户, 产品) 上全部行为权重之和；置信度 c = 1 + alpha * weight。
+    """
+    user_ids: Tuple[str, ...]
+    item_ids: np.ndarray
+    user_indptr: np.ndarray
+    user_items: np.ndarray
+    user_weights: np.ndarray
+    item_indptr: np.ndarray
+    item_users: np.ndarray
+    item_weights: np.ndarray
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.user_ids), len(self.item_ids)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.user_items)
+
+    @staticmethod
+    def _csr(rows: np.ndarray, cols: np.ndarray, values: np.ndarray, n_rows: int):
+        order = np.argsort(rows, kind="stable")
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+        return indptr, cols[order], values[order]
+
+    @classmethod
+    def from_events(
+        cls,
+        user_ids: Sequence[str],
+        item_ids: Sequence[int],
+        weights: Sequence[float]
+    ) -> "InteractionMatrix":
+        """由 (用户, 产品, 行为权重) 事件构建矩阵，重复的 (用户, 产品) 权重相加"""
+        users, user_codes = np.unique(np.asarray(user_ids, dtype=object).astype(str), return_inverse=True)
+        items, item_codes = np.unique(np.asarray(item_ids, dtype=np.int64), return_inverse=True)
+        keys, key_codes = np.unique(user_codes.astype(np.int64) * len(items) + item_codes, return_inverse=True)
+        summed = np.bincount(key_codes, weights=np.asarray(weights, dtype=np.float64))
+        rows, cols = keys // len(items), keys % len(items)
+
+        user_indptr, user_items, user_weights = cls._csr(rows, cols, summed, len(users))
+        item_indptr, item_users, item_weights = cls._csr(cols, rows, summed, len(items))
+        return cls(
+            user_ids=tuple(users.tolist()),
+            item_ids=items,
+            user_indptr=user_indptr,
+            user_items=user_items,
+            user_weights=user_weights,
+            item_indptr=item_indptr,
+            item_users=item_users,
+            item_weights=item_weights,
+        )
+
+
+class ImplicitALS:
+    """
+    隐式反馈 ALS（Hu, Koren, Volinsky 2008）
+
+    交替固定一侧隐向量求解另一侧：(YᵀY + λI + Yᵀ(C_u - I)Y) x_u = Yᵀ C_u p_u。
+    每轮以上一轮的结果为初值，对全部行同时做 cg_steps 步共轭梯度：
+    YᵀY 每轮只算一次，修正项只涉及非零元素，单步代价为 O(nnz·k)，全部运算在 float32 上向量化完成。
+    """
+
+    def __init__(
+        self,
+        factors: int = 32,
+        regularization: float = 0.1,
+        alpha: float = 2.0,
+        iterations: int = 10,
+        cg_steps: int = 3,
+        seed: int = 7
+    ):
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.cg_steps = cg_steps
+        self.seed = seed
+
+    def fit(self, matrix: InteractionMatrix) -> Tuple[np.ndarray, np.ndarray]:
+        """训练并返回 (用户隐向量, 产品隐向量)，均为 float32"""
+        rng = np.random.default_rng(self.seed)
+        n_users, n_items = matrix.shape
+        user_factors = rng.normal(0, 0.01, (n_users, self.factors)).astype(np.float32)
+        item_factors = rng.normal(0, 0.01, (n_items, self.factors)).astype(np.float32)
+        user_confidence = (1.0 + self.alpha * matrix.user_weights).astype(np.float32)
+        item_confidence = (1.0 + self.alpha * matrix.item_weights).astype(np.float32)
+
+        for _ in range(self.iterations):
+            self._solve(matrix.user_indptr, matrix.user_items, user_confidence, item_factors, user_factors)
+            self._solve(matrix.item_indptr, matrix.item_users, item_confidence, user_factors, item_factors)
+        return user_factors, item_factors
+
+    def _solve(
+        self,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        confidence: np.ndarray,
+        fixed: np.ndarray,
+        solved: np.ndarray
+    ) -> None:
+        """以 solved 为初值原地求解每一行"""
+        n_rows, k = solved.shape
+        gram = (fixed.T @ fixed + self.regularization * np.eye(k)).astype(np.float32)
+        counts = np.diff(indptr)
+        nonempty = counts > 0
+        owners = np.repeat(np.arange(n_rows), counts)
+        starts = indptr[:-1][nonempty]
+        # 非零元素对应的向量按 (k, nnz) 连续存放，按行求和沿连续内存进行
+        vectors = np.ascontiguousarray(fixed[indices].T)
+
+        def row_sums(values: np.ndarray) -> np.ndarray:
+            out = np.zeros((n_rows, k), dtype=np.float32)
+            if len(starts):
+                out[nonempty] = np.add.reduceat(values, starts, axis=1).T
+            return out
+
+        def multiply(x: np.ndarray) -> np.ndarray:
+            gathered = np.ascontiguousarray(x.T)[:, owners]
+            projected = np.einsum("kn,kn->n", vectors, gathered) * (confidence - 1.0)
+            return x @ gram + row_sums(vectors * projected)
+
+        residual = row_sums(vectors * confidence) - multiply(solved)
+        direction = residual.copy()
+        residual_norm = np.einsum("nk,nk->n", residual, residual)
+        for _ in range(self.cg_steps):
+            product = multiply(direction)
+            curvature = np.einsum("nk,nk->n", direction, product)
+            step = np.divide(residual_norm, curvature, out=np.zeros_like(residual_norm), where=curvature > 0)
+            solved += step[:, None] * direction
+            residual -= step[:, None] * product
+            new_norm = np.einsum("nk,nk->n", residual, residual)
+            ratio = np.divide(new_norm, residual_norm, out=np.zeros_like(new_norm), where=residual_norm > 0)
+            direction = residual + ratio[:, None] * direction
+            residual_norm = new_norm
+
+
+class FactorModel:
+    """加载后的分解模型（隐向量矩阵以内存映射方式只读访问）"""
+
+    def __init__(
+        self,
+        version: str,
+        user_ids: Sequence[str],
+        item_ids: np.ndarray,
+        user_factors: np.ndarray,
+        item_factors: np.ndarray,
+        item_ann: Optional[IVFFlatIndex] = None,
+        user_ann: Optional[IVFFlatIndex] = None
+    ):
+        self.version = version
+        self.user_ids = list(user_ids)
+        # 产品、用户规模较大时训练阶段会构建 ANN 索引（索引中的 id 为隐向量矩阵的行号）
+        self.item_ann = item_ann
+        self.user_ann = user_ann
+        self.user_index: Dict[str, int] = {user_id: i for i, user_id in enumerate(user_ids)}
+        self.item_ids = item_ids
+        self.item_index: Dict[int, int] = {int(item_id): i for i, item_id in enumerate(item_ids)}
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.user_index
+
+    def user_vector(self, user_id: str) -> Optional[np.ndarray]:
+        """用户隐向量；训练时没有出现过的用户返回 None"""
+        row = self.user_index.get(user_id)
+        return None if row is None else np.asarray(self.user_factors[row])
+
+    def recommend(
+        self,
+        user_id: str,
+        limit: int,
+        exclude: Sequence[int] = ()
+    ) -> List[Tuple[int, float]]:
+        """为用户打分全部产品（有 ANN 索引时只扫描被探测的列表），返回 top-k 的 (产品ID, 分数)"""
+        vector = self.user_vector(user_id)
+        if vector is None or limit <= 0:
+            return []
+        excluded = [self.item_index[pid] for pid in exclude if pid in self.item_index]
+        if self.item_ann is not None:
+            return [
+                (int(self.item_ids[row]), score)
+                for row, score in self.item_ann.search(vector, limit, exclude=excluded)
+            ]
+
+        scores = self.item_factors @ vector
+        if excluded:
+            scores[excluded] = -np.inf
+        limit = min(limit, len(scores) - len(excluded))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(int(self.item_ids[i]), float(scores[i])) for i in top]
+
+    def similar_users(self, user_id: str, limit: int) -> List[Tuple[str, float]]:
+        """按隐向量余弦相似度返回最相似的用户（不含自身），相似度截断到 [0, 1]"""
+        row = self.user_index.get(user_id)
+        if row is None or limit <= 0:
+            return []
+        vector = np.asarray(self.user_factors[row], dtype=np.float32)
+        if self.user_ann is not None:
+            neighbors = self.user_ann.search(vector, limit, exclude=[row])
+        else:
+            norms = np.linalg.norm(self.user_factors, axis=1) * max(float(np.linalg.norm(vector)), 1e-12)
+            scores = (self.user_factors @ vector) / np.maximum(norms, 1e-12)
+            scores[row] = -np.inf
+            limit = min(limit, len(scores) - 1)
+            if limit <= 0:
+                return []
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top = top[np.lexsort((top, -scores[top]))]
+            neighbors = [(int(i), float(scores[i])) for i in top]
+        return [(self.user_ids[i], round(min(max(score, 0.0), 1.0), 6)) for i, score in neighbors]
+
+
+def save_artifact(
+    directory: str,
+    matrix: InteractionMatrix,
+    user_factors: np.ndarray,
+    item_factors: np.ndarray,
+    meta: Optional[Dict[str, Any]] = None,
+    keep_versions: int = 3,
+    indexes: Optional[Dict[str, IVFFlatIndex]] = None
+) -> str:
+    """
+    写入新版本产物并原子地切换 LATEST 指针，返回版本号
+
+    先写入临时目录再整体重命名，读取方不会看到写了一半的版本；保留最近 keep_versions 个版本。
+    """
+    os.makedirs(directory, exist_ok=True)
+    version = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    staging = os.path.join(directory, f".{version}.tmp")
+    os.makedirs(staging)
+    np.save(os.path.join(staging, "user_factors.npy"), user_factors)
+    np.save(os.path.join(staging, "item_factors.npy"), item_factors)
+    np.save(os.path.join(staging, "item_ids.npy"), matrix.item_ids)
+    with open(os.path.join(staging, "user_ids.json"), "w", encoding="utf-8") as f:
+        json.dump(list(matrix.user_ids), f, ensure_ascii=False)
+    with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": version, **(meta or {})}, f, ensure_ascii=False)
+    for name, index in (indexes or {}).items():
+        index.save(os.path.join(staging, f"ann_{name}"))
+    os.replace(staging, os.path.join(directory, version))
+
+    pointer = os.path.join(directory, f".{LATEST_FILE}.tmp")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(directory, LATEST_FILE))
+
+    versions = sorted(name for name in os.listdir(directory) if name.isdigit())
+    for stale in versions[:-keep_versions]:
+        shutil.rmtree(os.path.join(directory, stale), ignore_errors=True)
+    return version
+
+
+def load_artifact(directory: str, version: Optional[str] = None) -> Optional[FactorModel]:
+    """以内存映射方式加载指定版本（默认 LATEST 指向的版本）；不存在时返回 None"""
+    if version is None:
+        version = read_latest_version(directory)
+        if version is None:
+            return None
+    path = os.path.join(directory, version)
+    with open(os.path.join(path, "user_ids.json"), "r", encoding="utf-8") as f:
+        user_ids = json.load(f)
+    indexes = {
+        name: IVFFlatIndex.load(os.path.join(path, f"ann_{name}"))
+        for name in ("items", "users")
+        if os.path.isdir(os.path.join(path, f"ann_{name}"))
+    }
+    return FactorModel(
+        version=version,
+        user_ids=user_ids,
+        item_ids=np.load(os.path.join(path, "item_ids.npy")),
+        user_factors=np.load(os.path.join(path, "user_factors.npy"), mmap_mode="r"),
+        item_factors=np.load(os.path.join(path, "item_factors.npy"), mmap_mode="r"),
+        item_ann=indexes.get("items"),
+        user_ann=indexes.get("users"),
+    )
+
+
+def read_latest_version(directory: str) -> Optional[str]:
+    """读取 LATEST 指针；尚未训练过时返回 None"""
+    try:
+        with open(os.path.join(directory, LATEST_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class FactorModelStore:
+    """
+    分解模型存储
+
+    每个工作进程持有一份内存映射的模型；每隔 check_seconds 检查一次 LATEST 指针，
+    版本变化时加载新版本（由其他进程训练写入的产物也会被加载）。
+    """
+
+    def __init__(self, directory: Optional[str] = None, check_seconds: Optional[float] = None):
+        self.directory = directory or settings.MF_ARTIFACT_DIR
+        self.check_seconds = check_seconds if check_seconds is not None else settings.MF_RELOAD_CHECK_SECONDS
+        self._model: Optional[FactorModel] = None
+        self._checked_at: Optional[float] = None
+
+    def current(self) -> Optional[FactorModel]:
+        """返回当前模型（按检查周期热加载新版本）"""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_seconds:
+            return self._model
+        self._checked_at = now
+        try:
+            version = read_latest_version(self.directory)
+            if version is not None and (self._model is None or self._model.version != version):
+                self._model = load_artifact(self.directory, version)
+                logger.info(f"矩阵分解模型已加载: 版本 {version}")
+        except (OSError, ValueError) as e:
+            logger.error(f"加载矩阵分解模型失败: {e}")
+        return self._model
+
+
+class MatrixFactorizationTrainer:
+    """离线训练任务：读取行为数据、训练 ALS、写入新版本产物"""
+
+    def __init__(self, behavior_weights: Dict[str, float], directory: Optional[str] = None):
+        self.behavior_weights = behavior_weights
+        self.directory = directory or settings.MF_ARTIFACT_DIR
+
+    async def load_interactions(self, db: AsyncSession) -> InteractionMatrix:
+        """在数据库中按 (用户, 产品, 行为类型) 聚合行为次数后构建矩阵"""
+        query = text("""
+            SELECT user_id, product_id, behavior_type, COUNT(*)
+            FROM user_behaviors
+            WHERE created_at >= :since
+            AND product_id IS NOT NULL
+            AND product_id != 0
+            GROUP BY user_id, product_id, behavior_type
+        """)
+        since = datetime.now() - timedelta(days=settings.MF_WINDOW_DAYS)
+        result = await db.execute(query, {"since": since})
+        users, items, weights = [], [], []
+        for user_id, product_id, behavior_type, count in result.fetchall():
+            try:
+                product_id = int(product_id)
+            except (TypeError, ValueError):
+                continue
+            users.append(str(user_id))
+            items.append(product_id)
+            weights.append(self.behavior_weights.get(behavior_type, 1.0) * count)
+        return InteractionMatrix.from_events(users, items, weights)
+
+    def train(self, matrix: InteractionMatrix) -> str:
+        """训练并保存产物（CPU密集，调用方应放到线程中执行）"""
+        model = ImplicitALS(
+            factors=settings.MF_FACTORS,
+            regularization=settings.MF_REGULARIZATION,
+            alpha=settings.MF_ALPHA,
+            iterations=settings.MF_ITERATIONS,
+        )
+        started = time.perf_counter()
+        user_factors, item_factors = model.fit(matrix)
+        elapsed = time.perf_counter() - started
+        version = save_artifact(self.directory, matrix, user_factors, item_factors, indexes=self.build_indexes(
+            user_factors, item_factors
+        ), meta={
+            "users": matrix.shape[0],
+            "items": matrix.shape[1],
+            "nnz": matrix.nnz,
+            "factors": model.factors,
+            "iterations": model.iterations,
+            "train_seconds": round(elapsed, 3),
+        })
+        logger.info(f"矩阵分解训练完成: 版本 {version}, {matrix.shape} 非零 {matrix.nnz}, 耗时 {elapsed:.1f}s")
+        return version
+
+    @staticmethod
+    def build_indexes(user_factors: np.ndarray, item_factors: np.ndarray) -> Dict[str, IVFFlatIndex]:
+        """规模达到 ANN_MIN_VECTORS 时为产品（内积）、用户（余弦）隐向量构建 IVF 索引"""
+        indexes = {}
+        if len(item_factors) >= settings.ANN_MIN_VECTORS:
+            indexes["items"] = IVFFlatIndex.build(item_factors, n_probe=settings.ANN_N_PROBE)
+        if len(user_factors) >= settings.ANN_MIN_VECTORS:
+            indexes["users"] = IVFFlatIndex.build(user_factors, n_probe=settings.ANN_N_PROBE, normalize=True)
+        return indexes
+
+    async def run(self, db: AsyncSession) -> Optional[str]:
+        """完整执行一次训练；没有行为数据时不生成产物"""
+        matrix = await self.load_interactions(db)
+        if matrix.nnz == 0:
+            return None
+        return await asyncio.to_thread(self.train, matrix)
+
+    async def run_trainer(self, session_factory: Callable[[], Any]) -> None:
+        """后台任务：按 MF_TRAIN_INTERVAL_SECONDS 周期重新训练"""
+        while True:
+            await asyncio.sleep(settings.MF_TRAIN_INTERVAL_SECONDS)
+            try:
+                async with session_factory() as session:
+                    await self.run(session)
+            except Exception as e:
+                logger.error(f"矩阵分解训练失败: {e}")
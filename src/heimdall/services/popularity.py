@@ -0,0 +1,419 @@
+"""
+产品热度服务
+按行为权重累计每个产品时间衰减后的浏览、点击、购买次数，后台按行为日志主键增量刷新，
+热门榜单与热度分数都从内存中的快照读取，请求路径上不访问数据库
+"""
+
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+
+from src.heimdall.core.config import settings
+from src.heimdall.services.catalog_snapshot import load_fingerprint
+
+logger = logging.getLogger("heimdall.popularity")
+
+# 计入热度的行为类型
+POPULARITY_BEHAVIOR_TYPES = ("view", "click", "purchase")
+
+# 与推荐引擎 behavior_weights 一致的默认行为权重
+DEFAULT_BEHAVIOR_WEIGHTS = {'purchase': 3.0, 'click': 1.5, 'view': 1.0}
+
+# 衰减量超过该倍数个半衰期后把累计值换算到新的基准时间，避免指数溢出
+REBASE_HALF_LIVES = 20.0
+
+# 换算后低于该值的产品不再保留
+MIN_DECAYED_VALUE = 1e-6
+
+
+def _epoch(value: Any) -> float:
+    """行为时间转换为 Unix 时间戳（秒）"""
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return value.timestamp()
+
+
+def _product_id(value: Any) -> Optional[int]:
+    try:
+        product_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return product_id or None
+
+
+class DecayedCounter:
+    """
+    指数衰减计数器
+
+    产品热度为 Σ w · 2^(-(now - t) / half_life)。累计值统一折算到基准时间 anchor 上保存，
+    加入一次行为是 O(1)，排序与时间无关；只在导出或换算基准时间时乘以同一个衰减系数。
+    """
+
+    def __init__(self, half_life_seconds: float, anchor: Optional[float] = None):
+        self.half_life_seconds = half_life_seconds
+        self.anchor = anchor if anchor is not None else time.time()
+        self.values: Dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def _factor(self, at: float) -> float:
+        return math.pow(2.0, (at - self.anchor) / self.half_life_seconds)
+
+    def add(self, product_id: int, weight: float, occurred_at: float) -> None:
+        """加入一次行为（occurred_at 为 Unix 时间戳）"""
+        self.values[product_id] = self.values.get(product_id, 0.0) + weight * self._factor(occurred_at)
+
+    def value(self, product_id: int, now: float) -> float:
+        """now 时刻的衰减后热度"""
+        return self.values.get(product_id, 0.0) / self._factor(now)
+
+    def export(self, now: float) -> Tuple[np.ndarray, np.ndarray]:
+        """返回按产品ID升序的 (产品ID, now 时刻的衰减后热度)"""
+        ids = np.fromiter(self.values.keys(), dtype=np.int64, count=len(self.values))
+        values = np.fromiter(self.values.values(), dtype=np.float64, count=len(self.values))
+        order = np.argsort(ids)
+        return ids[order], values[order] / self._factor(now)
+
+    def rebase(self, now: float) -> int:
+        """把累计值换算到 now 并淘汰衰减到可忽略的产品，返回淘汰数"""
+        factor = self._factor(now)
+        before = len(self.values)
+        self.values = {
+            product_id: value / factor
+            for product_id, value in self.values.items()
+            if value / factor >= MIN_DECAYED_VALUE
+        }
+        self.anchor = now
+        return before - len(self.values)
+
+    def maybe_rebase(self, now: float) -> bool:
+        """距离基准时间超过 REBASE_HALF_LIVES 个半衰期时换算基准时间"""
+        if now - self.anchor < REBASE_HALF_LIVES * self.half_life_seconds:
+            return False
+        self.rebase(now)
+        return True
+
+
+@dataclass(frozen=True)
+class PopularitySnapshot:
+    """
+    不可变的热度快照
+
+    ids / scores 为有行为产品的ID（升序）与归一化热度（log1p 后除以最大值，取值 0~1）；
+    ranked / by_category 为在售产品按热度、评分、评价数排序后的前 top_n 个产品字典，
+    由所有请求共享，只能读取不能修改。
+    """
+    ids: np.ndarray
+    scores: np.ndarray
+    ranked: Tuple[Dict[str, Any], ...]
+    by_category: Dict[Any, Tuple[Dict[str, Any], ...]]
+    computed_at: float
+
+
+@dataclass
+class PopularityStats:
+    """热度服务指标"""
+    refreshes: int = 0
+    rebuilds: int = 0
+    events: int = 0
+    failures: int = 0
+    last_refresh_seconds: float = 0.0
+    catalog_reloads: int = 0
+    fallbacks: int = 0
+
+
+class PopularityService:
+    """
+    产品热度服务
+
+    - 全量加载在数据库中按产品聚合时间窗口内的衰减热度，并记录行为日志主键水位
+    - 增量刷新只读取主键大于水位的新行为（按 chunk_size 分块），累加到衰减计数器
+    - 每 rebuild_seconds 全量重新加载一次，修正水位之前晚提交的行为
+    - 在售产品目录按目录指纹变化时重新加载；每次刷新后重新生成热度快照
+    - 快照生成之前 ready 为 False，调用方应回退到原有查询
+    """
+
+    def __init__(
+        self,
+        behavior_weights: Optional[Dict[str, float]] = None,
+        half_life_hours: Optional[float] = None,
+        window_days: Optional[int] = None,
+        top_n: Optional[int] = None,
+        chunk_size: Optional[int] = None,
+        rebuild_seconds: Optional[float] = None
+    ):
+        self.behavior_weights = behavior_weights or DEFAULT_BEHAVIOR_WEIGHTS
+        self.half_life_hours = (
+            half_life_hours if half_life_hours is not None else settings.POPULARITY_HALF_LIFE_HOURS
+        )
+        self.window_days = window_days if window_days is not None else settings.POPULARITY_WINDOW_DAYS
+        self.top_n = top_n if top_n is not None else settings.POPULARITY_TOP_N
+        self.chunk_size = chunk_size if chunk_size is not None else settings.POPULARITY_CHUNK_SIZE
+        self.rebuild_seconds = (
+            rebuild_seconds if rebuild_seconds is not None else settings.POPULARITY_REBUILD_SECONDS
+        )
+        self.stats = PopularityStats()
+        self._counter: Optional[DecayedCounter] = None
+        self._last_id = 0
+        self._loaded_at = 0.0
+        self._products: Tuple[Dict[str, Any], ...] = ()
+        self._fingerprint: Optional[Tuple[Any, ...]] = None
+        self._snapshot: Optional[PopularitySnapshot] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        """是否已有可用的热度快照"""
+        return self._snapshot is not None
+
+    @property
+    def snapshot(self) -> Optional[PopularitySnapshot]:
+        """当前热度快照（可能为空）"""
+        return self._snapshot
+
+    @property
+    def half_life_seconds(self) -> float:
+        return self.half_life_hours * 3600.0
+
+    def top(self, limit: int, category_id: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        热门产品（可按类别ID过滤）；快照未就绪或 limit 超过预先排好的榜单长度时返回 None
+        """
+        snapshot = self._snapshot
+        if snapshot is None or limit > self.top_n:
+            self.stats.fallbacks += 1
+            return None
+        ranked = snapshot.ranked if category_id is None else snapshot.by_category.get(category_id, ())
+        return list(ranked[:limit])
+
+    def score(self, product_id: int) -> Optional[float]:
+        """产品的归一化热度（0~1）；快照未就绪时返回 None"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        index = int(np.searchsorted(snapshot.ids, product_id))
+        if index < len(snapshot.ids) and snapshot.ids[index] == product_id:
+            return float(snapshot.scores[index])
+        return 0.0
+
+    def score_column(self, product_ids: np.ndarray) -> Optional[np.ndarray]:
+        """与 product_ids 对齐的归一化热度列；快照未就绪时返回 None"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        column = np.zeros(len(product_ids), dtype=np.float64)
+        if len(snapshot.ids) == 0 or len(product_ids) == 0:
+            return column
+        index = np.minimum(np.searchsorted(snapshot.ids, product_ids), len(snapshot.ids) - 1)
+        hit = snapshot.ids[index] == product_ids
+        column[hit] = snapshot.scores[index[hit]]
+        return column
+
+    def _weights_case(self) -> Tuple[str, Dict[str, Any]]:
+        """行为权重的 SQL CASE 表达式及其参数"""
+        params: Dict[str, Any] = {}
+        branches = []
+        for i, behavior_type in enumerate(POPULARITY_BEHAVIOR_TYPES):
+            params[f"type_{i}"] = behavior_type
+            params[f"weight_{i}"] = float(self.behavior_weights.get(behavior_type, 1.0))
+            branches.append(f"WHEN :type_{i} THEN :weight_{i}")
+        return f"CASE behavior_type {' '.join(branches)} ELSE 0 END", params
+
+    async def load(self, db: AsyncSession) -> int:
+        """全量加载：在数据库中按产品聚合时间窗口内的衰减热度，返回产品数"""
+        now = time.time()
+        result = await db.execute(text("SELECT COALESCE(MAX(id), 0) FROM user_behaviors"))
+        last_id = int(result.scalar() or 0)
+
+        weight_case, params = self._weights_case()
+        params.update({
+            "last_id": last_id,
+            "since_epoch": now - self.window_days * 86400.0,
+            "now_epoch": now,
+            "half_life_seconds": self.half_life_seconds,
+            "behavior_types": list(POPULARITY_BEHAVIOR_TYPES),
+        })
+        result = await db.execute(text(f"""
+            SELECT product_id,
+                   SUM(({weight_case}) * POWER(2.0,
+                       -(:now_epoch - EXTRACT(EPOCH FROM created_at)) / :half_life_seconds))
+            FROM user_behaviors
+            WHERE id <= :last_id
+            AND created_at >= TO_TIMESTAMP(:since_epoch)
+            AND behavior_type = ANY(:behavior_types)
+            AND product_id IS NOT NULL
+            AND product_id != 0
+            GROUP BY product_id
+        """), params)
+
+        counter = DecayedCounter(self.half_life_seconds, anchor=now)
+        for product_id, value in result.fetchall():
+            product_id = _product_id(product_id)
+            if product_id is not None and value:
+                counter.values[product_id] = counter.values.get(product_id, 0.0) + float(value)
+
+        self._counter = counter
+        self._last_id = last_id
+        self._loaded_at = time.monotonic()
+        self.stats.rebuilds += 1
+        return len(counter)
+
+    async def apply_new_events(self, db: AsyncSession) -> int:
+        """增量刷新：累加主键大于水位的新行为，返回处理的行为数"""
+        query = text("""
+            SELECT id, product_id, behavior_type, created_at
+            FROM user_behaviors
+            WHERE id > :last_id
+            AND behavior_type = ANY(:behavior_types)
+            AND product_id IS NOT NULL
+            AND product_id != 0
+            ORDER BY id
+            LIMIT :chunk_size
+        """)
+        counter = self._counter
+        applied = 0
+        while True:
+            result = await db.execute(query, {
+                "last_id": self._last_id,
+                "behavior_types": list(POPULARITY_BEHAVIOR_TYPES),
+                "chunk_size": self.chunk_size
+            })
+            rows = result.fetchall()
+            for row_id, product_id, behavior_type, created_at in rows:
+                product_id = _product_id(product_id)
+                if product_id is not None:
+                    counter.add(product_id, self.behavior_weights.get(behavior_type, 1.0), _epoch(created_at))
+                    applied += 1
+            if rows:
+                self._last_id = int(rows[-1][0])
+            if len(rows) < self.chunk_size:
+                break
+        self.stats.events += applied
+        return applied
+
+    async def load_catalog(self, db: AsyncSession) -> bool:
+        """目录指纹变化时重新加载在售产品，返回是否重新加载"""
+        fingerprint = await load_fingerprint(db)
+        if self._fingerprint is not None and fingerprint == self._fingerprint:
+            return False
+        result = await db.execute(text("""
+            SELECT id, name, description, price, category, category_id, brand, image_url,
+                   tags, attributes, rating, review_count
+            FROM products
+            WHERE is_active = true
+        """))
+        columns = (
+            "id", "name", "description", "price", "category", "category_id", "brand", "image_url",
+            "tags", "attributes", "rating", "review_count"
+        )
+        self._products = tuple(dict(zip(columns, row)) for row in result.fetchall())
+        self._fingerprint = fingerprint
+        self.stats.catalog_reloads += 1
+        return True
+
+    def build_snapshot(self, now: Optional[float] = None) -> PopularitySnapshot:
+        """由衰减计数器与在售产品目录生成热度快照（排序：热度、评分、评价数降序，产品ID升序）"""
+        now = now if now is not None else time.time()
+        ids, values = self._counter.export(now)
+        scores = np.log1p(values)
+        peak = scores.max() if len(scores) else 0.0
+        if peak > 0:
+            scores = scores / peak
+
+        products = self._products
+        product_ids = np.array([int(product["id"]) for product in products], dtype=np.int64)
+        popularity = np.zeros(len(products), dtype=np.float64)
+        if len(ids) and len(products):
+            index = np.minimum(np.searchsorted(ids, product_ids), len(ids) - 1)
+            hit = ids[index] == product_ids
+            popularity[hit] = values[index[hit]]
+        ratings = np.array([float(product["rating"] or 0) for product in products], dtype=np.float64)
+        review_counts = np.array([int(product["review_count"] or 0) for product in products], dtype=np.int64)
+        order = np.lexsort((product_ids, -review_counts, -ratings, -popularity))
+
+        ranked: List[Dict[str, Any]] = []
+        by_category: Dict[Any, List[Dict[str, Any]]] = {}
+        for i in order:
+            product = products[i]
+            if len(ranked) < self.top_n:
+                ranked.append(product)
+            category = by_category.setdefault(product["category_id"], [])
+            if len(category) < self.top_n:
+                category.append(product)
+
+        return PopularitySnapshot(
+            ids=ids,
+            scores=scores,
+            ranked=tuple(ranked),
+            by_category={category_id: tuple(items) for category_id, items in by_category.items()},
+            computed_at=now,
+        )
+
+    async def refresh(self, db: AsyncSession) -> Dict[str, Any]:
+        """执行一次刷新（首次或到达重建周期时全量加载，否则增量），返回统计信息"""
+        async with self._lock:
+            started = time.perf_counter()
+            try:
+                rebuild = (
+                    self._counter is None
+                    or time.monotonic() - self._loaded_at >= self.rebuild_seconds
+                )
+                if rebuild:
+                    await self.load(db)
+                applied = await self.apply_new_events(db)
+                await self.load_catalog(db)
+                now = time.time()
+                self._counter.maybe_rebase(now)
+                self._snapshot = self.build_snapshot(now)
+            except Exception:
+                self.stats.failures += 1
+                raise
+            self.stats.refreshes += 1
+            self.stats.last_refresh_seconds = time.perf_counter() - started
+            return {
+                "rebuild": rebuild,
+                "events": applied,
+                "products": len(self._counter),
+                "last_id": self._last_id,
+            }
+
+    async def run_refresher(self, session_factory: Callable[[], Any]) -> None:
+        """后台任务：启动后立即加载，之后按 POPULARITY_REFRESH_SECONDS 周期增量刷新"""
+        while True:
+            try:
+                async with session_factory() as session:
+                    stats = await self.refresh(session)
+                if stats["rebuild"]:
+                    logger.info(f"产品热度已全量加载: {stats}")
+            except Exception as e:
+                logger.error(f"产品热度刷新失败: {e}")
+            await asyncio.sleep(settings.POPULARITY_REFRESH_SECONDS)
+
+    def summary(self) -> Dict[str, Any]:
+        """导出指标摘要"""
+        return {
+            "ready": self.ready,
+            "products": len(self._counter) if self._counter is not None else 0,
+            "last_id": self._last_id,
+            "refreshes": self.stats.refreshes,
+            "rebuilds": self.stats.rebuilds,
+            "events": self.stats.events,
+            "failures": self.stats.failures,
+            "catalog_reloads": self.stats.catalog_reloads,
+            "fallbacks": self.stats.fallbacks,
+            "last_refresh_seconds": round(self.stats.last_refresh_seconds, 4),
+        }
+
+
+# 全局产品热度服务（在应用 lifespan 中启动后台刷新）
+popularity_service = PopularityService()
@@ -0,0 +1,196 @@
+"""
+用户画像后台更新队列
+记录行为的请求只提交"画像待更新"信号，由后台工作协程使用独立的数据库会话更新画像；
+同一用户在合并窗口内的多次信号合并为一次更新，并发更新数有上限
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+from src.heimdall.core.config import settings
+from src.heimdall.core.database import AsyncSessionLocal
+from src.heimdall.services.recommendation_engine import recommendation_engine
+
+logger = logging.getLogger("heimdall.profile_worker")
+
+BehaviorEvent = Tuple[str, Dict[str, Any], datetime]
+
+
+@dataclass
+class _PendingProfile:
+    """等待更新的用户：累积的行为事件，以及是否需要全量重建"""
+    first_signal_at: float
+    events: List[BehaviorEvent] = field(default_factory=list)
+    full_rebuild: bool = False
+
+
+@dataclass
+class ProfileWorkerStats:
+    """画像更新队列指标"""
+    signals: int = 0
+    coalesced: int = 0
+    updates: int = 0
+    failures: int = 0
+    # 从首次信号到更新完成的耗时（秒）
+    latencies: deque = field(default_factory=lambda: deque(maxlen=1000))
+
+    def summary(self) -> Dict[str, Any]:
+        """导出指标摘要"""
+        latencies = sorted(self.latencies)
+        return {
+            "signals": self.signals,
+            "coalesced": self.coalesced,
+            "updates": self.updates,
+            "failures": self.failures,
+            "coalesce_ratio": self.coalesced / self.signals if self.signals else 0.0,
+            "avg_latency_seconds": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p95_latency_seconds": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+            if latencies else 0.0,
+        }
+
+
+class ProfileRebuildWorker:
+    """
+    用户画像后台更新队列
+
+    - mark_dirty 只记录信号，首个信号在 coalesce_seconds 后才进入队列，
+      窗口内同一用户的后续信号直接并入待更新项
+    - concurrency 个工作协程消费队列，每次更新使用 session_factory 创建的独立会话；
+      带行为事件的信号做增量更新，不带事件的信号做全量重建
+    - drain 在关闭时立即放行所有待更新项并等待队列清空
+    """
+
+    def __init__(
+        self,
+        engine: Any,
+        session_factory: Optional[Callable[[], Any]] = None,
+        concurrency: Optional[int] = None,
+        coalesce_seconds: Optional[float] = None
+    ):
+        self.engine = engine
+        self.session_factory = session_factory
+        self.concurrency = concurrency if concurrency is not None else settings.PROFILE_WORKER_CONCURRENCY
+        self.coalesce_seconds = (
+            coalesce_seconds if coalesce_seconds is not None else settings.PROFILE_WORKER_COALESCE_SECONDS
+        )
+        self.stats = ProfileWorkerStats()
+        self._pending: Dict[str, _PendingProfile] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._accepting = False
+
+    @property
+    def running(self) -> bool:
+        """后台工作协程是否已启动且仍在接收信号"""
+        return self._accepting
+
+    def start(self) -> None:
+        """启动工作协程（需在事件循环中调用）"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._run(), name=f"profile-worker-{i}")
+            for i in range(max(self.concurrency, 1))
+        ]
+        self._accepting = True
+        logger.info(f"用户画像后台更新队列已启动: 并发 {len(self._workers)}")
+
+    def mark_dirty(self, user_id: str, event: Optional[BehaviorEvent] = None) -> bool:
+        """
+        提交"画像待更新"信号；event 为 (行为类型, 行为数据, 发生时间)，省略时表示需要全量重建
+
+        队列未运行时返回 False，调用方应自行同步更新画像。
+        """
+        if not self._accepting:
+            return False
+
+        self.stats.signals += 1
+        pending = self._pending.get(user_id)
+        if pending is None:
+            pending = _PendingProfile(first_signal_at=time.monotonic())
+            self._pending[user_id] = pending
+            loop = asyncio.get_running_loop()
+            self._timers[user_id] = loop.call_later(self.coalesce_seconds, self._release, user_id)
+        else:
+            self.stats.coalesced += 1
+
+        if event is None:
+            pending.full_rebuild = True
+        else:
+            pending.events.append(event)
+        return True
+
+    def _release(self, user_id: str) -> None:
+        """合并窗口结束，待更新项进入队列"""
+        self._timers.pop(user_id, None)
+        if self._queue is not None:
+            self._queue.put_nowait(user_id)
+
+    async def _run(self) -> None:
+        while True:
+            user_id = await self._queue.get()
+            try:
+                pending = self._pending.pop(user_id, None)
+                if pending is not None:
+                    await self._update(user_id, pending)
+            finally:
+                self._queue.task_done()
+
+    async def _update(self, user_id: str, pending: _PendingProfile) -> None:
+        try:
+            async with self.session_factory() as session:
+                if pending.full_rebuild:
+                    # 全量重建已包含所有已提交的行为
+                    await self.engine.build_user_profile(user_id, session)
+                else:
+                    await self.engine.apply_behavior_events(user_id, pending.events, session)
+            self.stats.updates += 1
+        except Exception as e:
+            self.stats.failures += 1
+            logger.error(f"后台更新用户画像失败 {user_id}: {e}")
+        finally:
+            self.stats.latencies.append(time.monotonic() - pending.first_signal_at)
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        """停止接收信号，立即放行所有待更新项，等待队列清空后停止工作协程"""
+        self._accepting = False
+        if self._queue is None:
+            return
+        for user_id, timer in list(self._timers.items()):
+            timer.cancel()
+            self._release(user_id)
+
+        timeout = timeout if timeout is not None else settings.PROFILE_WORKER_DRAIN_TIMEOUT_SECONDS
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"用户画像更新队列排空超时，丢弃 {len(self._pending)} 个待更新用户（由对账任务补齐）")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        logger.info("用户画像后台更新队列已排空")
+
+    def summary(self) -> Dict[str, Any]:
+        """导出指标摘要（含当前队列深度）"""
+        summary = self.stats.summary()
+        summary.update({
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "queue_depth": len(self._pending),
+            "in_queue": self._queue.qsize() if self._queue is not None else 0,
+        })
+        return summary
+
+
+# 全局用户画像后台更新队列（在应用 lifespan 中启动与排空）
+profile_rebuild_worker = ProfileRebuildWorker(recommendation_engine, session_factory=AsyncSessionLocal)
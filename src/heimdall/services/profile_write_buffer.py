@@ -0,0 +1,238 @@
+"""
+用户画像写缓冲（write-behind）
+画像保存只更新内存中该用户的最新版本，后台按定时或脏数据量阈值用多行 upsert 批量写入 user_profiles，
+同一用户在两次刷写之间的多次保存只序列化、写入一次
+"""
+
+import asyncio
+import json
+import logging
+import math
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, IntegrityError
+
+from src.heimdall.core.config import settings
+
+logger = logging.getLogger("heimdall.profile_write_buffer")
+
+# 只与单行数据有关的写入错误：整批失败时逐行重试，出错的行丢弃
+ROW_ERRORS = (DataError, IntegrityError)
+
+
+@dataclass
+class ProfileWriteStats:
+    """写缓冲指标"""
+    puts: int = 0
+    superseded: int = 0
+    flushes: int = 0
+    rows_written: int = 0
+    statements: int = 0
+    failures: int = 0
+    dropped: int = 0
+
+
+def _finite(value: Any) -> Any:
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    return value
+
+
+def encode_profile(profile: Dict[str, Any]) -> str:
+    """画像序列化为 JSON 文本；JSONB 不接受 Infinity / NaN，非有限浮点数写为 null"""
+    return json.dumps(_finite(profile), ensure_ascii=False, default=str, allow_nan=False)
+
+
+def build_upsert(count: int) -> str:
+    """构建 count 行的 user_profiles 多行 upsert 语句"""
+    values = ",\n".join(
+        f"(:user_id_{i}, :profile_data_{i}, :now, :now)" for i in range(count)
+    )
+    return f"""
+        INSERT INTO user_profiles (user_id, profile_data, created_at, updated_at)
+        VALUES {values}
+        ON CONFLICT (user_id)
+        DO UPDATE SET
+            profile_data = EXCLUDED.profile_data,
+            updated_at = EXCLUDED.updated_at
+    """
+
+
+class ProfileWriteBuffer:
+    """
+    用户画像写缓冲
+
+    - put 只记录用户的最新画像（覆盖尚未刷写的旧版本），get 供读取方优先读到未落库的画像
+    - 后台任务每 flush_seconds 刷写一次；脏画像数达到 max_dirty 时立即刷写
+    - 每次刷写按 batch_size 分批，每批一条多行 upsert，整次刷写一次提交
+    - 刷写失败或被取消的画像放回缓冲（期间已有更新版本的除外），下次重试；
+      因单行数据出错（DataError / IntegrityError）失败的批次逐行重试，出错的画像记录日志后丢弃
+    - 关闭时先让后台任务写完进行中的刷写再退出，然后刷写剩余的脏画像
+    - 未启动时 put 返回 False，调用方应直接写库
+    """
+
+    def __init__(
+        self,
+        flush_seconds: Optional[float] = None,
+        max_dirty: Optional[int] = None,
+        batch_size: Optional[int] = None
+    ):
+        self.flush_seconds = (
+            flush_seconds if flush_seconds is not None else settings.PROFILE_WRITE_FLUSH_SECONDS
+        )
+        self.max_dirty = max_dirty if max_dirty is not None else settings.PROFILE_WRITE_MAX_DIRTY
+        self.batch_size = batch_size if batch_size is not None else settings.PROFILE_WRITE_BATCH_SIZE
+        self.stats = ProfileWriteStats()
+        self.session_factory: Optional[Callable[[], Any]] = None
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        self._flushing: Dict[str, Dict[str, Any]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        """后台刷写任务是否在运行"""
+        return self._task is not None
+
+    def __len__(self) -> int:
+        return len(self._dirty)
+
+    def start(self, session_factory: Callable[[], Any]) -> None:
+        """启动后台刷写任务（需在事件循环中调用）"""
+        if self._task is not None:
+            return
+        self.session_factory = session_factory
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="profile-write-buffer")
+        logger.info(f"用户画像写缓冲已启动: 每 {self.flush_seconds}s 或 {self.max_dirty} 个脏画像刷写一次")
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """返回尚未落库的最新画像（含正在刷写的画像）"""
+        profile = self._dirty.get(user_id)
+        if profile is None:
+            profile = self._flushing.get(user_id)
+        return profile
+
+    def put(self, user_id: str, profile: Dict[str, Any]) -> bool:
+        """记录用户的最新画像，缓冲未运行时返回 False"""
+        if self._task is None:
+            return False
+        self.stats.puts += 1
+        if user_id in self._dirty:
+            self.stats.superseded += 1
+        self._dirty[user_id] = profile
+        if len(self._dirty) >= self.max_dirty:
+            self._wakeup.set()
+        return True
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"用户画像写缓冲刷写失败: {e}")
+
+    async def flush(self) -> int:
+        """把当前全部脏画像写入数据库，返回写入的画像数"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            self._flushing, self._dirty = self._dirty, {}
+            entries = list(self._flushing.items())
+            try:
+                written = await self._write_entries(entries)
+            except BaseException:
+                # 失败或被取消都放回缓冲，刷写期间已有新版本的用户保留新版本
+                self.stats.failures += 1
+                for user_id, profile in entries:
+                    self._dirty.setdefault(user_id, profile)
+                raise
+            finally:
+                self._flushing = {}
+            self.stats.flushes += 1
+            self.stats.rows_written += written
+            return written
+
+    async def _write_entries(self, entries: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """整批写入；因单行数据出错失败时逐行重试并丢弃出错的画像，返回写入的画像数"""
+        try:
+            async with self.session_factory() as session:
+                await self._write(session, entries)
+            return len(entries)
+        except ROW_ERRORS as e:
+            self.stats.failures += 1
+            logger.warning(f"用户画像批量刷写失败，逐行重试 {len(entries)} 个画像: {e}")
+
+        written = 0
+        for user_id, profile in entries:
+            try:
+                async with self.session_factory() as session:
+                    await self._write(session, [(user_id, profile)])
+                written += 1
+            except ROW_ERRORS as e:
+                self.stats.dropped += 1
+                logger.error(f"丢弃无法写入的用户画像 {user_id}: {e}")
+        return written
+
+    async def _write(self, session: Any, entries: List[Tuple[str, Dict[str, Any]]]) -> None:
+        now = datetime.now()
+        try:
+            for start in range(0, len(entries), self.batch_size):
+                batch = entries[start:start + self.batch_size]
+                params: Dict[str, Any] = {"now": now}
+                for i, (user_id, profile) in enumerate(batch):
+                    params[f"user_id_{i}"] = user_id
+                    params[f"profile_data_{i}"] = encode_profile(profile)
+                await session.execute(text(build_upsert(len(batch))), params)
+                self.stats.statements += 1
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+    async def close(self) -> None:
+        """停止后台任务（等待进行中的刷写完成）并刷写剩余的全部脏画像"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        started_at = time.monotonic()
+        try:
+            written = await self.flush()
+            logger.info(f"用户画像写缓冲已关闭: 刷写 {written} 个画像，耗时 {time.monotonic() - started_at:.3f}s")
+        except Exception as e:
+            logger.error(f"关闭时刷写用户画像失败，{len(self._dirty)} 个画像未落库（由对账任务补齐）: {e}")
+
+    def summary(self) -> Dict[str, Any]:
+        """导出指标摘要"""
+        return {
+            "running": self.running,
+            "dirty": len(self._dirty),
+            "puts": self.stats.puts,
+            "superseded": self.stats.superseded,
+            "flushes": self.stats.flushes,
+            "rows_written": self.stats.rows_written,
+            "statements": self.stats.statements,
+            "failures": self.stats.failures,
+            "dropped": self.stats.dropped,
+        }
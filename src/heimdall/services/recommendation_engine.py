@@ -6,21 +6,97 @@
 import asyncio
 import json
 import logging
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, text, func
 from collections import defaultdict, Counter
 import math
 
-from src.heimdall.core.database import get_db
+from src.heimdall.core.config import settings
+from src.heimdall.core.database import get_db, AsyncSessionLocal
+from src.heimdall.services.similar_user_index import SimilarUserIndex
+from src.heimdall.services.profile_write_buffer import ProfileWriteBuffer, encode_profile
+from src.heimdall.services.matrix_factorization import FactorModelStore
+from src.heimdall.services.popularity import PopularityService, popularity_service
+from src.heimdall.services.behavior_partitions import behavior_window_start
 
 logger = logging.getLogger("heimdall.recommendation_engine")
 
+# 倒数排名融合（RRF）的平滑常数
+RRF_K = 60
+
+# 画像偏好的指数时间衰减速率（每天）
+PROFILE_DECAY_PER_DAY = 0.1
+
+
+def decay_factor(since: datetime, now: datetime) -> float:
+    """从 since 衰减到 now 的系数（连续时间指数衰减）"""
+    days = max((now - since).total_seconds() / 86400.0, 0.0)
+    return math.exp(-days * PROFILE_DECAY_PER_DAY)
+
+
+def _parse_timestamp(value: Any, default: datetime) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def accumulate(value: float, last: datetime, weight: float, occurred_at: datetime) -> Tuple[float, datetime]:
+    """
+    把一次行为的权重加到时间戳为 last 的衰减累加器上，返回 (新值, 新时间戳)
+
+    行为晚于累加器时先把累加器衰减到行为时间；早于累加器（乱序到达）时把权重衰减到累加器时间，
+    时间戳不回退。
+    """
+    if occurred_at >= last:
+        return value * decay_factor(last, occurred_at) + weight, occurred_at
+    return value + weight * decay_factor(occurred_at, last), last
+
+class KeyedLocks:
+    """按键（用户ID）划分的进程内互斥锁，无人持有或等待时回收"""
+    
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._holders: Dict[str, int] = {}
+    
+    def __len__(self) -> int:
+        return len(self._locks)
+    
+    @asynccontextmanager
+    async def hold(self, key: str):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._holders[key] = self._holders.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._holders[key] -= 1
+            if not self._holders[key]:
+                del self._holders[key]
+                del self._locks[key]
+
+
 class EnterpriseRecommendationEngine:
     """企业级推荐引擎"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], AsyncSession]] = None,
+        popularity: Optional[PopularityService] = None
+    ):
+        # 混合推荐各分支使用的独立会话工厂（未配置时分支在请求会话上串行执行）
+        self.session_factory = session_factory
+        
+        # 产品行为热度（后台增量刷新，未加载前热门产品回退到按评分查询）
+        self.popularity_service = popularity or PopularityService()
+        
         self.behavior_weights = {
             'purchase': 3.0,    # 购买权重最高
             'click': 1.5,       # 点击次之
@@ -34,10 +110,27 @@ class EnterpriseRecommendationEngine:
             'view': 0.7,        # 查看行为衰减较快
             'search': 0.6       # 搜索行为衰减最快
         }
+        
+        # 相似用户 MinHash/LSH 索引（画像保存时增量更新）
+        self.similar_user_index = SimilarUserIndex(self.calculate_similarity)
+        
+        # 用户画像写缓冲（在应用 lifespan 中启动；未启动时画像直接写库）
+        self.profile_write_buffer = ProfileWriteBuffer()
+        
+        # 同一用户的画像修改（增量更新与全量重建）在进程内串行，避免在写缓冲中互相覆盖
+        self.profile_locks = KeyedLocks()
+        
+        # 矩阵分解模型（离线训练产物，内存映射加载）
+        self.factor_model_store = FactorModelStore()
     
     async def get_user_profile(self, user_id: str, db: AsyncSession) -> Dict[str, Any]:
         """获取用户画像"""
         try:
+            # 优先读取写缓冲中尚未落库的画像
+            buffered = self.profile_write_buffer.get(user_id)
+            if buffered is not None:
+                return buffered
+            
             # 从用户画像表获取数据
             query = text("""
                 SELECT profile_data FROM user_profiles 
@@ -57,73 +150,81 @@ class EnterpriseRecommendationEngine:
             return {}
     
     async def build_user_profile(self, user_id: str, db: AsyncSession) -> Dict[str, Any]:
-        """基于行为数据构建用户画像"""
+        """
+        基于行为数据构建用户画像
+        
+        时间衰减权重与按类别、品牌、总体的聚合都在数据库中完成（GROUPING SETS，一次查询），
+        只读取类型化列，可走 (user_id, created_at) 覆盖索引；返回的行数与用户行为数量无关。
+        与同一用户的增量更新互斥执行。
+        """
+        async with self.profile_locks.hold(user_id):
+            return await self._build_user_profile(user_id, db)
+    
+    async def _build_user_profile(self, user_id: str, db: AsyncSession) -> Dict[str, Any]:
         try:
-            # 获取用户最近30天的行为数据
+            # 获取用户最近30天的行为聚合：level 1 为类别行，2 为品牌行，3 为总计行
             query = text("""
-                SELECT behavior_type, behavior_data, created_at 
-                FROM user_behaviors 
-                WHERE user_id = :user_id 
-                AND created_at >= :cutoff_date
-                ORDER BY created_at DESC
+                WITH events AS (
+                    SELECT ub.category, ub.brand, ub.price, ub.created_at,
+                           COALESCE(w.weight, 1.0) * EXP(
+                               -GREATEST(EXTRACT(EPOCH FROM (now() - ub.created_at)), 0) / 86400.0 * :decay_per_day
+                           ) AS weight
+                    FROM user_behaviors ub
+                    LEFT JOIN unnest(CAST(:weight_types AS TEXT[]), CAST(:weight_values AS FLOAT8[]))
+                        AS w(behavior_type, weight) ON w.behavior_type = ub.behavior_type
+                    WHERE ub.user_id = :user_id 
+                    AND ub.created_at >= :cutoff_date
+                )
+                SELECT GROUPING(category, brand) AS level, category, brand,
+                       SUM(weight), COUNT(*), MIN(price), MAX(price), MAX(created_at)
+                FROM events
+                GROUP BY GROUPING SETS ((category), (brand), ())
             """)
             
             cutoff_date = datetime.now() - timedelta(days=30)
             result = await db.execute(query, {
                 "user_id": user_id,
-                "cutoff_date": cutoff_date
+                "cutoff_date": cutoff_date,
+                "decay_per_day": PROFILE_DECAY_PER_DAY,
+                "weight_types": list(self.behavior_weights.keys()),
+                "weight_values": [float(weight) for weight in self.behavior_weights.values()]
             })
             
-            behaviors = result.fetchall()
-            
-            if not behaviors:
+            category_scores = {}
+            brand_scores = {}
+            total = None
+            for level, category, brand, weight, count, min_price, max_price, last_activity in result.fetchall():
+                if level == 1 and category is not None:
+                    category_scores[category] = float(weight or 0.0)
+                elif level == 2 and brand is not None:
+                    brand_scores[brand] = float(weight or 0.0)
+                elif level == 3:
+                    total = (float(weight or 0.0), count, min_price, max_price, last_activity)
+            
+            if total is None or not total[1]:
                 return {"user_id": user_id, "preferences": {}, "activity_level": 0}
             
-            # 分析用户偏好
-            category_scores = defaultdict(float)
-            brand_scores = defaultdict(float)
-            price_range = {"min": float('inf'), "max": 0}
-            total_behavior_score = 0
-            
-            for behavior in behaviors:
-                behavior_type = behavior[0]
-                behavior_data = behavior[1]
-                created_at = behavior[2]
-                
-                # 计算时间衰减权重
-                days_ago = (datetime.now() - created_at).days
-                time_decay = math.exp(-days_ago * 0.1)  # 指数衰减
-                
-                # 基础权重
-                weight = self.behavior_weights.get(behavior_type, 1.0) * time_decay
-                
-                # 分析类别偏好
-                if 'category' in behavior_data:
-                    category = behavior_data['category']
-                    category_scores[category] += weight
-                
-                # 分析品牌偏好
-                if 'brand' in behavior_data:
-                    brand = behavior_data['brand']
-                    brand_scores[brand] += weight
-                
-                # 分析价格偏好
-                if 'price' in behavior_data:
-                    price = behavior_data['price']
-                    price_range['min'] = min(price_range['min'], price)
-                    price_range['max'] = max(price_range['max'], price)
-                
-                total_behavior_score += weight
+            total_behavior_score, behavior_count, min_price, max_price, last_activity = total
+            price_range = {
+                "min": float(min_price) if min_price is not None else float('inf'),
+                "max": float(max_price) if max_price is not None else 0
+            }
             
             # 构建画像
+            now = datetime.now()
+            now_iso = now.isoformat()
             profile = {
                 "user_id": user_id,
-                "category_preferences": dict(category_scores),
-                "brand_preferences": dict(brand_scores),
+                "category_preferences": category_scores,
+                "brand_preferences": brand_scores,
                 "price_range": price_range,
                 "activity_level": total_behavior_score,
-                "last_activity": behaviors[0][2] if behaviors else datetime.now(),
-                "behavior_count": len(behaviors)
+                "last_activity": last_activity or now,
+                "behavior_count": behavior_count,
+                # 各累加器的衰减基准时间，供增量更新使用
+                "category_updated_at": {category: now_iso for category in category_scores},
+                "brand_updated_at": {brand: now_iso for brand in brand_scores},
+                "activity_updated_at": now_iso
             }
             
             # 保存用户画像
@@ -135,9 +236,167 @@ class EnterpriseRecommendationEngine:
             logger.error(f"构建用户画像失败: {e}")
             return {}
     
+    def apply_behavior_delta(
+        self, 
+        profile: Dict[str, Any], 
+        behavior_type: str, 
+        behavior_data: Dict[str, Any], 
+        occurred_at: datetime
+    ) -> Dict[str, Any]:
+        """
+        将一条行为增量应用到画像上
+        
+        每个类别、品牌的偏好值都是带各自时间戳的衰减累加器：先把被命中的累加器衰减到当前时间再加上本次权重，
+        未命中的累加器保持不变，因此单条行为的更新代价与用户历史行为数量无关。
+        早于累加器时间戳的行为按 accumulate 的规则加入，时间戳和最近活跃时间都不回退。
+        """
+        profile = dict(profile)
+        weight = self.behavior_weights.get(behavior_type, 1.0)
+        
+        for key, field_name in (("category", "category_preferences"), ("brand", "brand_preferences")):
+            if key not in behavior_data:
+                continue
+            value = behavior_data[key]
+            preferences = dict(profile.get(field_name) or {})
+            updated_at = dict(profile.get(f"{key}_updated_at") or {})
+            last = _parse_timestamp(updated_at.get(value), occurred_at)
+            preferences[value], updated = accumulate(preferences.get(value, 0.0), last, weight, occurred_at)
+            updated_at[value] = updated.isoformat()
+            profile[field_name] = preferences
+            profile[f"{key}_updated_at"] = updated_at
+        
+        if 'price' in behavior_data:
+            price = behavior_data['price']
+            price_range = dict(profile.get("price_range") or {"min": float('inf'), "max": 0})
+            # 落库时非有限的 min 写为 null，读回后视为无下限
+            current_min, current_max = price_range.get('min'), price_range.get('max')
+            price_range['min'] = price if current_min is None else min(current_min, price)
+            price_range['max'] = price if current_max is None else max(current_max, price)
+            profile["price_range"] = price_range
+        
+        last_activity_update = _parse_timestamp(profile.get("activity_updated_at"), occurred_at)
+        profile["activity_level"], activity_updated = accumulate(
+            profile.get("activity_level", 0), last_activity_update, weight, occurred_at
+        )
+        profile["activity_updated_at"] = activity_updated.isoformat()
+        profile["last_activity"] = max(_parse_timestamp(profile.get("last_activity"), occurred_at), occurred_at)
+        profile["behavior_count"] = profile.get("behavior_count", 0) + 1
+        profile["user_id"] = profile.get("user_id", "")
+        return profile
+    
+    def decayed_preferences(
+        self, 
+        profile: Dict[str, Any], 
+        key: str, 
+        now: Optional[datetime] = None
+    ) -> Dict[str, float]:
+        """把类别（key="category"）或品牌（key="brand"）累加器统一衰减到同一时间点后返回"""
+        now = now or datetime.now()
+        preferences = profile.get(f"{key}_preferences") or {}
+        updated_at = profile.get(f"{key}_updated_at") or {}
+        return {
+            name: value * decay_factor(_parse_timestamp(updated_at.get(name), now), now)
+            for name, value in preferences.items()
+        }
+    
+    async def apply_behavior_event(
+        self, 
+        user_id: str, 
+        behavior_type: str, 
+        behavior_data: Dict[str, Any], 
+        db: AsyncSession,
+        occurred_at: Optional[datetime] = None
+    ) -> Dict[str, Any]:
+        """记录行为后增量更新用户画像（读取并锁定一行画像，应用增量后写回）"""
+        return await self.apply_behavior_events(
+            user_id, [(behavior_type, behavior_data, occurred_at or datetime.now())], db
+        )
+    
+    async def apply_behavior_events(
+        self, 
+        user_id: str, 
+        events: List[Tuple[str, Dict[str, Any], datetime]], 
+        db: AsyncSession
+    ) -> Dict[str, Any]:
+        """
+        按时间顺序将同一用户的多条行为增量合并应用，只读取、写回画像各一次
+        
+        与同一用户的其他增量更新、全量重建互斥执行；写缓冲未运行时画像在同一事务中
+        读取（FOR UPDATE）并写回，运行时由进程内锁保证读改写不被覆盖。
+        """
+        async with self.profile_locks.hold(user_id):
+            return await self._apply_behavior_events(user_id, events, db)
+    
+    async def _apply_behavior_events(
+        self, 
+        user_id: str, 
+        events: List[Tuple[str, Dict[str, Any], datetime]], 
+        db: AsyncSession
+    ) -> Dict[str, Any]:
+        try:
+            profile = self.profile_write_buffer.get(user_id)
+            if profile is None:
+                lock_clause = "" if self.profile_write_buffer.running else "FOR UPDATE"
+                query = text(f"""
+                    SELECT profile_data FROM user_profiles 
+                    WHERE user_id = :user_id
+                    {lock_clause}
+                """)
+                result = await db.execute(query, {"user_id": user_id})
+                row = result.fetchone()
+                profile = row[0] if row else None
+            if isinstance(profile, str):
+                profile = json.loads(profile)
+            if not isinstance(profile, dict):
+                profile = {"user_id": user_id}
+            
+            for behavior_type, behavior_data, occurred_at in sorted(events, key=lambda event: event[2]):
+                profile = self.apply_behavior_delta(profile, behavior_type, behavior_data or {}, occurred_at)
+            profile["user_id"] = user_id
+            await self.save_user_profile(user_id, profile, db)
+            return profile
+            
+        except Exception as e:
+            logger.error(f"增量更新用户画像失败: {e}")
+            await db.rollback()
+            return {}
+    
+    async def reconcile_profiles(self, db: AsyncSession, since: datetime) -> int:
+        """对账：为 since 之后有行为的用户全量重建画像，纠正增量累加的偏差并裁剪30天以外的数据"""
+        query = text("""
+            SELECT DISTINCT user_id FROM user_behaviors 
+            WHERE created_at >= :since
+        """)
+        result = await db.execute(query, {"since": since})
+        user_ids = [row[0] for row in result.fetchall()]
+        
+        for user_id in user_ids:
+            await self.build_user_profile(user_id, db)
+        
+        logger.info(f"用户画像对账完成: {len(user_ids)} 个用户")
+        return len(user_ids)
+    
+    async def run_profile_reconciler(self, session_factory) -> None:
+        """后台对账任务：按 PROFILE_RECONCILE_INTERVAL_SECONDS 周期全量重建近期活跃用户的画像"""
+        interval = settings.PROFILE_RECONCILE_INTERVAL_SECONDS
+        since = datetime.now() - timedelta(seconds=interval)
+        while True:
+            await asyncio.sleep(interval)
+            started_at = datetime.now()
+            try:
+                async with session_factory() as session:
+                    await self.reconcile_profiles(session, since)
+                since = started_at
+            except Exception as e:
+                logger.error(f"用户画像对账失败: {e}")
+    
     async def save_user_profile(self, user_id: str, profile: Dict[str, Any], db: AsyncSession):
-        """保存用户画像"""
+        """保存用户画像（写缓冲运行时只更新内存中的最新版本，由缓冲批量落库）"""
         try:
+            if self.profile_write_buffer.put(user_id, profile):
+                self.similar_user_index.upsert(user_id, profile)
+                return
+            
             query = text("""
                 INSERT INTO user_profiles (user_id, profile_data, created_at, updated_at)
                 VALUES (:user_id, :profile_data, :created_at, :updated_at)
@@ -149,45 +408,50 @@ class EnterpriseRecommendationEngine:
             
             await db.execute(query, {
                 "user_id": user_id,
-                "profile_data": json.dumps(profile, ensure_ascii=False, default=str),
+                "profile_data": encode_profile(profile),
                 "created_at": datetime.now(),
                 "updated_at": datetime.now()
             })
             
             await db.commit()
             
+            # 同步更新相似用户索引
+            self.similar_user_index.upsert(user_id, profile)
+            
         except Exception as e:
             logger.error(f"保存用户画像失败: {e}")
             await db.rollback()
     
     async def get_similar_users(self, user_id: str, db: AsyncSession, limit: int = 10) -> List[str]:
         """获取相似用户"""
+        similar_users = await self.get_similar_users_with_scores(user_id, db, limit)
+        return [similar_user for similar_user, _ in similar_users]
+    
+    async def get_similar_users_with_scores(
+        self, 
+        user_id: str, 
+        db: AsyncSession, 
+        limit: int = 10,
+        user_profile: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        获取相似用户及相似度
+        
+        通过 MinHash/LSH 索引召回候选用户，只对候选计算精确相似度，不再逐次扫描全部用户画像；
+        SIMILAR_USERS_BACKEND=ann 时改用矩阵分解用户隐向量的近似最近邻
+        """
         try:
-            # 获取当前用户的画像
-            current_profile = await self.get_user_profile(user_id, db)
+            # 获取当前用户的画像（调用方已加载时直接复用）
+            current_profile = user_profile if user_profile is not None else await self.get_user_profile(user_id, db)
             if not current_profile:
                 return []
             
-            # 获取所有用户画像
-            query = text("""
-                SELECT user_id, profile_data FROM user_profiles 
-                WHERE user_id != :user_id
-            """)
-            result = await db.execute(query, {"user_id": user_id})
-            all_profiles = result.fetchall()
-            
-            # 计算相似度
-            similarities = []
-            for profile_row in all_profiles:
-                other_user_id = profile_row[0]
-                other_profile = profile_row[1]
-                
-                similarity = self.calculate_similarity(current_profile, other_profile)
-                similarities.append((other_user_id, similarity))
+            if settings.SIMILAR_USERS_BACKEND == "ann":
+                model = self.factor_model_store.current()
+                if model is not None and user_id in model:
+                    return model.similar_users(user_id, limit)
             
-            # 排序并返回最相似的用户
-            similarities.sort(key=lambda x: x[1], reverse=True)
-            return [user_id for user_id, _ in similarities[:limit]]
+            return self.similar_user_index.query(current_profile, limit, exclude=user_id)
             
         except Exception as e:
             logger.error(f"获取相似用户失败: {e}")
@@ -228,7 +492,8 @@ class EnterpriseRecommendationEngine:
     async def get_user_behavior_products(self, user_id: str, db: AsyncSession) -> List[int]:
         """获取用户行为相关的产品ID"""
         try:
-            # 获取用户查看、点击、购买过的产品
+            # 获取用户查看、点击、购买过的产品（用于排除已交互产品，读取保留期内的全部行为，
+            # 不按 BEHAVIOR_QUERY_WINDOW_DAYS 截断）
             query = text("""
                 SELECT DISTINCT product_id
                 FROM user_behaviors 
@@ -247,6 +512,41 @@ class EnterpriseRecommendationEngine:
             logger.error(f"获取用户行为产品失败: {e}")
             return []
     
+    async def get_users_behavior_products(
+        self, 
+        user_ids: List[str], 
+        db: AsyncSession
+    ) -> List[Tuple[str, int, str]]:
+        """批量获取多个用户交互过的产品，返回 (user_id, product_id, behavior_type)"""
+        if not user_ids:
+            return []
+        try:
+            query = text("""
+                SELECT DISTINCT user_id, product_id, behavior_type
+                FROM user_behaviors 
+                WHERE user_id = ANY(:user_ids)
+                AND created_at >= :since
+                AND product_id IS NOT NULL
+                AND product_id != 0
+                AND behavior_type IN ('view', 'click', 'purchase')
+            """)
+            
+            result = await db.execute(query, {"user_ids": list(user_ids), "since": behavior_window_start()})
+            rows = []
+            for user_id, product_id, behavior_type in result.fetchall():
+                if not product_id:
+                    continue
+                if isinstance(product_id, str):
+                    if not product_id.isdigit():
+                        continue
+                    product_id = int(product_id)
+                rows.append((str(user_id), product_id, behavior_type))
+            return rows
+            
+        except Exception as e:
+            logger.error(f"批量获取用户行为产品失败: {e}")
+            return []
+    
     async def recommend_products(
         self, 
         user_id: str, 
@@ -264,9 +564,17 @@ class EnterpriseRecommendationEngine:
             
             # 根据策略推荐
             if strategy == "collaborative":
-                return await self.collaborative_filtering(user_id, db, limit, interacted_products)
+                return await self.collaborative_filtering(
+                    user_id, db, limit, interacted_products, user_profile=user_profile
+                )
             elif strategy == "content":
                 return await self.content_based_filtering(user_profile, db, limit, interacted_products)
+            elif strategy == "factorized":
+                recommendations = await self.factorized_recommendations(user_id, db, limit, interacted_products)
+                if recommendations:
+                    return recommendations
+                # 模型未训练或用户不在模型中时回退到混合推荐
+                return await self.hybrid_recommendations(user_id, user_profile, db, limit, interacted_products)
             else:  # hybrid
                 return await self.hybrid_recommendations(user_id, user_profile, db, limit, interacted_products)
                 
@@ -279,45 +587,64 @@ class EnterpriseRecommendationEngine:
         user_id: str, 
         db: AsyncSession, 
         limit: int,
-        interacted_products: List[int]
+        interacted_products: List[int],
+        user_profile: Optional[Dict[str, Any]] = None
     ) -> List[Dict[str, Any]]:
-        """协同过滤推荐"""
+        """
+        协同过滤推荐
+        
+        一次批量查询取回全部相似用户的交互产品，按"相似度 x 行为权重"投票排序候选产品
+        """
         try:
-            # 获取相似用户
-            similar_users = await self.get_similar_users(user_id, db, limit=20)
+            # 获取相似用户及相似度
+            similar_users = await self.get_similar_users_with_scores(
+                user_id, db, limit=20, user_profile=user_profile
+            )
             
             if not similar_users:
                 return []
             
-            # 获取相似用户喜欢的产品
-            similar_user_products = set()
-            for similar_user in similar_users:
-                products = await self.get_user_behavior_products(similar_user, db)
-                similar_user_products.update(products)
+            # 相似用户的交互产品（一次查询）
+            neighbour_products = await self.get_users_behavior_products(
+                [similar_user for similar_user, _ in similar_users], db
+            )
+            
+            # 相似用户投票：每个相似用户对每个产品按其最强行为计一票，票数按相似度加权
+            similarity_by_user = dict(similar_users)
+            strongest: Dict[Tuple[str, int], float] = {}
+            for neighbour, product_id, behavior_type in neighbour_products:
+                weight = self.behavior_weights.get(behavior_type, 1.0)
+                key = (neighbour, product_id)
+                strongest[key] = max(strongest.get(key, 0.0), weight)
+            
+            votes: Dict[int, float] = defaultdict(float)
+            for (neighbour, product_id), weight in strongest.items():
+                votes[product_id] += similarity_by_user.get(neighbour, 0.0) * weight
             
             # 排除用户已经交互过的产品
-            candidate_products = similar_user_products - set(interacted_products)
+            for product_id in interacted_products:
+                votes.pop(product_id, None)
             
-            if not candidate_products:
+            if not votes:
                 return []
             
+            # 只取得票最高的一批候选查询详情（预留余量给下架产品）
+            top_candidates = sorted(votes, key=lambda pid: votes[pid], reverse=True)[:max(limit, 1) * 4]
+            
             # 获取产品详情
             query = text("""
                 SELECT id, name, description, price, category, brand, image_url, tags, attributes, rating, review_count
                 FROM products 
                 WHERE id = ANY(:product_ids)
                 AND is_active = true
-                ORDER BY rating DESC, review_count DESC
-                LIMIT :limit
             """)
             
-            result = await db.execute(query, {
-                "product_ids": list(candidate_products),
-                "limit": limit
-            })
+            result = await db.execute(query, {"product_ids": top_candidates})
             
+            max_vote = max(votes.values()) or 1.0
             products = []
             for row in result.fetchall():
+                vote = votes.get(row[0], 0.0)
                 products.append({
                     "id": row[0],
                     "name": row[1],
@@ -331,15 +658,77 @@ class EnterpriseRecommendationEngine:
                     "rating": row[9],
                     "review_count": row[10],
                     "recommendation_reason": "基于相似用户行为推荐",
-                    "relevance_score": 0.85  # 默认相关度
+                    "relevance_score": round(vote / max_vote, 3) if max_vote > 0 else 0.0
                 })
             
-            return products
+            # 按相似用户投票排序，同票时按评分、评论数排序
+            products.sort(
+                key=lambda p: (votes.get(p["id"], 0.0), p["rating"] or 0, p["review_count"] or 0),
+                reverse=True
+            )
+            return products[:limit]
             
         except Exception as e:
             logger.error(f"协同过滤推荐失败: {e}")
             return []
     
+    async def factorized_recommendations(
+        self, 
+        user_id: str, 
+        db: AsyncSession, 
+        limit: int,
+        interacted_products: List[int]
+    ) -> List[Dict[str, Any]]:
+        """
+        矩阵分解推荐
+        
+        用户隐向量与全部产品隐向量做一次矩阵向量乘法打分；模型不可用时返回空列表
+        """
+        try:
+            model = self.factor_model_store.current()
+            if model is None or user_id not in model:
+                return []
+            
+            # 预留余量给下架产品
+            scored = model.recommend(user_id, max(limit, 1) * 2, exclude=interacted_products)
+            if not scored:
+                return []
+            scores = dict(scored)
+            
+            query = text("""
+                SELECT id, name, description, price, category, brand, image_url, tags, attributes, rating, review_count
+                FROM products 
+                WHERE id = ANY(:product_ids)
+                AND is_active = true
+            """)
+            result = await db.execute(query, {"product_ids": list(scores)})
+            
+            max_score = max(max(scores.values()), 1e-9)
+            products = []
+            for row in result.fetchall():
+                products.append({
+                    "id": row[0],
+                    "name": row[1],
+                    "description": row[2],
+                    "price": row[3],
+                    "category": row[4],
+                    "brand": row[5],
+                    "image_url": row[6],
+                    "tags": row[7],
+                    "attributes": row[8],
+                    "rating": row[9],
+                    "review_count": row[10],
+                    "recommendation_reason": "基于用户行为隐向量推荐",
+                    "relevance_score": round(max(scores[row[0]], 0.0) / max_score, 3)
+                })
+            
+            products.sort(key=lambda p: scores[p["id"]], reverse=True)
+            return products[:limit]
+            
+        except Exception as e:
+            logger.error(f"矩阵分解推荐失败: {e}")
+            return []
+    
     async def content_based_filtering(
         self, 
         user_profile: Dict[str, Any], 
@@ -349,9 +738,9 @@ class EnterpriseRecommendationEngine:
     ) -> List[Dict[str, Any]]:
         """基于内容的推荐"""
         try:
-            # 获取用户偏好的类别和品牌
-            category_preferences = user_profile.get('category_preferences', {})
-            brand_preferences = user_profile.get('brand_preferences', {})
+            # 获取用户偏好的类别和品牌（各累加器衰减到同一时间点后再比较）
+            category_preferences = self.decayed_preferences(user_profile, "category")
+            brand_preferences = self.decayed_preferences(user_profile, "brand")
             
             if not category_preferences and not brand_preferences:
                 return []
@@ -424,34 +813,72 @@ class EnterpriseRecommendationEngine:
         limit: int,
         interacted_products: List[int]
     ) -> List[Dict[str, Any]]:
-        """混合推荐"""
+        """
+        混合推荐
+        
+        协同过滤与内容推荐两个分支在各自的会话上并发执行，复用已加载的画像与交互产品，
+        再按倒数排名融合（RRF）合并两个排序列表
+        """
         try:
-            # 获取协同过滤推荐
-            cf_recommendations = await self.collaborative_filtering(user_id, db, limit // 2, interacted_products)
-            
-            # 获取基于内容的推荐
-            content_recommendations = await self.content_based_filtering(user_profile, db, limit // 2, interacted_products)
-            
-            # 合并推荐结果
-            all_recommendations = cf_recommendations + content_recommendations
-            
-            # 去重
-            seen_ids = set()
-            unique_recommendations = []
-            for rec in all_recommendations:
-                if rec['id'] not in seen_ids:
-                    seen_ids.add(rec['id'])
-                    unique_recommendations.append(rec)
-            
-            # 按评分和推荐理由排序
-            unique_recommendations.sort(key=lambda x: (x['rating'], x['review_count']), reverse=True)
-            
-            return unique_recommendations[:limit]
+            db_lock = asyncio.Lock()
+            cf_recommendations, content_recommendations = await asyncio.gather(
+                self._with_session(db, db_lock, lambda session: self.collaborative_filtering(
+                    user_id, session, limit, interacted_products, user_profile=user_profile
+                )),
+                self._with_session(db, db_lock, lambda session: self.content_based_filtering(
+                    user_profile, session, limit, interacted_products
+                ))
+            )
+            
+            return self.fuse_rankings([cf_recommendations, content_recommendations], limit)
             
         except Exception as e:
             logger.error(f"混合推荐失败: {e}")
             return []
     
+    async def _with_session(
+        self, 
+        db: AsyncSession, 
+        db_lock: asyncio.Lock, 
+        work: Callable[[AsyncSession], Awaitable[Any]]
+    ) -> Any:
+        """在独立的连接池会话上执行 work；未配置会话工厂时在请求会话上串行执行"""
+        if self.session_factory is None:
+            # 同一个 AsyncSession 不支持并发执行查询
+            async with db_lock:
+                return await work(db)
+        async with self.session_factory() as session:
+            return await work(session)
+    
+    @staticmethod
+    def fuse_rankings(rankings: List[List[Dict[str, Any]]], limit: int) -> List[Dict[str, Any]]:
+        """
+        倒数排名融合：每个产品得分为其在各列表中 1 / (RRF_K + 名次) 之和
+        
+        同分时按评分、评论数排序；relevance_score 为融合得分相对最高分的比例
+        """
+        fused: Dict[Any, float] = defaultdict(float)
+        first_seen: Dict[Any, Dict[str, Any]] = {}
+        for ranking in rankings:
+            for rank, recommendation in enumerate(ranking, start=1):
+                product_id = recommendation['id']
+                fused[product_id] += 1.0 / (RRF_K + rank)
+                first_seen.setdefault(product_id, recommendation)
+        
+        if not fused:
+            return []
+        
+        ordered = sorted(
+            fused,
+            key=lambda pid: (fused[pid], first_seen[pid].get('rating') or 0, first_seen[pid].get('review_count') or 0),
+            reverse=True
+        )[:limit]
+        best = fused[ordered[0]]
+        return [
+            {**first_seen[pid], "relevance_score": round(fused[pid] / best, 3)}
+            for pid in ordered
+        ]
+    
     async def record_recommendation(
         self, 
         user_id: str, 
@@ -483,7 +910,11 @@ class EnterpriseRecommendationEngine:
             await db.rollback()
     
     async def get_popular_products(self, db: AsyncSession, limit: int = 10) -> List[Dict[str, Any]]:
-        """获取热门产品推荐"""
+        """获取热门产品推荐：优先读取内存中按行为热度排好的榜单，热度未加载时按评分查询"""
+        ranked = self.popularity_service.top(limit)
+        if ranked is not None:
+            return [self._format_popular_product(product) for product in ranked]
+        
         try:
             query = text("""
                 SELECT id, name, description, price, category, brand, image_url, tags, attributes, rating, review_count
@@ -518,10 +949,30 @@ class EnterpriseRecommendationEngine:
             logger.error(f"获取热门产品失败: {e}")
             return []
     
+    def _format_popular_product(self, product: Dict[str, Any]) -> Dict[str, Any]:
+        """热度榜单中的产品转换为与按评分查询一致的响应格式"""
+        return {
+            "product_id": str(product["id"]),
+            "title": product["name"],
+            "description": product["description"],
+            "price": float(product["price"]) if product["price"] else 0,
+            "category": self._get_category_name(product["category"]),
+            "brand": product["brand"],
+            "image_url": product["image_url"],
+            "rating": float(product["rating"]) if product["rating"] else 0,
+            "review_count": product["review_count"] if product["review_count"] else 0,
+            "relevance_score": 0.8,  # 默认相关度
+            "tags": product["tags"] or [],
+            "attributes": product["attributes"] or {}
+        }
+    
     def _get_category_name(self, category: str) -> str:
         """根据类别ID获取类别名称"""
         # 直接返回类别名称
         return category or "其他"
 
 # 全局推荐引擎实例
-recommendation_engine = EnterpriseRecommendationEngine()
\ No newline at end of file
+recommendation_engine = EnterpriseRecommendationEngine(
+    session_factory=AsyncSessionLocal,
+    popularity=popularity_service
+)
\ No newline at end of file
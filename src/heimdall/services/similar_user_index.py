@@ -0,0 +1,270 @@
+"""
+相似用户 MinHash/LSH 索引
+为每个用户的类别集合与品牌集合分别计算 MinHash 签名，按 LSH 分带建立内存倒排桶；
+查询时只对与当前用户至少共享一个桶的候选用户计算精确相似度。
+索引由后台任务从 user_profiles 周期性全量重建后整体替换，请求路径只查询
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple, Iterable, Callable, Set
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+
+from src.heimdall.core.config import settings
+
+logger = logging.getLogger("heimdall.similar_user_index")
+
+# 分别建立签名的画像字段
+PROFILE_FIELDS = ("category_preferences", "brand_preferences")
+
+
+def _token_hash(token: str) -> int:
+    """稳定的64位token哈希（不受 PYTHONHASHSEED 影响）"""
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def profile_feature_sets(profile: Dict[str, Any]) -> Tuple[frozenset, ...]:
+    """从画像中提取参与相似度计算的集合（类别、品牌）"""
+    sets = []
+    for field_name in PROFILE_FIELDS:
+        preferences = profile.get(field_name) or {}
+        sets.append(frozenset(str(key) for key in preferences))
+    return tuple(sets)
+
+
+class MinHasher:
+    """
+    确定性的 MinHash 签名计算器
+
+    第 i 个哈希函数为 splitmix64(token_hash XOR seed_i)，各哈希函数之间的取值顺序相互独立；
+    uint64 乘法按 2^64 回绕，正是 splitmix64 所需的运算。
+    """
+
+    def __init__(self, num_perm: int, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.seeds = rng.randint(0, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self.num_perm = num_perm
+
+    @staticmethod
+    def _mix(z: np.ndarray) -> np.ndarray:
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+    def signature(self, tokens: Iterable[str]) -> Optional[np.ndarray]:
+        """计算集合的签名；空集合返回 None"""
+        hashes = np.array([_token_hash(token) for token in tokens], dtype=np.uint64)
+        if len(hashes) == 0:
+            return None
+        with np.errstate(over="ignore"):
+            return self._mix(hashes[:, None] ^ self.seeds[None, :]).min(axis=0)
+
+
+class SimilarUserIndex:
+    """
+    相似用户 LSH 索引
+
+    - 类别、品牌集合各自计算 num_perm 维签名，每 band_rows 行为一个带，
+      任一带完全相同的用户互为候选（两个 Jaccard 中任一足够高即可召回）
+    - 候选用户用 similarity 回调计算精确相似度后排序，因此返回的分数与全量计算一致，
+      近似只体现在候选召回上
+    - 候选过多时优先保留命中带数最多的用户（命中带数与 Jaccard 正相关）
+    """
+
+    def __init__(
+        self,
+        similarity: Callable[[Dict[str, Any], Dict[str, Any]], float],
+        num_perm: int = 48,
+        band_rows: int = 3,
+        max_candidates: int = 2000,
+        seed: int = 1
+    ):
+        if num_perm % band_rows:
+            raise ValueError("num_perm 必须是 band_rows 的整数倍")
+        self.similarity = similarity
+        self.band_rows = band_rows
+        self.max_candidates = max_candidates
+        self.hasher = MinHasher(num_perm, seed)
+        self.loaded_at: Optional[float] = None
+        self._buckets: Dict[Tuple[int, int, bytes], Set[str]] = {}
+        self._users: Dict[str, Tuple[Dict[str, Any], Tuple[Tuple[int, int, bytes], ...], int]] = {}
+        self._sequence = 0
+        self._lock = asyncio.Lock()
+        # 全量重建进行中时记录期间的增量修改（user_id -> 画像，None 表示移除），替换后重新应用
+        self._pending: Optional[Dict[str, Optional[Dict[str, Any]]]] = None
+        self.reloads = 0
+        self.last_load_seconds = 0.0
+        # 查询指标：累计查询次数与精确打分的候选用户数
+        self.queries = 0
+        self.candidates_scored = 0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._users
+
+    def _band_keys(self, profile: Dict[str, Any]) -> Tuple[Tuple[int, int, bytes], ...]:
+        keys = []
+        for field_index, tokens in enumerate(profile_feature_sets(profile)):
+            signature = self.hasher.signature(sorted(tokens))
+            if signature is None:
+                continue
+            for band in range(0, len(signature), self.band_rows):
+                keys.append((field_index, band, signature[band:band + self.band_rows].tobytes()))
+        return tuple(keys)
+
+    @staticmethod
+    def _compact(profile: Dict[str, Any]) -> Dict[str, Any]:
+        """只保留相似度计算需要的字段"""
+        return {
+            field_name: dict.fromkeys((profile.get(field_name) or {}), 1)
+            for field_name in PROFILE_FIELDS
+        }
+
+    def upsert(self, user_id: str, profile: Dict[str, Any]) -> None:
+        """新增或更新用户（画像保存后调用）"""
+        if self._pending is not None:
+            self._pending[user_id] = profile
+        self._remove(user_id)
+        keys = self._band_keys(profile)
+        self._sequence += 1
+        self._users[user_id] = (self._compact(profile), keys, self._sequence)
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(user_id)
+
+    def remove(self, user_id: str) -> None:
+        """从索引中移除用户"""
+        if self._pending is not None:
+            self._pending[user_id] = None
+        self._remove(user_id)
+
+    def _remove(self, user_id: str) -> None:
+        entry = self._users.pop(user_id, None)
+        if entry is None:
+            return
+        for key in entry[1]:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(user_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def query(
+        self,
+        profile: Dict[str, Any],
+        limit: int,
+        exclude: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        """返回近似的 top-k 相似用户及其精确相似度（降序）"""
+        band_hits: Counter = Counter()
+        for key in self._band_keys(profile):
+            bucket = self._buckets.get(key)
+            if bucket:
+                band_hits.update(bucket)
+        band_hits.pop(exclude, None)
+
+        if len(band_hits) > self.max_candidates:
+            candidates = [user_id for user_id, _ in band_hits.most_common(self.max_candidates)]
+        else:
+            candidates = list(band_hits)
+        self.queries += 1
+        self.candidates_scored += len(candidates)
+
+        scored = []
+        for user_id in candidates:
+            compact, _, sequence = self._users[user_id]
+            scored.append((-self.similarity(profile, compact), sequence, user_id))
+        scored.sort()
+        results = [(user_id, -negative) for negative, _, user_id in scored[:limit]]
+
+        # 候选不足时按加入顺序补齐（与全量排序时相似度为0的用户排在末尾一致）
+        if len(results) < limit:
+            chosen = {user_id for user_id, _ in results}
+            for user_id, (compact, _, _) in self._users.items():
+                if len(results) >= limit:
+                    break
+                if user_id == exclude or user_id in chosen:
+                    continue
+                results.append((user_id, self.similarity(profile, compact)))
+        return results
+
+    def _build(self, rows: List[Tuple[Any, Any]]) -> Tuple[Dict[str, Any], Dict[Tuple[int, int, bytes], Set[str]], int]:
+        """由 user_profiles 的行构建一份新的索引数据（纯计算，在线程池中执行）"""
+        users: Dict[str, Tuple[Dict[str, Any], Tuple[Tuple[int, int, bytes], ...], int]] = {}
+        buckets: Dict[Tuple[int, int, bytes], Set[str]] = {}
+        sequence = 0
+        for user_id, profile_data in rows:
+            if isinstance(profile_data, str):
+                try:
+                    profile_data = json.loads(profile_data)
+                except json.JSONDecodeError:
+                    continue
+            if not isinstance(profile_data, dict):
+                continue
+            user_id = str(user_id)
+            keys = self._band_keys(profile_data)
+            sequence += 1
+            users[user_id] = (self._compact(profile_data), keys, sequence)
+            for key in keys:
+                buckets.setdefault(key, set()).add(user_id)
+        return users, buckets, sequence
+
+    async def load(self, db: AsyncSession) -> int:
+        """
+        从 user_profiles 全量重建索引并整体替换，返回用户数
+
+        签名计算在线程池中进行，不阻塞事件循环；构建期间查询继续使用旧索引，
+        构建期间保存的画像在替换后重新应用；已删除的用户随替换一并移除。
+        """
+        async with self._lock:
+            started = time.perf_counter()
+            self._pending = {}
+            try:
+                result = await db.execute(text("SELECT user_id, profile_data FROM user_profiles"))
+                rows = result.fetchall()
+                users, buckets, sequence = await asyncio.to_thread(self._build, rows)
+            except BaseException:
+                self._pending = None
+                raise
+            pending, self._pending = self._pending, None
+            self._users, self._buckets, self._sequence = users, buckets, sequence
+            for user_id, profile in pending.items():
+                if profile is None:
+                    self.remove(user_id)
+                else:
+                    self.upsert(user_id, profile)
+            self.loaded_at = time.monotonic()
+            self.reloads += 1
+            self.last_load_seconds = time.perf_counter() - started
+            logger.info(f"相似用户索引已加载: {len(self._users)} 个用户, {len(self._buckets)} 个LSH桶")
+            return len(self._users)
+
+    async def run_refresher(self, session_factory: Callable[[], Any]) -> None:
+        """后台任务：启动后立即加载，之后按 SIMILAR_USER_INDEX_REFRESH_SECONDS 周期重建（同步其他工作进程写入的画像）"""
+        while True:
+            try:
+                async with session_factory() as session:
+                    await self.load(session)
+            except Exception as e:
+                logger.error(f"相似用户索引加载失败: {e}")
+            await asyncio.sleep(settings.SIMILAR_USER_INDEX_REFRESH_SECONDS)
+
+    def summary(self) -> Dict[str, Any]:
+        """导出指标摘要"""
+        return {
+            "users": len(self._users),
+            "buckets": len(self._buckets),
+            "reloads": self.reloads,
+            "last_load_seconds": round(self.last_load_seconds, 4),
+            "queries": self.queries,
+            "candidates_scored": self.candidates_scored,
+        }
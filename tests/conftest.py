@@ -0,0 +1,17 @@
+# 测试公共配置：在导入应用模块之前提供必需的环境变量，
+# 使 Settings() 在没有 .env 文件的环境下也能完成初始化。
+import os
+
+_TEST_ENV_DEFAULTS = {
+    "LLM_API_KEY": "test-key",
+    "LLM_API_BASE": "http://127.0.0.1:9/v1",
+    "MODEL_NAME": "test-model",
+    "DATABASE_USER": "heimdall",
+    "DATABASE_PASSWORD": "heimdall",
+    "DATABASE_HOST": "127.0.0.1",
+    "DATABASE_PORT": "5432",
+    "DATABASE_NAME": "heimdall_test",
+}
+
+for _key, _value in _TEST_ENV_DEFAULTS.items():
+    os.environ.setdefault(_key, _value)
@@ -0,0 +1,83 @@
+# 测试替身：记录SQL往返次数的内存版 AsyncSession
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+class FakeResult:
+    """模拟 SQLAlchemy Result，支持 fetchall / fetchone / scalar / 迭代"""
+
+    def __init__(self, rows: Optional[Sequence[Sequence[Any]]] = None, rowcount: int = 0):
+        self._rows = [tuple(row) for row in (rows or [])]
+        self.rowcount = rowcount or len(self._rows)
+
+    def fetchall(self) -> List[tuple]:
+        return list(self._rows)
+
+    def fetchone(self) -> Optional[tuple]:
+        return self._rows[0] if self._rows else None
+
+    def scalar(self) -> Any:
+        return self._rows[0][0] if self._rows else None
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class FakeAsyncSession:
+    """
+    按SQL文本路由结果的假会话
+
+    handler(sql, params) 返回 FakeResult；每次 execute 都计入 round_trips，
+    用于断言数据库往返次数。
+    """
+
+    def __init__(self, handler: Callable[[str, Dict[str, Any]], FakeResult]):
+        self.handler = handler
+        self.round_trips = 0
+        self.statements: List[str] = []
+        self.commits = 0
+
+    async def execute(self, statement: Any, params: Optional[Dict[str, Any]] = None) -> FakeResult:
+        sql = str(statement)
+        self.round_trips += 1
+        self.statements.append(sql)
+        return self.handler(sql, params or {})
+
+    async def commit(self) -> None:
+        self.commits += 1
+
+    async def rollback(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def __aenter__(self) -> "FakeAsyncSession":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        pass
+
+
+CATEGORIES = ["电子产品", "运动户外", "家居", "美妆护肤", "服装", "手机", "笔记本", "耳机"]
+BRANDS = ["Apple", "Xiaomi", "Nike", "Adidas", "Dyson", "SK-II", "华为", "联想"]
+
+
+def make_catalog_rows(size: int, seed: int = 7) -> List[tuple]:
+    """生成 _get_all_products 查询格式的产品行（按评分降序）"""
+    import random
+
+    rng = random.Random(seed)
+    rows = []
+    for product_id in range(1, size + 1):
+        rows.append((
+            product_id,
+            f"产品{product_id}",
+            rng.choice(CATEGORIES),
+            rng.choice(BRANDS),
+            float(rng.choice([299, 899, 1299, 3990, 5999, 7999, 8999])),
+            "",
+            round(rng.uniform(3.0, 5.0), 1),
+            "",
+        ))
+    rows.sort(key=lambda row: row[6], reverse=True)
+    return rows
@@ -0,0 +1,100 @@
+# IVF-flat 近似最近邻索引：召回率-延迟曲线、增量添加、内存映射加载、矩阵分解模型接入
+import time
+
+import numpy as np
+
+from src.heimdall.services.ann_index import IVFFlatIndex, brute_force_search
+from src.heimdall.services.matrix_factorization import FactorModel
+
+
+def clustered_vectors(n, dim=32, n_clusters=64, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 1, (n_clusters, dim))
+    return (centers[rng.integers(0, n_clusters, n)] + rng.normal(0, 0.5, (n, dim))).astype(np.float32)
+
+
+def recall(index, vectors, queries, k=10, n_probe=None, normalize=False):
+    hits = 0
+    for query in queries:
+        exact = {i for i, _ in brute_force_search(vectors, query, k, normalize=normalize)}
+        hits += len(exact & {i for i, _ in index.search(query, k, n_probe=n_probe)})
+    return hits / (k * len(queries))
+
+
+def _timed(fn, queries):
+    started = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - started) / len(queries) * 1000
+
+
+def test_recall_latency_curve_against_brute_force():
+    """基准：不同 n_probe 下相对精确 top-10 的召回率与单次查询耗时"""
+    vectors = clustered_vectors(200000)
+    queries = clustered_vectors(100, seed=1)
+    index = IVFFlatIndex.build(vectors, n_lists=512)
+
+    brute_ms = _timed(lambda q: brute_force_search(vectors, q, 10), queries)
+    curve = {}
+    for n_probe in (1, 4, 8, 16, 32):
+        curve[n_probe] = (
+            recall(index, vectors, queries[:50], n_probe=n_probe),
+            _timed(lambda q: index.search(q, 10, n_probe=n_probe), queries),
+        )
+    recalls = [value for value, _ in curve.values()]
+    assert recalls == sorted(recalls), curve
+    assert curve[16][0] >= 0.9, curve
+    assert curve[8][1] < brute_ms, (curve, brute_ms)
+
+
+def test_incremental_add_is_searchable_and_survives_compact():
+    vectors = clustered_vectors(5000)
+    index = IVFFlatIndex.build(vectors, n_lists=32, n_probe=32)
+    extra = clustered_vectors(10, seed=3) * 10
+
+    index.add(extra, ids=np.arange(5000, 5010))
+    assert len(index) == 5010
+    assert index.search(extra[0], 1)[0][0] == 5000
+
+    index.compact()
+    assert index.search(extra[0], 1)[0][0] == 5000
+    # n_probe 等于列表数时结果与暴力搜索一致
+    everything = np.concatenate([vectors, extra])
+    assert [i for i, _ in index.search(extra[3], 5)] == [i for i, _ in brute_force_search(everything, extra[3], 5)]
+
+
+def test_save_and_memory_mapped_load(tmp_path):
+    vectors = clustered_vectors(3000)
+    index = IVFFlatIndex.build(vectors, n_lists=16, n_probe=4, normalize=True)
+    index.add(vectors[:2] * 2, ids=[9001, 9002])
+    index.save(str(tmp_path / "ann"))
+
+    loaded = IVFFlatIndex.load(str(tmp_path / "ann"))
+
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.normalize and loaded.n_probe == 4
+    assert loaded.search(vectors[7], 10, exclude=[7]) == index.search(vectors[7], 10, exclude=[7])
+
+
+def test_factor_model_uses_ann_indexes_for_items_and_similar_users():
+    users = clustered_vectors(2000, dim=16, seed=4)
+    items = clustered_vectors(3000, dim=16, seed=5)
+    user_ids = [f"u{i}" for i in range(len(users))]
+    item_ids = np.arange(100, 100 + len(items))
+    exact = FactorModel("v", user_ids, item_ids, users, items)
+    approximate = FactorModel(
+        "v", user_ids, item_ids, users, items,
+        item_ann=IVFFlatIndex.build(items, n_lists=32, n_probe=32),
+        user_ann=IVFFlatIndex.build(users, n_lists=32, n_probe=32, normalize=True),
+    )
+
+    # 探测全部列表时与精确打分一致
+    def ranked(model):
+        return [pid for pid, _ in model.recommend("u1", 10, exclude=[100, 101])]
+
+    assert ranked(approximate) == ranked(exact)
+    assert not {100, 101} & set(ranked(approximate))
+    similar = approximate.similar_users("u1", 5)
+    assert [user for user, _ in similar] == [user for user, _ in exact.similar_users("u1", 5)]
+    assert "u1" not in {user for user, _ in similar}
+    assert all(0.0 <= score <= 1.0 for _, score in similar)
@@ -0,0 +1,66 @@
+# 行为聚合在数据库中完成：画像与行为分析只读取类型化列、一次查询，按 GROUPING SETS 结果行组装
+import asyncio
+
+from src.heimdall.services.hybrid_recommendation_engine import HybridRecommendationEngine
+from src.heimdall.services.recommendation_engine import EnterpriseRecommendationEngine
+from tests.fakes import FakeAsyncSession, FakeResult
+
+
+def test_hybrid_behavior_profile_reads_grouped_rows():
+    # level, behavior_type, category, brand, score, frequency, group_count
+    rows = [
+        (3, "view", None, None, 3.0, 3, 2),
+        (3, "purchase", None, None, 5.0, 1, 1),
+        (5, None, "手机", None, 7.0, 3, 2),
+        (5, None, "耳机", None, 1.0, 1, 1),
+        (5, None, None, None, 0.0, 0, 0),
+        (6, None, None, "华为", 6.0, 2, 2),
+        (6, None, None, "", 2.0, 2, 1),
+    ]
+    session = FakeAsyncSession(lambda sql, params: FakeResult(rows))
+    engine = HybridRecommendationEngine()
+
+    profile = asyncio.run(engine.get_user_behavior_profile("u1", session))
+
+    assert list(profile["category_preferences"].items()) == [("手机", 7.0), ("耳机", 1.0)]
+    assert profile["brand_preferences"] == {"华为": 6.0}
+    assert profile["behavior_patterns"] == {"view": 3, "purchase": 1}
+    # 与原实现一致：total_behaviors 是读取到的 (行为类型, 产品, 类别, 品牌) 分组数，最多 50 个
+    assert profile["total_behaviors"] == 3
+    assert session.round_trips == 1
+    assert "LIMIT 50" in session.statements[0]
+    assert "behavior_data" not in session.statements[0]
+
+
+def test_build_user_profile_without_behaviors_returns_empty_profile():
+    session = FakeAsyncSession(lambda sql, params: FakeResult([(3, None, None, None, 0, None, None, None)]))
+    engine = EnterpriseRecommendationEngine()
+
+    profile = asyncio.run(engine.build_user_profile("u1", session))
+
+    assert profile == {"user_id": "u1", "preferences": {}, "activity_level": 0}
+    assert session.round_trips == 1 and "GROUPING SETS" in session.statements[0]
+
+
+def test_user_activity_analytics_counts_by_dimension():
+    from src.heimdall.api.endpoints.enterprise_recommendations import get_user_activity_analytics
+
+    rows = [
+        ("behavior_type", "view", 4),
+        ("behavior_type", "click", 1),
+        ("category", "手机", 3),
+        ("category", None, 2),
+        ("brand", "华为", 5),
+        ("day", "2026-10-15", 2),
+        ("day", "2026-10-16", 3),
+    ]
+    session = FakeAsyncSession(lambda sql, params: FakeResult(rows))
+
+    result = asyncio.run(get_user_activity_analytics(user_id="u1", days=30, db=session))
+
+    assert result["total_behaviors"] == 5
+    assert result["behavior_counts"] == {"view": 4, "click": 1}
+    assert result["category_preferences"] == {"手机": 3}
+    assert list(result["daily_activity"]) == ["2026-10-16", "2026-10-15"]
+    assert result["most_active_day"] == "2026-10-16"
+    assert "behavior_data" not in session.statements[0]
@@ -0,0 +1,226 @@
+# 行为批量写入：逐事件校验与拒绝原因、COPY / INSERT 写入路径、NDJSON 流式写入，以及按需运行的内存与吞吐基准
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import pytest
+from pydantic import BaseModel
+
+from src.heimdall.services.behavior_ingest import BehaviorIngestor, iter_ndjson_lines, validate_events
+from tests.fakes import FakeAsyncSession, FakeResult
+
+
+class EventModel(BaseModel):
+    """与 UserBehaviorRequest 字段一致，另可带发生时间"""
+    user_id: str
+    session_id: str
+    behavior_type: str
+    behavior_data: Dict[str, Any]
+    created_at: Optional[datetime] = None
+
+
+def _event(i: int, **overrides: Any) -> Dict[str, Any]:
+    event = {
+        "user_id": f"user-{i % 1000}",
+        "session_id": f"session-{i % 5000}",
+        "behavior_type": ("view", "click", "purchase", "search")[i % 4],
+        "behavior_data": {"product_id": i % 997, "category": "手机", "brand": "华为", "price": 3999},
+    }
+    event.update(overrides)
+    return event
+
+
+def test_validate_events_returns_per_event_rejects():
+    received_at = datetime(2026, 1, 1, 12, 0, 0)
+    raw = [
+        _event(0),
+        _event(1, behavior_type="like"),
+        {"user_id": "u", "behavior_type": "view", "behavior_data": {}},
+        _event(3, behavior_data="not a dict"),
+        _event(4, created_at="2025-12-31T08:00:00"),
+        "garbage",
+        _event(6, user_id=""),
+    ]
+
+    records, rejects = validate_events(raw, EventModel, received_at=received_at)
+
+    assert [record[0] for record in records] == ["user-0", "user-4"]
+    assert records[0][4] == received_at
+    assert records[1][4] == datetime(2025, 12, 31, 8, 0, 0)
+    assert [reject.index for reject in rejects] == [1, 2, 3, 5, 6]
+    assert "behavior_type" in rejects[0].errors[0]
+    assert rejects[1].errors[0].startswith("session_id")
+    assert rejects[2].errors[0].startswith("behavior_data")
+    assert rejects[4].errors[0].startswith("user_id")
+
+
+class _FakeDriver:
+    def __init__(self):
+        self.copies = []
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copies.append((table, list(records), columns))
+
+
+class _FakeCopySession(FakeAsyncSession):
+    """底层为 asyncpg 连接的假会话"""
+
+    def __init__(self):
+        super().__init__(lambda sql, params: FakeResult([]))
+        self.driver = _FakeDriver()
+
+    async def connection(self):
+        session = self
+
+        class _Connection:
+            async def get_raw_connection(self):
+                class _Raw:
+                    driver_connection = session.driver
+                return _Raw()
+        return _Connection()
+
+
+def test_ingest_uses_copy_in_batches_with_one_commit():
+    session = _FakeCopySession()
+    ingestor = BehaviorIngestor(copy_batch_size=4)
+    raw = [_event(i) for i in range(10)] + [_event(10, behavior_type="bad")]
+
+    result = asyncio.run(ingestor.ingest(session, raw, EventModel))
+
+    assert (result.accepted, result.rejected) == (10, 1)
+    assert [len(copy[1]) for copy in session.driver.copies] == [4, 4, 2]
+    table, rows, columns = session.driver.copies[0]
+    assert table == "user_behaviors"
+    assert columns == ('user_id', 'session_id', 'behavior_type', 'behavior_data', 'created_at')
+    assert json.loads(rows[0][3]) == raw[0]["behavior_data"]
+    assert session.commits == 1 and session.round_trips == 0
+    assert ingestor.summary()["copy_batches"] == 3
+
+
+def test_ingest_falls_back_to_batched_insert_without_asyncpg():
+    session = FakeAsyncSession(lambda sql, params: FakeResult([]))
+    ingestor = BehaviorIngestor(copy_batch_size=100)
+
+    result = asyncio.run(ingestor.ingest(session, [_event(i) for i in range(150)], EventModel))
+
+    assert result.accepted == 150
+    assert session.round_trips == 2 and session.commits == 1
+    assert ingestor.stats.insert_batches == 2
+
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def _collect_lines(data: bytes, size: int, max_line_bytes: int = 64):
+    async def run():
+        return [item async for item in iter_ndjson_lines(_chunks(data, size), max_line_bytes)]
+    return asyncio.run(run())
+
+
+def test_ndjson_lines_split_across_chunks():
+    data = b'{"a": 1}\n\n{"b": 2}\r\n' + b"x" * 100 + b'\n{"c": 3}'
+    for size in (1, 3, 7, 1000):
+        assert _collect_lines(data, size) == [
+            (1, b'{"a": 1}'), (2, b""), (3, b'{"b": 2}\r'), (4, None), (5, b'{"c": 3}')
+        ]
+    assert _collect_lines(b"x" * 100, 8) == [(1, None)]
+
+
+def test_ndjson_ingest_batches_while_reading_and_reports_rejects():
+    session = _FakeCopySession()
+    ingestor = BehaviorIngestor(copy_batch_size=3)
+    lines = [json.dumps(_event(i)) for i in range(7)]
+    lines.insert(2, "{not json")
+    lines.insert(5, json.dumps(_event(99, behavior_type="like")))
+    lines.insert(6, "")
+    data = ("\n".join(lines) + "\n").encode()
+    batches = []
+
+    result = asyncio.run(ingestor.ingest_ndjson(
+        session, _chunks(data, 16), EventModel, max_reject_samples=1, on_batch=lambda records: batches.append(len(records))
+    ))
+
+    assert (result.accepted, result.rejected, result.lines, result.batches) == (7, 2, 10, 3)
+    assert [reject.index for reject in result.reject_samples] == [3]
+    assert batches == [3, 3, 1] and session.commits == 3
+    assert [json.loads(row[3])["product_id"] for copy in session.driver.copies for row in copy[1]] == list(range(7))
+
+
+@pytest.mark.skipif(not os.environ.get("HEIMDALL_RUN_BENCHMARKS"), reason="设置 HEIMDALL_RUN_BENCHMARKS=1 后运行")
+def test_ndjson_ingest_memory_stays_flat():
+    """基准：NDJSON 流式写入的峰值内存不随事件数增长"""
+    class _DiscardDriver:
+        async def copy_records_to_table(self, table, records, columns):
+            pass
+
+    def peak_for(events: int):
+        async def stream():
+            for start in range(0, events, 500):
+                yield "".join(json.dumps(_event(i)) + "\n" for i in range(start, min(start + 500, events))).encode()
+
+        session = _FakeCopySession()
+        session.driver = _DiscardDriver()
+        tracemalloc.start()
+        try:
+            result = asyncio.run(BehaviorIngestor(copy_batch_size=1000).ingest_ndjson(session, stream(), EventModel))
+            return tracemalloc.get_traced_memory()[1], result.accepted
+        finally:
+            tracemalloc.stop()
+
+    small_peak, small_accepted = peak_for(5_000)
+    large_peak, large_accepted = peak_for(50_000)
+    assert (small_accepted, large_accepted) == (5_000, 50_000)
+    # 10 倍的数据量，峰值内存基本不变
+    assert large_peak < small_peak * 1.5
+
+
+BENCH_DATABASE_URL = os.environ.get("HEIMDALL_BENCH_DATABASE_URL")
+
+
+@pytest.mark.skipif(not BENCH_DATABASE_URL, reason="设置 HEIMDALL_BENCH_DATABASE_URL（postgresql+asyncpg://...）后运行")
+def test_copy_ingest_throughput_against_postgres():
+    """单个工作进程校验 + COPY 写入的吞吐，目标 > 50k 事件/秒（写入会话级临时表，不影响数据）"""
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    total, batch_size = 200_000, 10_000
+    batches = [[_event(start + i) for i in range(batch_size)] for start in range(0, total, batch_size)]
+
+    async def run() -> float:
+        engine = create_async_engine(BENCH_DATABASE_URL)
+        try:
+            async with AsyncSession(engine) as session:
+                # 临时表在 search_path 中优先，COPY user_behaviors 写入临时表
+                await session.execute(text("""
+                    CREATE TEMP TABLE user_behaviors (
+                        id SERIAL PRIMARY KEY,
+                        user_id VARCHAR(255) NOT NULL,
+                        session_id VARCHAR(255),
+                        behavior_type VARCHAR(50) NOT NULL,
+                        behavior_data JSONB,
+                        timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    ) ON COMMIT PRESERVE ROWS
+                """))
+                await session.commit()
+                ingestor = BehaviorIngestor(copy_batch_size=batch_size)
+                started = time.perf_counter()
+                for batch in batches:
+                    await ingestor.ingest(session, batch, EventModel)
+                elapsed = time.perf_counter() - started
+                count = (await session.execute(text("SELECT COUNT(*) FROM user_behaviors"))).scalar()
+                assert count == total
+                assert ingestor.stats.copy_batches == len(batches)
+                return elapsed
+        finally:
+            await engine.dispose()
+
+    elapsed = asyncio.run(run())
+    rate = total / elapsed
+    assert rate > 50_000, f"批量写入 {total} 个事件: {elapsed:.2f}s, {rate:,.0f} 事件/秒"
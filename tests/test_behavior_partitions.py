@@ -0,0 +1,84 @@
+# 行为表分区维护：月份计算、提前创建分区、超过保留期的分区先汇总再删除，以及未分区时跳过
+import asyncio
+from datetime import date, datetime
+
+from src.heimdall.services.behavior_partitions import (
+    BehaviorPartitionManager, add_months, behavior_window_start, parse_partition_month, partition_ddl
+)
+from tests.fakes import FakeAsyncSession, FakeResult
+
+
+def test_month_arithmetic_and_partition_names():
+    assert add_months(date(2026, 11, 1), 3) == date(2027, 2, 1)
+    assert add_months(date(2026, 1, 1), -13) == date(2024, 12, 1)
+    assert parse_partition_month("user_behaviors_p202602") == date(2026, 2, 1)
+    assert parse_partition_month("user_behaviors_default") is None
+    assert "FROM ('2026-12-01 00:00:00+00') TO ('2027-01-01 00:00:00+00')" in partition_ddl(date(2026, 12, 1))
+    assert behavior_window_start(days=90, now=datetime(2026, 4, 1)) == datetime(2026, 1, 1)
+
+
+class CatalogDatabase:
+    """按系统表查询返回现有分区的假数据库"""
+
+    def __init__(self, partitions, partitioned=True, locked=True):
+        self.partitions = partitions
+        self.partitioned = partitioned
+        self.locked = locked
+
+    def handler(self, sql, params):
+        if "pg_try_advisory_xact_lock" in sql:
+            return FakeResult([(self.locked,)])
+        if "pg_partitioned_table" in sql:
+            return FakeResult([(1,)] if self.partitioned else [])
+        if "pg_inherits" in sql:
+            return FakeResult([(name,) for name in self.partitions])
+        if "INSERT INTO user_behavior_rollups" in sql:
+            return FakeResult(rowcount=10)
+        return FakeResult([])
+
+
+def test_maintenance_creates_future_partitions_and_rolls_up_expired_ones():
+    database = CatalogDatabase([
+        "user_behaviors_default",
+        "user_behaviors_p202608", "user_behaviors_p202509", "user_behaviors_p202510",
+        "user_behaviors_p202511", "user_behaviors_p202610",
+    ])
+    session = FakeAsyncSession(database.handler)
+    manager = BehaviorPartitionManager(months_ahead=2, retention_months=12)
+
+    result = asyncio.run(manager.run_maintenance(session, today=date(2026, 10, 17)))
+
+    assert result["created"] == ["user_behaviors_p202611", "user_behaviors_p202612"]
+    assert result["dropped"] == ["user_behaviors_p202509"]
+    ddl = [sql for sql in session.statements if "INSERT INTO user_behavior_rollups" in sql or "user_behaviors_p2025" in sql]
+    # 先汇总，再摘除并删除
+    assert "FROM user_behaviors_p202509" in ddl[0]
+    assert ddl[1].strip() == "ALTER TABLE user_behaviors DETACH PARTITION user_behaviors_p202509"
+    assert ddl[2].strip() == "DROP TABLE user_behaviors_p202509"
+    assert not any("user_behaviors_p202510" in sql for sql in session.statements)
+    assert session.commits == 1
+    assert manager.summary()["partitions_dropped"] == 1 and manager.summary()["rollup_rows"] == 10
+
+
+def test_maintenance_skips_unpartitioned_table_and_held_lock():
+    for database in (CatalogDatabase([], partitioned=False), CatalogDatabase([], locked=False)):
+        session = FakeAsyncSession(database.handler)
+        manager = BehaviorPartitionManager(months_ahead=2, retention_months=12)
+
+        result = asyncio.run(manager.run_maintenance(session, today=date(2026, 10, 17)))
+
+        assert result["skipped"] and session.commits == 0
+        assert not any("CREATE TABLE" in sql for sql in session.statements)
+
+
+def test_exclusion_list_is_not_limited_to_the_query_window():
+    from src.heimdall.services.recommendation_engine import EnterpriseRecommendationEngine
+
+    engine = EnterpriseRecommendationEngine()
+    session = FakeAsyncSession(lambda sql, params: FakeResult([(7,)]))
+
+    # 已交互产品（用于排除）读取保留期内的全部行为；相似用户的行为（用于打分）按时间窗口裁剪分区
+    assert asyncio.run(engine.get_user_behavior_products("u1", session)) == [7]
+    asyncio.run(engine.get_users_behavior_products(["u2"], session))
+    assert "created_at" not in session.statements[0]
+    assert "created_at >= :since" in session.statements[1]
@@ -0,0 +1,107 @@
+# 行为写入队列：有界入队、按数量/时间凑批写入、失败重试、关闭时写完剩余事件，以及队列满时接口返回 503
+import asyncio
+from datetime import datetime
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.heimdall.services.behavior_ingest import BehaviorIngestor
+from src.heimdall.services.behavior_queue import BehaviorWriteQueue
+from tests.fakes import FakeAsyncSession, FakeResult
+
+
+def _record(i):
+    return (f"u{i % 3}", "s1", "view", {"product_id": i}, datetime(2026, 1, 1))
+
+
+class SessionFactory:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.batches = []
+
+    def handler(self, sql, params):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("数据库不可用")
+        self.batches.append([row["behavior_data"] for row in params])
+        return FakeResult([])
+
+    def __call__(self):
+        return FakeAsyncSession(self.handler)
+
+
+def _queue(**kwargs):
+    written = []
+    queue = BehaviorWriteQueue(ingestor=BehaviorIngestor(), on_written=written.extend, **kwargs)
+    return queue, written
+
+
+def test_batches_by_size_and_time_and_flushes_on_close():
+    factory = SessionFactory()
+
+    async def scenario():
+        queue, written = _queue(max_size=100, batch_size=4, flush_seconds=0.05)
+        assert not queue.enqueue(_record(0))
+        queue.start(factory)
+        for i in range(10):
+            assert queue.enqueue(_record(i))
+        # 两个满批立即写入，剩余 2 个在凑批时间到后写入
+        await asyncio.sleep(0.2)
+        assert [len(batch) for batch in factory.batches] == [4, 4, 2]
+
+        for i in range(10, 13):
+            queue.enqueue(_record(i))
+        await queue.close()
+        assert not queue.enqueue(_record(99))
+        return queue, written
+
+    queue, written = asyncio.run(scenario())
+    assert sum(len(batch) for batch in factory.batches) == 13
+    assert [record[3]["product_id"] for record in written] == list(range(13))
+    assert queue.summary()["rows_written"] == 13 and queue.summary()["depth"] == 0
+
+
+def test_full_queue_rejects_without_blocking():
+    async def scenario():
+        queue, _ = _queue(max_size=3, batch_size=100, flush_seconds=10)
+        queue.start(SessionFactory())
+        results = [queue.enqueue(_record(i)) for i in range(5)]
+        stats = queue.summary()
+        await queue.close(timeout=0.01)
+        return results, stats
+
+    results, stats = asyncio.run(scenario())
+    assert results == [True, True, True, False, False]
+    assert stats["rejected_full"] == 2
+
+
+def test_failed_batch_is_retried():
+    factory = SessionFactory(failures=2)
+
+    async def scenario():
+        queue, written = _queue(max_size=10, batch_size=5, flush_seconds=0.01, max_retries=3)
+        queue.start(factory)
+        for i in range(5):
+            queue.enqueue(_record(i))
+        await queue.close()
+        return queue, written
+
+    queue, written = asyncio.run(scenario())
+    assert len(factory.batches) == 1 and len(written) == 5
+    assert queue.stats.failures == 2 and queue.stats.dropped == 0
+
+
+def test_record_behavior_returns_503_with_retry_after_when_queue_unavailable():
+    from src.heimdall.api.endpoints import advertising
+
+    app = FastAPI()
+    app.include_router(advertising.router)
+    client = TestClient(app)
+    body = {"user_id": "u1", "session_id": "s1", "behavior_type": "view", "behavior_data": {"product_id": 1}}
+
+    response = client.post("/api/v1/advertising/record_behavior", json=body)
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+    response = client.post("/api/v1/advertising/record_behavior", json={**body, "behavior_type": "like"})
+    assert response.status_code == 400
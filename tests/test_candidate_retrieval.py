@@ -0,0 +1,82 @@
+# 两阶段召回 -> 打分的候选召回测试
+import asyncio
+
+from src.heimdall.services.candidate_retrieval import CandidateRetriever
+from src.heimdall.services.hybrid_recommendation_engine import HybridRecommendationEngine
+from src.heimdall.services.hybrid_scoring import ColumnarCatalog
+from tests.fakes import FakeAsyncSession, FakeResult, make_catalog_rows
+
+
+def _catalog(size):
+    products = [
+        {"id": r[0], "name": r[1], "category": r[2], "brand": r[3], "price": r[4], "rating": r[6]}
+        for r in make_catalog_rows(size)
+    ]
+    return ColumnarCatalog.from_products(products)
+
+
+def test_small_catalog_is_fully_scored():
+    retriever = CandidateRetriever(min_candidates=10, max_candidates=100)
+    assert retriever.retrieve(_catalog(50), {}, None) is None
+    assert retriever.stats.full_scans == 1
+
+
+def test_candidates_come_from_inverted_indexes():
+    catalog = _catalog(2000)
+    retriever = CandidateRetriever(min_candidates=0, max_candidates=500)
+    profile = {"category_preferences": {"手机": 3.0}, "brand_preferences": {}}
+    intent = {"product_categories": ["耳机"], "brand_preferences": [], "price_range": "高"}
+
+    candidates = retriever.retrieve(catalog, profile, intent)
+
+    categories = {catalog.categories[catalog.category_codes[i]] for i in candidates}
+    assert categories <= {"手机", "耳机"}
+    assert 0 < len(candidates) <= 500
+    assert list(candidates) == sorted(candidates)
+
+
+def test_candidates_bounded_and_backfilled_by_popularity():
+    catalog = _catalog(3000)
+    retriever = CandidateRetriever(min_candidates=200, max_candidates=300)
+
+    bounded = retriever.retrieve(catalog, {"brand_preferences": {"Apple": 1, "Nike": 1}}, {"price_range": "低"})
+    assert len(bounded) == 300
+
+    backfilled = retriever.retrieve(catalog, {}, None)
+    assert len(backfilled) == 200
+    assert retriever.stats.backfilled == 1
+    assert set(backfilled) == set(range(200))
+
+
+def test_engine_scores_only_candidates_and_records_recall(monkeypatch):
+    from src.heimdall.services import hybrid_recommendation_engine as module
+
+    rows = make_catalog_rows(3000)
+    engine = HybridRecommendationEngine()
+    engine.candidate_retriever = CandidateRetriever(min_candidates=50, max_candidates=400)
+    monkeypatch.setattr(module.settings, "HYBRID_RECALL_SAMPLE_RATE", 1.0)
+    collaborative_sizes = []
+
+    def handler(sql, params):
+        if "MAX(updated_at)" in sql:
+            return FakeResult([(len(rows), None)])
+        if "FROM products" in sql:
+            return FakeResult(rows)
+        if "ub2.product_id" in sql:
+            collaborative_sizes.append(len(params["product_ids"]))
+        return FakeResult([])
+
+    async def fake_profile(user_id, db):
+        return {"category_preferences": {"手机": 8.0}, "brand_preferences": {"华为": 4.0},
+                "behavior_patterns": {"click": 3}}
+
+    engine.get_user_behavior_profile = fake_profile
+    recommendations = asyncio.run(engine.get_hybrid_recommendations(
+        user_id="u1", db=FakeAsyncSession(handler), limit=10
+    ))
+
+    assert recommendations
+    assert collaborative_sizes and collaborative_sizes[0] <= 400
+    summary = engine.get_metrics()["candidate_retrieval"]
+    assert summary["recall_samples"] == 1
+    assert summary["max_candidate_size"] <= 400
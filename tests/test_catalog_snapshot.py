@@ -0,0 +1,88 @@
+# 产品目录快照版本失效测试
+import asyncio
+
+from src.heimdall.services.catalog_snapshot import CatalogSnapshotStore
+from tests.fakes import FakeAsyncSession, FakeResult, make_catalog_rows
+
+
+class _Catalog:
+    def __init__(self, size):
+        self.rows = make_catalog_rows(size)
+        self.updated_at = 1
+
+    def handler(self, sql, params):
+        if "MAX(updated_at)" in sql:
+            return FakeResult([(len(self.rows), self.updated_at)])
+        if "FROM products" in sql:
+            return FakeResult(self.rows)
+        return FakeResult([])
+
+
+def test_snapshot_reused_until_version_bump():
+    catalog = _Catalog(20)
+    store = CatalogSnapshotStore(max_staleness_seconds=60)
+
+    async def scenario():
+        db = FakeAsyncSession(catalog.handler)
+        first = await store.get_snapshot(db)
+        assert db.round_trips == 2
+        assert len(first.products) == 20
+
+        second = await store.get_snapshot(db)
+        assert second is first
+        assert db.round_trips == 2
+
+        catalog.rows = make_catalog_rows(21)
+        store.bump_version()
+        third = await store.get_snapshot(db)
+        assert third.version == store.version == 1
+        assert len(third.products) == 21
+        assert len(third.catalog) == 21
+
+    asyncio.run(scenario())
+
+
+def test_expired_snapshot_revalidated_by_fingerprint():
+    catalog = _Catalog(5)
+    store = CatalogSnapshotStore(max_staleness_seconds=0)
+
+    async def scenario():
+        db = FakeAsyncSession(catalog.handler)
+        first = await store.get_snapshot(db)
+
+        # 目录未变：只做一次指纹查询，不重新加载产品
+        second = await store.get_snapshot(db)
+        assert db.round_trips == 3
+        assert second.products is first.products
+
+        # 其他工作进程修改了目录：指纹变化触发重新加载并提升版本
+        catalog.updated_at = 2
+        catalog.rows = make_catalog_rows(6)
+        third = await store.get_snapshot(db)
+        assert third.version == first.version + 1
+        assert len(third.products) == 6
+
+    asyncio.run(scenario())
+
+
+def test_bump_during_load_forces_next_read_to_reload():
+    catalog = _Catalog(3)
+    store = CatalogSnapshotStore(max_staleness_seconds=60)
+
+    def handler(sql, params):
+        result = catalog.handler(sql, params)
+        if "FROM products" in sql and "MAX(updated_at)" not in sql and len(catalog.rows) == 3:
+            # 加载旧行期间产品接口更新了目录
+            catalog.rows = make_catalog_rows(4)
+            store.bump_version()
+        return result
+
+    async def scenario():
+        db = FakeAsyncSession(handler)
+        stale = await store.get_snapshot(db)
+        assert len(stale.products) == 3 and stale.version != store.version
+
+        fresh = await store.get_snapshot(db)
+        assert len(fresh.products) == 4 and fresh.version == store.version
+
+    asyncio.run(scenario())
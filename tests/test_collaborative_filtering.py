@@ -0,0 +1,67 @@
+# 企业推荐引擎协同过滤：相似用户产品批量查询与加权投票排序
+import asyncio
+import time
+
+from src.heimdall.services.recommendation_engine import EnterpriseRecommendationEngine
+from tests.fakes import FakeAsyncSession, FakeResult
+
+PROFILES = {
+    "me": {"category_preferences": {"手机": 1, "耳机": 1}, "brand_preferences": {"华为": 1}},
+    "close": {"category_preferences": {"手机": 1, "耳机": 1}, "brand_preferences": {"华为": 1}},
+    "far": {"category_preferences": {"手机": 1}, "brand_preferences": {"Apple": 1}},
+}
+
+BEHAVIORS = [
+    ("close", 10, "purchase"),
+    ("close", 10, "view"),
+    ("close", 11, "view"),
+    ("far", 12, "purchase"),
+    ("far", 11, "view"),
+    ("far", 1, "view"),
+]
+
+
+def _handler(sql, params):
+    if "FROM user_profiles" in sql:
+        return FakeResult([(PROFILES[params["user_id"]],)])
+    if "ANY(:user_ids)" in sql:
+        return FakeResult([row for row in BEHAVIORS if row[0] in params["user_ids"]])
+    if "FROM products" in sql:
+        return FakeResult([
+            (pid, f"产品{pid}", "", 999.0, "手机", "华为", "", [], {}, 5.0 - pid / 100, 10)
+            for pid in params["product_ids"]
+        ])
+    return FakeResult([])
+
+
+def _engine():
+    engine = EnterpriseRecommendationEngine()
+    for user_id, profile in PROFILES.items():
+        engine.similar_user_index.upsert(user_id, profile)
+    engine.similar_user_index.loaded_at = time.monotonic()
+    return engine
+
+
+def test_neighbour_products_fetched_in_one_query_and_ranked_by_votes():
+    engine = _engine()
+    db = FakeAsyncSession(_handler)
+
+    products = asyncio.run(engine.collaborative_filtering("me", db, limit=5, interacted_products=[1]))
+
+    # 画像 1 次 + 相似用户产品 1 次 + 产品详情 1 次，与相似用户数量无关
+    assert db.round_trips == 3
+    assert sum("ANY(:user_ids)" in sql for sql in db.statements) == 1
+    # close（相似度1.0）购买的10号产品得票最高；11号两人都看过；12号只有较远的用户购买
+    assert [product["id"] for product in products] == [10, 11, 12]
+    assert products[0]["relevance_score"] == 1.0
+
+
+def test_batch_behavior_products_groups_rows_by_user():
+    engine = EnterpriseRecommendationEngine()
+    db = FakeAsyncSession(_handler)
+
+    rows = asyncio.run(engine.get_users_behavior_products(["close", "far"], db))
+
+    assert db.round_trips == 1
+    assert ("close", 10, "purchase") in rows and ("far", 1, "view") in rows
+    assert asyncio.run(engine.get_users_behavior_products([], db)) == []
@@ -0,0 +1,86 @@
+# 企业推荐引擎混合推荐：协同过滤与内容分支并发执行、复用画像、倒数排名融合
+import asyncio
+import time
+
+from src.heimdall.services.recommendation_engine import EnterpriseRecommendationEngine
+from tests.fakes import FakeAsyncSession, FakeResult
+
+QUERY_DELAY = 0.05
+
+PROFILE = {"category_preferences": {"手机": 3.0}, "brand_preferences": {"华为": 2.0}}
+
+
+def _product_row(pid, rating=4.5):
+    return (pid, f"产品{pid}", "", 999.0, "手机", "华为", "", [], {}, rating, 10)
+
+
+class SlowSession(FakeAsyncSession):
+    """每次查询模拟一次数据库往返延迟"""
+
+    async def execute(self, statement, params=None):
+        await asyncio.sleep(QUERY_DELAY)
+        return await super().execute(statement, params)
+
+
+def _handler(sql, params):
+    if "FROM user_profiles" in sql:
+        raise AssertionError("混合推荐不应重新读取用户画像")
+    if "ANY(:user_ids)" in sql:
+        return FakeResult([("peer", 1, "purchase"), ("peer", 2, "view"), ("peer", 3, "view")])
+    if "ANY(:product_ids)" in sql:
+        return FakeResult([_product_row(pid) for pid in params["product_ids"]])
+    if "ANY(:category_ids)" in sql:
+        return FakeResult([_product_row(pid, rating) for pid, rating in ((2, 4.9), (4, 4.8), (5, 4.7))])
+    return FakeResult([])
+
+
+def _engine(session_factory=None):
+    engine = EnterpriseRecommendationEngine(session_factory=session_factory)
+    engine.similar_user_index.upsert("me", PROFILE)
+    engine.similar_user_index.upsert("peer", PROFILE)
+    engine.similar_user_index.loaded_at = time.monotonic()
+    return engine
+
+
+def _run(engine):
+    db = SlowSession(_handler)
+    started = time.perf_counter()
+    recommendations = asyncio.run(engine.hybrid_recommendations("me", PROFILE, db, 4, []))
+    return recommendations, time.perf_counter() - started
+
+
+def test_branches_run_concurrently_on_separate_sessions():
+    sessions = []
+
+    def session_factory():
+        session = SlowSession(_handler)
+        sessions.append(session)
+        return session
+
+    sequential, sequential_seconds = _run(_engine())
+    concurrent, concurrent_seconds = _run(_engine(session_factory))
+
+    assert [r["id"] for r in concurrent] == [r["id"] for r in sequential]
+    assert len(sessions) == 2
+    # 协同过滤 2 次往返、内容推荐 1 次往返：并发后耗时取决于较长的分支
+    assert concurrent_seconds < sequential_seconds * 0.8
+
+
+def test_reciprocal_rank_fusion_rewards_items_in_both_lists():
+    recommendations, _ = _run(_engine())
+
+    # 2 号产品同时出现在两个分支中，融合后排第一
+    assert recommendations[0]["id"] == 2
+    assert recommendations[0]["relevance_score"] == 1.0
+    # 3 号与 5 号同为各自列表第 3 名，按评分排序
+    assert [r["id"] for r in recommendations] == [2, 1, 4, 5]
+
+
+def test_fuse_rankings_breaks_ties_by_rating():
+    fused = EnterpriseRecommendationEngine.fuse_rankings([
+        [{"id": 1, "rating": 4.0, "review_count": 1}],
+        [{"id": 2, "rating": 4.5, "review_count": 1}],
+    ], limit=5)
+
+    assert [r["id"] for r in fused] == [2, 1]
+    assert EnterpriseRecommendationEngine.fuse_rankings([[], []], limit=5) == []
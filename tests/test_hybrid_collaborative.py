@@ -0,0 +1,78 @@
+# 混合推荐协同过滤批量打分测试与往返次数基准
+import asyncio
+
+from src.heimdall.services.hybrid_recommendation_engine import HybridRecommendationEngine
+from tests.fakes import FakeAsyncSession, FakeResult, make_catalog_rows
+
+
+def _make_session(catalog_rows):
+    def handler(sql, params):
+        if "MAX(updated_at)" in sql:
+            return FakeResult([(len(catalog_rows), None)])
+        if "FROM products" in sql:
+            return FakeResult(catalog_rows)
+        if "ub2.product_id" in sql:
+            # 每个第3个产品有共现记录
+            ids = params.get("product_ids", [])
+            return FakeResult([(pid, pid % 7) for pid in ids if pid % 3 == 0])
+        if "FROM user_behaviors" in sql:
+            # 行为画像的 GROUPING SETS 结果：(level, behavior_type, category, brand, score, frequency, group_count)
+            return FakeResult([
+                (3, "click", None, None, 6.0, 4, 1),
+                (3, "purchase", None, None, 6.0, 2, 1),
+                (5, None, "电子产品", None, 6.0, 4, 1),
+                (5, None, "手机", None, 6.0, 2, 1),
+                (6, None, None, "Apple", 6.0, 4, 1),
+                (6, None, None, "华为", 6.0, 2, 1),
+            ])
+        return FakeResult([])
+
+    return FakeAsyncSession(handler)
+
+
+def test_collaborative_scores_batched_into_one_query():
+    engine = HybridRecommendationEngine()
+    db = _make_session([])
+
+    scores = asyncio.run(engine._calculate_collaborative_scores([3, 4, 6, 9], "u1", db))
+
+    assert db.round_trips == 1
+    assert scores == {3: min(3 / 5, 1.0), 6: min(6 / 5, 1.0), 9: min(2 / 5, 1.0)}
+
+
+def test_single_product_score_matches_batch():
+    engine = HybridRecommendationEngine()
+    db = _make_session([])
+
+    score = asyncio.run(engine._calculate_collaborative_score({"id": 6}, "u1", db))
+    missing = asyncio.run(engine._calculate_collaborative_score({"id": 4}, "u1", db))
+
+    assert score == 1.0
+    assert missing == 0.0
+
+
+def test_round_trips_constant_as_catalog_grows():
+    """基准：每次请求的数据库往返次数不随产品目录规模增长"""
+    cold_round_trips = {}
+    warm_round_trips = {}
+
+    for size in (10, 100, 1000, 5000):
+        engine = HybridRecommendationEngine()
+        rows = make_catalog_rows(size)
+
+        # 冷启动请求：加载目录快照
+        db = _make_session(rows)
+        recommendations = asyncio.run(
+            engine.get_hybrid_recommendations(user_id="u1", db=db, limit=10)
+        )
+        cold_round_trips[size] = db.round_trips
+        assert recommendations
+
+        # 热请求：目录快照命中
+        db = _make_session(rows)
+        asyncio.run(engine.get_hybrid_recommendations(user_id="u1", db=db, limit=10))
+        warm_round_trips[size] = db.round_trips
+
+    assert len(set(cold_round_trips.values())) == 1
+    assert len(set(warm_round_trips.values())) == 1
+    assert warm_round_trips[5000] == 2
@@ -0,0 +1,113 @@
+# 混合推荐并发加载（画像 / 意图 / 目录）与超时降级测试
+import asyncio
+
+from src.heimdall.services import hybrid_recommendation_engine as module
+from src.heimdall.services.hybrid_recommendation_engine import HybridRecommendationEngine
+from tests.fakes import FakeAsyncSession, FakeResult, make_catalog_rows
+
+STAGE_DELAY = 0.2
+
+
+class SlowSession(FakeAsyncSession):
+    """每次查询固定延迟的假会话，并统计同时在途的查询数"""
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def execute(self, statement, params=None):
+        SlowSession.in_flight += 1
+        SlowSession.max_in_flight = max(SlowSession.max_in_flight, SlowSession.in_flight)
+        try:
+            await asyncio.sleep(STAGE_DELAY)
+            return await super().execute(statement, params)
+        finally:
+            SlowSession.in_flight -= 1
+
+
+def _handler(rows):
+    def handler(sql, params):
+        if "MAX(updated_at)" in sql:
+            return FakeResult([(len(rows), None)])
+        if "FROM products" in sql:
+            return FakeResult(rows)
+        if "FROM user_behaviors" in sql and "ub2" not in sql:
+            return FakeResult([
+                (3, "click", None, None, 6.0, 4, 1), (5, None, "手机", None, 6.0, 4, 1), (6, None, None, "华为", 6.0, 4, 1)
+            ])
+        return FakeResult([])
+    return handler
+
+
+def _engine(rows, sessions):
+    def session_factory():
+        session = SlowSession(_handler(rows))
+        sessions.append(session)
+        return session
+    engine = HybridRecommendationEngine(session_factory=session_factory)
+
+    async def slow_intent(user_input, user_id=None):
+        await asyncio.sleep(STAGE_DELAY)
+        return engine._offline_intent_analysis(user_input)
+
+    engine.analyze_user_intent = slow_intent
+    return engine
+
+
+def test_stages_run_concurrently_on_separate_sessions():
+    rows = make_catalog_rows(50)
+    sessions = []
+    engine = _engine(rows, sessions)
+    SlowSession.max_in_flight = 0
+
+    profile, intent, snapshot = asyncio.run(
+        engine._load_request_context("u1", "想买华为手机", SlowSession(_handler(rows)))
+    )
+
+    assert profile["category_preferences"] == {"手机": 6.0}
+    assert intent["intent_type"]
+    assert len(snapshot.products) == 50
+    assert len(sessions) == 2
+    # 画像与目录快照各用一个会话，查询同时进行
+    assert SlowSession.max_in_flight == 2
+
+
+def test_without_session_factory_db_stages_share_request_session():
+    rows = make_catalog_rows(20)
+    engine = HybridRecommendationEngine()
+    SlowSession.max_in_flight = 0
+
+    profile, intent, snapshot = asyncio.run(
+        engine._load_request_context("u1", None, SlowSession(_handler(rows)))
+    )
+
+    assert intent is None
+    assert len(snapshot.products) == 20
+    assert SlowSession.max_in_flight == 1
+
+
+def test_slow_intent_degrades_to_offline_analysis(monkeypatch):
+    rows = make_catalog_rows(20)
+    engine = _engine(rows, [])
+    monkeypatch.setattr(module.settings, "HYBRID_INTENT_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(module.settings, "HYBRID_PROFILE_TIMEOUT_SECONDS", 0.05)
+
+    recommendations = asyncio.run(engine.get_hybrid_recommendations(
+        user_id="u1", user_input="想买华为手机", db=FakeAsyncSession(_handler(rows)), limit=5
+    ))
+
+    assert recommendations
+    assert engine.stage_timeouts == {"profile": 1, "intent": 1, "catalog": 0}
+    assert engine.get_metrics()["stage_timeouts"]["intent"] == 1
+
+
+def test_catalog_timeout_falls_back_to_previous_snapshot(monkeypatch):
+    rows = make_catalog_rows(30)
+    engine = _engine(rows, [])
+    asyncio.run(engine.catalog_store.refresh(FakeAsyncSession(_handler(rows))))
+    engine.catalog_store.bump_version()
+    monkeypatch.setattr(module.settings, "HYBRID_CATALOG_TIMEOUT_SECONDS", 0.05)
+
+    _, _, snapshot = asyncio.run(engine._load_request_context("u1", None, None))
+
+    assert len(snapshot.products) == 30
+    assert engine.stage_timeouts["catalog"] == 1
@@ -0,0 +1,90 @@
+# /recommendations 端点复用推荐过程中的画像与意图分析（每个请求只计算一次）
+import asyncio
+from types import SimpleNamespace
+
+from src.heimdall.api.endpoints import hybrid_recommendations as endpoint
+from src.heimdall.services.catalog_snapshot import CatalogSnapshotStore
+from tests.fakes import FakeAsyncSession, FakeResult, make_catalog_rows
+
+
+def test_recommendations_endpoint_computes_profile_and_intent_once(monkeypatch):
+    engine = endpoint.hybrid_recommendation_engine
+    rows = make_catalog_rows(40)
+    calls = {"profile": 0, "intent": 0}
+
+    async def fake_profile(user_id, db):
+        calls["profile"] += 1
+        return {"user_id": user_id, "category_preferences": {"手机": 5.0},
+                "brand_preferences": {}, "behavior_patterns": {"click": 2}}
+
+    async def fake_intent(user_input, user_id=None):
+        calls["intent"] += 1
+        return engine._offline_intent_analysis(user_input)
+
+    def handler(sql, params):
+        if "MAX(updated_at)" in sql:
+            return FakeResult([(len(rows), None)])
+        if "FROM products" in sql:
+            return FakeResult(rows)
+        return FakeResult([])
+
+    monkeypatch.setattr(engine, "session_factory", None)
+    monkeypatch.setattr(engine, "catalog_store", CatalogSnapshotStore())
+    monkeypatch.setattr(engine, "get_user_behavior_profile", fake_profile)
+    monkeypatch.setattr(engine, "analyze_user_intent", fake_intent)
+
+    response = asyncio.run(endpoint.get_hybrid_recommendations(
+        endpoint.HybridRecommendationRequest(user_id="u1", user_input="想买华为手机", limit=5),
+        SimpleNamespace(state=SimpleNamespace(request_id="req-1")),
+        db=FakeAsyncSession(handler)
+    ))
+
+    assert calls == {"profile": 1, "intent": 1}
+    assert response.behavior_profile["category_preferences"] == {"手机": 5.0}
+    assert response.intent_analysis["intent_type"]
+    assert response.total_recommendations == len(response.recommendations) > 0
+
+
+def test_compare_strategies_scores_once_and_matches_single_strategy():
+    from src.heimdall.services.hybrid_recommendation_engine import HybridRecommendationEngine
+
+    rows = make_catalog_rows(200, seed=11)
+    intent_calls = []
+
+    def handler(sql, params):
+        if "MAX(updated_at)" in sql:
+            return FakeResult([(len(rows), None)])
+        if "FROM products" in sql:
+            return FakeResult(rows)
+        if "ub2.product_id" in sql:
+            return FakeResult([(pid, pid % 6) for pid in params["product_ids"] if pid % 4 == 0])
+        if "FROM user_behaviors" in sql:
+            return FakeResult([
+                (3, "purchase", None, None, 6.0, 2, 1), (3, "view", None, None, 5.0, 5, 1),
+                (5, None, "手机", None, 6.0, 2, 1), (5, None, "耳机", None, 5.0, 5, 1),
+                (6, None, None, "华为", 6.0, 2, 1), (6, None, None, "Apple", 5.0, 5, 1),
+            ])
+        return FakeResult([])
+
+    engine = HybridRecommendationEngine()
+
+    async def fake_intent(user_input, user_id=None):
+        intent_calls.append(user_input)
+        return engine._offline_intent_analysis(user_input)
+
+    engine.analyze_user_intent = fake_intent
+    strategies = ("hybrid", "intent_based", "behavior_based")
+
+    asyncio.run(engine.catalog_store.refresh(FakeAsyncSession(handler)))
+    db = FakeAsyncSession(handler)
+    comparison = asyncio.run(engine.compare_strategies("u1", "想买便宜的华为手机", db, strategies, limit=8))
+
+    # 画像 + 协同过滤各一次查询，意图分析一次，与策略数量无关
+    assert db.round_trips == 2
+    assert len(intent_calls) == 1
+
+    for strategy in strategies:
+        single = asyncio.run(engine.get_hybrid_recommendations(
+            "u1", "想买便宜的华为手机", FakeAsyncSession(handler), limit=8, strategy=strategy
+        ))
+        assert comparison[strategy] == single
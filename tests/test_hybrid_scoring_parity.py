@@ -0,0 +1,154 @@
+# 向量化打分内核与逐产品标量打分的排序一致性测试
+import asyncio
+import random
+
+import pytest
+
+from src.heimdall.services.hybrid_recommendation_engine import HybridRecommendationEngine
+from tests.fakes import BRANDS, CATEGORIES, FakeAsyncSession, FakeResult, make_catalog_rows
+
+STRATEGIES = ["hybrid", "intent_based", "behavior_based", "average"]
+
+
+def _reference_recommendations(engine, products, intent_analysis, behavior_profile,
+                               collaborative_scores, limit, strategy):
+    """逐产品标量打分的参考实现（向量化之前的排序逻辑）"""
+    recommendations = []
+    for product in products:
+        intent_score = 0.0
+        if intent_analysis:
+            intent_score = engine._calculate_intent_score(product, intent_analysis)
+        behavior_score = engine._calculate_behavior_score(product, behavior_profile)
+        collaborative_score = collaborative_scores.get(product["id"], 0.0)
+        content_score = engine._calculate_content_score(product, behavior_profile)
+        popularity_score = engine._calculate_popularity_score(product, None)
+
+        if strategy == "hybrid":
+            final_score = (
+                intent_score * engine.strategy_weights['intent_based'] +
+                behavior_score * engine.strategy_weights['collaborative'] +
+                content_score * engine.strategy_weights['content_based'] +
+                popularity_score * engine.strategy_weights['popularity']
+            )
+        elif strategy == "intent_based":
+            final_score = intent_score
+        elif strategy == "behavior_based":
+            final_score = behavior_score
+        else:
+            final_score = (intent_score + behavior_score + content_score) / 3
+
+        if final_score > 0.1:
+            recommendations.append({
+                "product_id": product["id"],
+                "name": product["name"],
+                "category": product["category"],
+                "brand": product["brand"],
+                "price": product["price"],
+                "image_url": product.get("image_url", ""),
+                "final_score": round(final_score, 3),
+                "intent_score": round(intent_score, 3),
+                "behavior_score": round(behavior_score, 3),
+                "collaborative_score": round(collaborative_score, 3),
+                "content_score": round(content_score, 3),
+                "popularity_score": round(popularity_score, 3),
+                "recommendation_reason": engine._generate_recommendation_reason(
+                    product, intent_analysis, behavior_profile, final_score
+                )
+            })
+    recommendations.sort(key=lambda x: float(x["final_score"]), reverse=True)
+    return recommendations[:limit]
+
+
+def _random_intent(rng):
+    if rng.random() < 0.15:
+        return None
+    return {
+        "intent_type": rng.choice(["产品购买", "价格比较", "信息查询", "品牌了解", "售后服务", "其他"]),
+        "product_categories": [
+            rng.choice([c, c.upper(), c.lower()]) for c in rng.sample(CATEGORIES + ["apple"], rng.randint(0, 3))
+        ],
+        "price_range": rng.choice(["低", "中", "高", "中等"]),
+        "brand_preferences": rng.sample(BRANDS, rng.randint(0, 2)),
+        "urgency_level": rng.choice([0.0, 0.3, 0.5, 0.8, 1.0, rng.random()]),
+    }
+
+
+def _random_profile(rng):
+    return {
+        "category_preferences": {
+            c: rng.choice([1, 3.0, 7.5, 12, rng.uniform(0, 20)]) for c in rng.sample(CATEGORIES, rng.randint(0, 4))
+        },
+        "brand_preferences": {
+            b: rng.choice([1, 2.5, 6, rng.uniform(0, 10)]) for b in rng.sample(BRANDS, rng.randint(0, 3))
+        },
+        "behavior_patterns": rng.choice([{}, {"view": 3}, {"purchase": 1, "click": 2}]),
+    }
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_vectorized_ranking_matches_scalar(seed):
+    rng = random.Random(seed)
+    engine = HybridRecommendationEngine()
+    rows = make_catalog_rows(rng.choice([1, 25, 300]), seed=seed)
+    collaborative = {row[0]: min(rng.randint(0, 8) / 5, 1.0) for row in rows if rng.random() < 0.3}
+    intent_analysis = _random_intent(rng)
+    behavior_profile = _random_profile(rng)
+    strategy = rng.choice(STRATEGIES)
+    limit = rng.choice([1, 5, 10, 50])
+
+    def handler(sql, params):
+        if "FROM products" in sql:
+            return FakeResult(rows)
+        if "ub2.product_id" in sql:
+            return FakeResult([(pid, int(round(score * 5))) for pid, score in collaborative.items()])
+        return FakeResult([])
+
+    async def fake_profile(user_id, db):
+        return behavior_profile
+
+    async def fake_intent(user_input, user_id=None):
+        return intent_analysis
+
+    engine.get_user_behavior_profile = fake_profile
+    engine.analyze_user_intent = fake_intent
+
+    db = FakeAsyncSession(handler)
+    products = asyncio.run(engine._get_all_products(db))
+    expected = _reference_recommendations(
+        engine, products, intent_analysis, behavior_profile, collaborative, limit, strategy
+    )
+
+    actual = asyncio.run(engine.get_hybrid_recommendations(
+        user_id="u1", user_input="我想买手机", db=FakeAsyncSession(handler), limit=limit, strategy=strategy
+    ))
+
+    assert actual == expected
+
+
+def test_round_scores_matches_python_round_near_half():
+    import numpy as np
+    from src.heimdall.services.hybrid_scoring import round_scores
+
+    rng = random.Random(5)
+    values = [rng.random() for _ in range(2000)]
+    # 放大后恰好落在 .5 附近的值（np.round 与 Python round 最容易不一致）
+    values += [(k + 0.5) / 1000 + delta for k in range(100, 1000, 7) for delta in (-1e-12, 0.0, 1e-12)]
+    values += [0.1125, 0.2675, 1.0005, 0.3335, 2.675 / 10]
+    scores = np.array(values, dtype=np.float64)
+
+    assert round_scores(scores).tolist() == [round(v, 3) for v in values]
+
+
+@pytest.mark.parametrize("limit", [0, 1, 3, 10, 500])
+def test_rank_indices_matches_full_stable_sort(limit):
+    import numpy as np
+    from src.heimdall.services.hybrid_scoring import rank_indices
+
+    rng = random.Random(limit)
+    # 大量并列分数，检查同分时保持目录顺序
+    scores = np.array([rng.choice([0.05, 0.1, 0.2, 0.2004, 0.2006, 0.35, 0.9]) for _ in range(300)])
+
+    survivors = [i for i, score in enumerate(scores) if score > 0.1]
+    expected = sorted(survivors, key=lambda i: round(float(scores[i]), 3), reverse=True)[:limit]
+
+    assert rank_indices(scores, limit).tolist() == expected
@@ -0,0 +1,201 @@
+# 用户画像增量更新：衰减累加器与全量重建一致，单条行为的数据库往返次数与历史长度无关
+import asyncio
+import json
+import math
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.heimdall.services.recommendation_engine import EnterpriseRecommendationEngine, decay_factor
+from tests.fakes import FakeAsyncSession, FakeResult
+
+START = datetime(2026, 10, 1, 8, 0, 0)
+
+EVENTS = [
+    ("view", {"category": "手机", "brand": "华为", "price": 3999}, START),
+    ("like", {"category": "耳机", "brand": "华为", "price": 899}, START + timedelta(hours=7)),
+    ("purchase", {"category": "手机", "brand": "小米", "price": 2999}, START + timedelta(days=2)),
+    ("view", {"category": "笔记本", "brand": "联想"}, START + timedelta(days=5, hours=3)),
+    ("share", {"category": "手机", "brand": "华为"}, START + timedelta(days=6)),
+]
+
+
+def _aggregate_rows(engine, events, now):
+    """按 build_user_profile 查询的语义（连续时间衰减 + GROUPING SETS）生成聚合结果行"""
+    groups = {}
+    for behavior_type, data, created_at in events:
+        weight = engine.behavior_weights.get(behavior_type, 1.0) * decay_factor(created_at, now)
+        price = data.get("price")
+        for key in ((1, data.get("category"), None), (2, None, data.get("brand")), (3, None, None)):
+            weight_sum, count, prices, last = groups.get(key, (0.0, 0, [], None))
+            prices = prices + ([price] if price is not None else [])
+            groups[key] = (weight_sum + weight, count + 1, prices, max(last or created_at, created_at))
+    return [
+        (level, category, brand, weight_sum, count, min(prices, default=None), max(prices, default=None), last)
+        for (level, category, brand), (weight_sum, count, prices, last) in groups.items()
+    ]
+
+
+def _rebuild(engine, events, now):
+    """按全量重建的方式（连续时间衰减）计算各累加器，作为增量结果的参照"""
+    rows = _aggregate_rows(engine, events, now)
+    saved = {}
+
+    async def save_user_profile(user_id, profile, db):
+        saved.update(profile)
+
+    engine.save_user_profile = save_user_profile
+
+    class FrozenNow(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now
+
+    import src.heimdall.services.recommendation_engine as module
+    original = module.datetime
+    module.datetime = FrozenNow
+    try:
+        asyncio.run(engine.build_user_profile("u1", FakeAsyncSession(lambda sql, params: FakeResult(rows))))
+    finally:
+        module.datetime = original
+    return saved
+
+
+def test_delta_updates_match_full_rebuild():
+    engine = EnterpriseRecommendationEngine()
+    profile = {"user_id": "u1"}
+    for behavior_type, data, occurred_at in EVENTS:
+        profile = engine.apply_behavior_delta(profile, behavior_type, data, occurred_at)
+
+    now = EVENTS[-1][2]
+    rebuilt = _rebuild(EnterpriseRecommendationEngine(), EVENTS, now)
+
+    assert profile["behavior_count"] == rebuilt["behavior_count"] == len(EVENTS)
+    assert profile["price_range"] == rebuilt["price_range"]
+    assert profile["activity_level"] == pytest.approx(rebuilt["activity_level"])
+    for key in ("category", "brand"):
+        incremental = engine.decayed_preferences(profile, key, now)
+        expected = rebuilt[f"{key}_preferences"]
+        assert incremental.keys() == expected.keys()
+        for name, value in expected.items():
+            assert incremental[name] == pytest.approx(value)
+
+
+def test_untouched_accumulators_keep_their_own_timestamp():
+    engine = EnterpriseRecommendationEngine()
+    profile = engine.apply_behavior_delta({}, "view", {"category": "手机"}, START)
+    profile = engine.apply_behavior_delta(profile, "view", {"category": "耳机"}, START + timedelta(days=10))
+
+    # 未被命中的累加器不改写，读取时再按各自时间戳衰减
+    assert profile["category_preferences"]["手机"] == 1.0
+    assert profile["category_updated_at"]["手机"] == START.isoformat()
+    decayed = engine.decayed_preferences(profile, "category", START + timedelta(days=10))
+    assert decayed["耳机"] == 1.0
+    assert decayed["手机"] == pytest.approx(math.exp(-1.0))
+
+
+def test_out_of_order_event_does_not_rewind_accumulators():
+    engine = EnterpriseRecommendationEngine()
+    late = START + timedelta(days=20)
+    profile = engine.apply_behavior_delta({}, "view", {"category": "手机"}, late)
+    profile = engine.apply_behavior_delta(profile, "view", {"category": "手机"}, START)
+
+    # 早到的行为按自身时间衰减后加入，时间戳保持为较晚的一次
+    assert profile["category_updated_at"]["手机"] == late.isoformat()
+    assert profile["activity_updated_at"] == late.isoformat()
+    assert profile["last_activity"] == late
+    expected = 1.0 + math.exp(-2.0)
+    assert engine.decayed_preferences(profile, "category", late)["手机"] == pytest.approx(expected)
+    assert profile["activity_level"] == pytest.approx(expected)
+
+    events = [("view", {"category": "手机"}, START), ("view", {"category": "手机"}, late)]
+    rebuilt = _rebuild(EnterpriseRecommendationEngine(), events, late)
+    assert rebuilt["category_preferences"]["手机"] == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("history", [0, 10, 10000])
+def test_event_update_round_trips_do_not_depend_on_history(history):
+    engine = EnterpriseRecommendationEngine()
+    stored = {
+        "user_id": "u1",
+        "category_preferences": {"手机": 3.0},
+        "category_updated_at": {"手机": START.isoformat()},
+        "activity_level": 3.0,
+        "activity_updated_at": START.isoformat(),
+        "behavior_count": history,
+    }
+
+    def handler(sql, params):
+        if "FOR UPDATE" in sql:
+            return FakeResult([(json.dumps(stored),)] if history else [])
+        if "user_behaviors" in sql:
+            raise AssertionError("增量更新不应读取行为历史")
+        return FakeResult([])
+
+    db = FakeAsyncSession(handler)
+    profile = asyncio.run(engine.apply_behavior_event(
+        "u1", "purchase", {"category": "手机"}, db, occurred_at=START + timedelta(days=1)
+    ))
+
+    # 锁定读取画像 1 次 + 写回 1 次
+    assert db.round_trips == 2
+    assert db.commits == 1
+    assert profile["behavior_count"] == history + 1
+    assert "u1" in engine.similar_user_index
+
+
+def test_reconcile_rebuilds_recently_active_users():
+    engine = EnterpriseRecommendationEngine()
+    rebuilt = []
+
+    async def build_user_profile(user_id, db):
+        rebuilt.append(user_id)
+        return {}
+
+    engine.build_user_profile = build_user_profile
+    db = FakeAsyncSession(lambda sql, params: FakeResult([("a",), ("b",)]))
+
+    count = asyncio.run(engine.reconcile_profiles(db, START))
+
+    assert count == 2
+    assert rebuilt == ["a", "b"]
+    assert db.statements[0].count("DISTINCT user_id") == 1
+
+
+def test_worker_delta_and_rebuild_are_serialized_per_user():
+    engine = EnterpriseRecommendationEngine()
+    saved = []
+    in_flight = {"now": 0, "max": 0}
+
+    class SlowSession(FakeAsyncSession):
+        async def execute(self, statement, params=None):
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            await asyncio.sleep(0.01)
+            in_flight["now"] -= 1
+            return await super().execute(statement, params)
+
+    def handler(sql, params):
+        if "GROUPING SETS" in sql:
+            return FakeResult([(1, "手机", None, 3.0, 3, None, None, START), (3, None, None, 3.0, 3, None, None, START)])
+        return FakeResult([])
+
+    async def scenario():
+        engine.profile_write_buffer.start(lambda: FakeAsyncSession(lambda sql, params: FakeResult([])))
+        delta_session = SlowSession(handler)
+        await asyncio.gather(
+            engine.build_user_profile("u1", SlowSession(handler)),
+            engine.apply_behavior_events("u1", [("view", {"category": "耳机"}, START)], delta_session),
+        )
+        saved.append(engine.profile_write_buffer.get("u1"))
+        await engine.profile_write_buffer.close()
+        return delta_session
+
+    delta_session = asyncio.run(scenario())
+
+    # 两次修改没有交错执行，后执行的增量更新基于全量重建的结果
+    assert in_flight["max"] == 1
+    assert set(saved[0]["category_preferences"]) == {"手机", "耳机"}
+    # 写缓冲运行时不再使用与写入不在同一事务中的 FOR UPDATE
+    assert not any("FOR UPDATE" in sql for sql in delta_session.statements)
+    assert len(engine.profile_locks) == 0
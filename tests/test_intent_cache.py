@@ -0,0 +1,135 @@
+# 意图分析缓存：TTL、LRU淘汰、并发请求合并与引擎接入
+import asyncio
+
+import pytest
+
+from src.heimdall.services import hybrid_recommendation_engine as module
+from src.heimdall.services.hybrid_recommendation_engine import HybridRecommendationEngine
+from src.heimdall.services.intent_cache import IntentCache, normalize_intent_input
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalized_inputs_share_a_key():
+    assert normalize_intent_input("  想买　华为\t手机  ") == normalize_intent_input("想买 华为 手机")
+    assert IntentCache.make_key("iPhone 15", "m", "v1") == IntentCache.make_key("iphone  15", "m", "v1")
+    assert IntentCache.make_key("iPhone 15", "m", "v1") != IntentCache.make_key("iPhone 15", "m", "v2")
+
+
+def test_ttl_expiry_and_lru_eviction():
+    clock = FakeClock()
+    cache = IntentCache(max_size=2, ttl_seconds=10, clock=clock)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}  # a 变为最近使用
+
+    cache.put("c", {"v": 3})
+    assert cache.get("b") is None
+    assert cache.stats.evictions == 1
+
+    clock.now = 11
+    assert cache.get("a") is None
+    assert cache.stats.expirations == 1
+
+
+def test_concurrent_identical_requests_make_one_call():
+    cache = IntentCache(max_size=10, ttl_seconds=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"intent_type": "产品购买"}
+
+    async def run():
+        key = cache.make_key("想买手机", "m", "v1")
+        results = await asyncio.gather(*(cache.get_or_compute(key, compute) for _ in range(20)))
+        again = await cache.get_or_compute(key, compute)
+        return results, again
+
+    results, again = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(result == {"intent_type": "产品购买"} for result in results)
+    assert again == {"intent_type": "产品购买"}
+    summary = cache.summary()
+    assert (summary["misses"], summary["coalesced"], summary["hits"]) == (1, 19, 1)
+
+    # 返回副本，调用方修改不影响缓存
+    results[0]["intent_type"] = "已修改"
+    assert again["intent_type"] == "产品购买"
+
+
+def test_failures_propagate_to_waiters_and_are_not_cached():
+    cache = IntentCache(max_size=10, ttl_seconds=60)
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise ConnectionError("connection refused")
+
+    async def run():
+        key = cache.make_key("想买手机", "m", "v1")
+        results = await asyncio.gather(
+            *(cache.get_or_compute(key, failing) for _ in range(3)), return_exceptions=True
+        )
+        with pytest.raises(ConnectionError):
+            await cache.get_or_compute(key, failing)
+        return results
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert len(attempts) == 2
+    assert len(cache) == 0
+
+
+def test_caller_timeout_does_not_abort_shared_computation():
+    cache = IntentCache(max_size=10, ttl_seconds=60)
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return {"intent_type": "价格比较"}
+
+    async def run():
+        key = cache.make_key("多少钱", "m", "v1")
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(cache.get_or_compute(key, slow), 0.01)
+        await asyncio.sleep(0.08)
+        return cache.get(key)
+
+    assert asyncio.run(run()) == {"intent_type": "价格比较"}
+
+
+def test_engine_analyze_user_intent_uses_cache(monkeypatch):
+    cache = IntentCache(max_size=10, ttl_seconds=60)
+    monkeypatch.setattr(module, "intent_cache", cache)
+    engine = HybridRecommendationEngine()
+    llm_calls = []
+
+    async def fake_request(user_input):
+        llm_calls.append(user_input)
+        await asyncio.sleep(0.01)
+        return {"intent_type": "产品购买", "product_categories": ["手机"]}
+
+    engine._request_intent_analysis = fake_request
+
+    async def run():
+        return await asyncio.gather(
+            engine.analyze_user_intent("想买 华为手机", "u1"),
+            engine.analyze_user_intent("想买华为手机", "u2"),
+            engine.analyze_user_intent(" 想买  华为手机 ", "u3"),
+        )
+
+    first, _, _ = asyncio.run(run())
+    # "想买 华为手机" 与 "想买华为手机" 规范化后不同（空白不会被删除）
+    assert len(llm_calls) == 2
+    assert first["product_categories"] == ["手机"]
+    assert engine.get_metrics()["intent_cache"]["coalesced"] == 1
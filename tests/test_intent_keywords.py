@@ -0,0 +1,166 @@
+# 离线意图分析关键词匹配器：与原逐关键词子串判断结果一致、热更新与长输入基准
+import json
+import os
+import random
+import time
+
+import pytest
+
+from src.heimdall.services.intent_keywords import (
+    DEFAULT_KEYWORD_TABLES,
+    KeywordMatcher,
+    OfflineIntentAnalyzer,
+)
+
+
+def reference_offline_intent_analysis(user_input):
+    """原 _offline_intent_analysis 的逐关键词实现（对照基准）"""
+    input_lower = user_input.lower()
+    intent_keywords = {
+        "产品购买": ["买", "购买", "要", "想买", "订购", "下单", "获取"],
+        "价格比较": ["价格", "多少钱", "贵", "便宜", "对比", "比较", "性价比"],
+        "信息查询": ["什么", "怎么样", "如何", "介绍", "了解", "说明"],
+        "品牌了解": ["品牌", "牌子", "哪个好", "推荐", "评价"],
+        "售后服务": ["保修", "售后", "服务", "维修", "退换"]
+    }
+    intent_type = "信息查询"
+    max_matches = 0
+    for intent, keywords in intent_keywords.items():
+        matches = sum(1 for keyword in keywords if keyword in input_lower)
+        if matches > max_matches:
+            max_matches = matches
+            intent_type = intent
+    category_keywords = {
+        "手机": ["手机", "iphone", "华为", "小米", "oppo", "vivo"],
+        "笔记本": ["笔记本", "电脑", "macbook", "联想", "戴尔", "惠普"],
+        "耳机": ["耳机", "airpods", "蓝牙", "音响"],
+        "平板": ["平板", "ipad", "tablet"],
+        "相机": ["相机", "摄像机", "单反"]
+    }
+    matched_categories = []
+    for category, keywords in category_keywords.items():
+        if any(keyword in input_lower for keyword in keywords):
+            matched_categories.append(category)
+    price_range = "中"
+    if any(word in input_lower for word in ["便宜", "经济", "低价", "预算"]):
+        price_range = "低"
+    elif any(word in input_lower for word in ["贵", "高端", "旗舰", "最好"]):
+        price_range = "高"
+    urgency_level = 0.5
+    if any(word in input_lower for word in ["马上", "立即", "现在", "急"]):
+        urgency_level = 0.8
+    elif any(word in input_lower for word in ["看看", "了解", "考虑"]):
+        urgency_level = 0.3
+    keywords = []
+    for category, category_keys in category_keywords.items():
+        for key in category_keys:
+            if key in input_lower and key not in keywords:
+                keywords.append(key)
+    return {
+        "intent_type": intent_type,
+        "confidence": min(0.6 + max_matches * 0.1, 0.9),
+        "product_categories": matched_categories,
+        "price_range": price_range,
+        "brand_preferences": [],
+        "urgency_level": urgency_level,
+        "keywords": keywords[:5],
+        "analysis_summary": f"离线分析识别为{intent_type}意图"
+    }
+
+
+ALL_KEYWORDS = sorted({
+    keyword
+    for group in DEFAULT_KEYWORD_TABLES.values()
+    for keywords in group.values()
+    for keyword in keywords
+})
+FILLER = ["我", "的", "一个", "这款", "，", "。", "呢", "iPhone", "MacBook", "OPPO", "好", "多", "高", " "]
+
+
+def random_input(rng, pieces):
+    return "".join(
+        rng.choice(ALL_KEYWORDS) if rng.random() < 0.3 else rng.choice(FILLER)
+        for _ in range(pieces)
+    )
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_reference_analysis(seed):
+    rng = random.Random(seed)
+    analyzer = OfflineIntentAnalyzer()
+    for _ in range(50):
+        text = random_input(rng, rng.randint(0, 40))
+        assert analyzer.analyze(text) == reference_offline_intent_analysis(text)
+
+
+def test_overlapping_keywords_are_all_found():
+    matcher = KeywordMatcher(["想买", "买", "多少钱", "少", "钱包"])
+    assert matcher.find("想买多少钱包") == {"想买", "买", "多少钱", "少", "钱包"}
+    assert matcher.find("") == frozenset()
+
+
+def test_hot_reload_from_file(tmp_path):
+    analyzer = OfflineIntentAnalyzer()
+    tables = json.loads(json.dumps(DEFAULT_KEYWORD_TABLES))
+    tables["category"]["手表"] = ["手表", "watch"]
+    path = tmp_path / "keywords.json"
+    path.write_text(json.dumps(tables, ensure_ascii=False), encoding="utf-8")
+
+    assert analyzer.analyze("想买Apple Watch")["product_categories"] == []
+    assert analyzer.reload_from_file(str(path)) == 2
+    assert analyzer.analyze("想买Apple Watch")["product_categories"] == ["手表"]
+
+    with pytest.raises(ValueError):
+        analyzer.reload({"intent": {}})
+    assert analyzer.version == 2
+
+
+def test_reloaded_keywords_are_lowercased_and_deduplicated():
+    analyzer = OfflineIntentAnalyzer()
+    tables = json.loads(json.dumps(DEFAULT_KEYWORD_TABLES))
+    tables["category"]["手表"] = ["Watch", "watch", "WATCH", "手表"]
+
+    analyzer.reload(tables)
+
+    assert analyzer.tables["category"]["手表"] == ("watch", "手表")
+    assert analyzer.analyze("想买apple watch")["product_categories"] == ["手表"]
+    assert analyzer.analyze("想买APPLE WATCH")["product_categories"] == ["手表"]
+
+
+def _long_inputs():
+    rng = random.Random(42)
+    return {
+        # 长段描述中夹杂少量关键词（多数关键词需要完整扫描）
+        "sparse": "这是一段没有关键词的补充描述文字" * 1500 + "想买华为手机",
+        # 关键词密集的长输入（关键词很快命中）
+        "dense": "".join(random_input(rng, 20) + "补充描述文字" * 5 for _ in range(200)),
+    }
+
+
+def test_long_inputs_match_reference_analysis():
+    analyzer = OfflineIntentAnalyzer()
+    for text in _long_inputs().values():
+        assert analyzer.analyze(text) == reference_offline_intent_analysis(text)
+
+
+def _best_of(fn, text, rounds=5, repeat=20):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(text)
+        timings.append((time.perf_counter() - start) / repeat)
+    return min(timings)
+
+
+@pytest.mark.skipif(not os.environ.get("HEIMDALL_RUN_BENCHMARKS"), reason="设置 HEIMDALL_RUN_BENCHMARKS=1 后运行")
+def test_long_input_benchmark():
+    """基准：长输入下去重后的匹配器不慢于原逐关键词子串判断"""
+    analyzer = OfflineIntentAnalyzer()
+    timings = {
+        name: (_best_of(analyzer.analyze, text), _best_of(reference_offline_intent_analysis, text))
+        for name, text in _long_inputs().items()
+    }
+
+    assert timings["sparse"][0] < timings["sparse"][1], timings
+    assert timings["dense"][0] < timings["dense"][1] * 1.5, timings
@@ -0,0 +1,182 @@
+# 产品相似度离线任务：共现余弦相似度、内容补齐、分块流式读取行为日志
+import asyncio
+import math
+from datetime import datetime
+
+from src.heimdall.services.item_similarity import (
+    CatalogItem,
+    CooccurrenceAccumulator,
+    ItemSimilarityJob,
+    content_neighbors,
+)
+from tests.fakes import FakeAsyncSession, FakeResult
+
+CATALOG = [
+    CatalogItem(1, "手机", "华为", 4.5, 100),
+    CatalogItem(2, "手机", "小米", 4.8, 50),
+    CatalogItem(3, "耳机", "华为", 4.1, 10),
+    CatalogItem(4, "耳机", "索尼", 4.9, 300),
+    CatalogItem(5, "平板", "苹果", 4.0, 5),
+]
+
+# (id, user_id, product_id)，按 (user_id, id) 排序
+BEHAVIORS = [
+    (1, "a", 1), (2, "a", 2), (3, "a", 3),
+    (4, "b", 1), (5, "b", 2),
+    (6, "c", 1), (7, "c", 3), (8, "c", 3),
+]
+
+
+def test_cooccurrence_uses_cosine_similarity():
+    accumulator = CooccurrenceAccumulator()
+    accumulator.add_user([1, 2, 3])
+    accumulator.add_user([1, 2])
+    accumulator.add_user([1, 3, 3])
+
+    neighbors = accumulator.top_neighbors(top_n=2)
+
+    assert neighbors[1] == [(2, round(2 / math.sqrt(3 * 2), 6)), (3, round(2 / math.sqrt(3 * 2), 6))]
+    assert neighbors[2][0] == (1, round(2 / math.sqrt(6), 6))
+    assert neighbors[3][1] == (2, round(1 / math.sqrt(4), 6))
+
+
+def test_pair_counts_are_pruned_when_over_budget():
+    accumulator = CooccurrenceAccumulator(max_pairs=5)
+    accumulator.add_user([1, 2])
+    accumulator.add_user([1, 2])
+    accumulator.add_user([3, 4, 5, 6])
+
+    # 超出上限后只淘汰计数最低的共现对，保留到上限的 90%
+    assert (1, 2) in accumulator.pair_counts
+    assert len(accumulator.pair_counts) == accumulator.prune_to == 4
+    assert accumulator.pruned == 3
+
+
+def test_prune_keeps_signal_when_all_counts_are_one():
+    accumulator = CooccurrenceAccumulator(max_pairs=10, prune_to=8)
+    accumulator.add_user([1, 2, 3, 4, 5])
+    accumulator.add_user([6, 7])
+
+    assert len(accumulator.pair_counts) == 8
+    assert accumulator.pruned == 3
+    assert all(count == 1 for count in accumulator.pair_counts.values())
+
+
+def test_prune_evicts_lowest_counts_first():
+    accumulator = CooccurrenceAccumulator()
+    for items in ([1, 2], [1, 2], [1, 2], [3, 4], [3, 4], [5, 6], [5, 6]):
+        accumulator.add_user(items)
+    accumulator.max_pairs = accumulator.prune_to = 1
+    accumulator.add_user([1, 2])
+
+    assert accumulator.pair_counts == {(1, 2): 4}
+    assert accumulator.pruned == 2
+
+
+def test_per_user_cap_keeps_most_recent_items():
+    accumulator = CooccurrenceAccumulator(max_items_per_user=2)
+    accumulator.add_user([9, 5, 9, 1])
+
+    assert dict(accumulator.pair_counts) == {(5, 9): 1}
+    assert 1 not in accumulator.item_counts
+
+
+def test_stream_yields_items_most_recent_first():
+    def handler(sql, params):
+        after = (params["last_user_id"], params["last_id"])
+        rows = [row for row in BEHAVIORS if (row[1], row[0]) > after]
+        return FakeResult(rows[:params["chunk_size"]])
+
+    job = ItemSimilarityJob(chunk_size=2)
+
+    async def collect():
+        return [entry async for entry in job.stream_user_items(FakeAsyncSession(handler), since=None)]
+
+    assert asyncio.run(collect()) == [("a", [3, 2, 1]), ("b", [2, 1]), ("c", [3, 1])]
+
+
+def test_content_neighbors_follow_rating_order_within_category_or_brand():
+    neighbors = content_neighbors(CATALOG, top_n=3)
+
+    # 同类别（手机）或同品牌（华为），按评分、评价数降序
+    assert neighbors[1] == [2, 3]
+    assert neighbors[3] == [4, 1]
+    assert neighbors[5] == []
+
+
+def test_job_streams_behaviors_in_chunks_and_fills_cold_items():
+    def handler(sql, params):
+        if "FROM user_behaviors" in sql:
+            after = (params["last_user_id"], params["last_id"])
+            rows = [row for row in BEHAVIORS if (row[1], row[0]) > after]
+            return FakeResult(rows[:params["chunk_size"]])
+        if "FROM products" in sql:
+            return FakeResult([(i.id, i.category, i.brand, i.rating, i.review_count) for i in CATALOG])
+        return FakeResult([])
+
+    db = FakeAsyncSession(handler)
+    job = ItemSimilarityJob(top_n=3, chunk_size=2, window_days=30)
+
+    stats = asyncio.run(job.run(db))
+
+    # 8 行按每块 2 行读取：4 个满块 + 1 个空块，用户 c 跨块也只计为一个用户
+    assert sum("FROM user_behaviors" in sql for sql in db.statements) == 5
+    assert stats["users"] == 3
+    assert stats["products"] == len(CATALOG)
+
+    assert sum("INSERT INTO product_similarities" in sql for sql in db.statements) == 1
+    assert db.commits == 1
+    assert any("DELETE FROM product_similarities" in sql for sql in db.statements)
+
+
+def test_merge_puts_cooccurrence_first_then_content_fill():
+    job = ItemSimilarityJob(top_n=3)
+    merged = job.merge_neighbors(CATALOG, {1: [(4, 0.5), (99, 0.4)]})
+
+    # 已下架的99被剔除，不足部分用内容相似产品补齐（分数为0，不重复）
+    assert merged[1] == [(4, 0.5), (2, 0.0), (3, 0.0)]
+    assert merged[5] == []
+
+
+def test_product_recommendations_fall_back_when_similarity_table_is_missing():
+    from collections import namedtuple
+    from sqlalchemy.exc import ProgrammingError
+
+    from src.heimdall.api.endpoints.products import get_product_recommendations
+
+    fields = (
+        "id name description price category brand image_url tags attributes stock_quantity "
+        "rating review_count is_active created_at updated_at"
+    )
+
+    class Row(namedtuple("Row", fields)):
+        @property
+        def _mapping(self):
+            return self._asdict()
+
+    class UndefinedTable(Exception):
+        pgcode = "42P01"
+
+    class Rows(FakeResult):
+        """保留具名行（端点按属性读取列）"""
+
+        def __init__(self, rows):
+            super().__init__()
+            self._rows = rows
+
+    Product = namedtuple("Product", "category brand tags neighbor_ids")
+    now = datetime.now()
+
+    def handler(sql, params):
+        if "product_similarities" in sql:
+            raise ProgrammingError(sql, params, UndefinedTable())
+        if "NULL AS neighbor_ids" in sql:
+            return Rows([Product("手机", "华为", [], None)])
+        return Rows([Row(2, "手机B", "", 2999, "手机", "小米", "", [], {}, 10, 4.8, 50, True, now, now)])
+
+    session = FakeAsyncSession(handler)
+    result = asyncio.run(get_product_recommendations(product_id=1, limit=5, db=session))
+
+    # 未执行迁移 002 时按类别、品牌回退，而不是返回 500
+    assert [product.id for product in result["recommendations"]] == [2]
+    assert "category = :category OR brand = :brand" in session.statements[-1]
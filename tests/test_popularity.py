@@ -0,0 +1,183 @@
+# 产品热度服务：衰减计数、全量加载 + 增量刷新、内存榜单，以及混合推荐热门度分数的标量/向量一致性
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from src.heimdall.services.hybrid_recommendation_engine import HybridRecommendationEngine
+from src.heimdall.services.popularity import DecayedCounter, PopularityService
+from src.heimdall.services.recommendation_engine import EnterpriseRecommendationEngine
+from tests.fakes import FakeAsyncSession, FakeResult, make_catalog_rows
+from tests.test_hybrid_scoring_parity import (
+    STRATEGIES, _random_intent, _random_profile, _reference_recommendations
+)
+
+HOUR = 3600.0
+
+# id, name, description, price, category, category_id, brand, image_url, tags, attributes, rating, review_count
+PRODUCTS = [
+    (1, "手机A", "", 3999, "手机", 1, "华为", "", [], {}, 4.9, 500),
+    (2, "手机B", "", 2999, "手机", 1, "小米", "", [], {}, 4.2, 50),
+    (3, "耳机A", "", 599, "耳机", 2, "索尼", "", [], {}, 4.5, 80),
+    (4, "耳机B", "", 199, "耳机", 2, "小米", "", [], {}, 4.0, 10),
+]
+
+
+def test_decayed_counter_halves_per_half_life_and_rebases():
+    counter = DecayedCounter(half_life_seconds=HOUR, anchor=0.0)
+    counter.add(1, 3.0, occurred_at=0.0)
+    counter.add(2, 1.0, occurred_at=HOUR)
+
+    assert abs(counter.value(1, now=HOUR) - 1.5) < 1e-12
+    assert abs(counter.value(2, now=HOUR) - 1.0) < 1e-12
+
+    counter.rebase(now=2 * HOUR)
+    assert counter.anchor == 2 * HOUR
+    assert abs(counter.value(1, now=2 * HOUR) - 0.75) < 1e-12
+    ids, values = counter.export(now=3 * HOUR)
+    assert ids.tolist() == [1, 2]
+    assert np.allclose(values, [0.375, 0.25])
+
+
+def _handler(state):
+    def handler(sql, params):
+        if "MAX(id)" in sql:
+            return FakeResult([(state["max_id"],)])
+        if "GROUP BY product_id" in sql:
+            return FakeResult(state["aggregated"])
+        if "FROM user_behaviors" in sql:
+            rows = [row for row in state["events"] if row[0] > params["last_id"]]
+            return FakeResult(rows[:params["chunk_size"]])
+        if "COUNT(*), MAX(updated_at)" in sql:
+            return FakeResult([(len(PRODUCTS), "v1")])
+        if "FROM products" in sql:
+            state["catalog_loads"] += 1
+            return FakeResult(PRODUCTS)
+        return FakeResult([])
+    return handler
+
+
+def test_full_load_then_incremental_refresh_serves_top_lists_from_memory():
+    now = datetime.now(timezone.utc)
+    state = {
+        "max_id": 10,
+        # 全量加载时数据库已按产品聚合衰减热度
+        "aggregated": [(4, 6.0), (3, 2.0), ("bad", 1.0)],
+        "events": [],
+        "catalog_loads": 0,
+    }
+    service = PopularityService(top_n=3, chunk_size=2)
+    assert not service.ready
+    assert service.top(3) is None
+
+    stats = asyncio.run(service.refresh(FakeAsyncSession(_handler(state))))
+    assert stats["rebuild"] and stats["last_id"] == 10
+    # 有行为的产品在前，无行为的产品按评分、评价数排序
+    assert [product["id"] for product in service.top(3)] == [4, 3, 1]
+    assert [product["id"] for product in service.top(2, category_id=1)] == [1, 2]
+    assert service.top(4) is None
+
+    # 新行为只按主键水位增量读取（分块大小 2，共读取 2 块）
+    state["events"] = [
+        (11, "2", "purchase", now), (12, "2", "purchase", now),
+        (13, "2", "click", now), (14, None, "view", now),
+    ]
+    session = FakeAsyncSession(_handler(state))
+    stats = asyncio.run(service.refresh(session))
+    assert not stats["rebuild"] and stats["events"] == 3 and stats["last_id"] == 14
+    assert [product["id"] for product in service.top(3)] == [2, 4, 3]
+    assert [product["id"] for product in service.top(2, category_id=1)] == [2, 1]
+    # 目录指纹未变化时不重新读取产品
+    assert state["catalog_loads"] == 1
+    assert not any("GROUP BY product_id" in sql for sql in session.statements)
+
+    # 请求路径只读内存
+    assert service.score(2) == 1.0
+    assert service.score(1) == 0.0
+    column = service.score_column(np.array([1, 2, 3, 4, 99], dtype=np.int64))
+    assert column.tolist() == [service.score(pid) for pid in [1, 2, 3, 4, 99]]
+
+
+def test_get_popular_products_reads_ranked_list_without_db():
+    state = {"max_id": 0, "aggregated": [(3, 5.0)], "events": [], "catalog_loads": 0}
+    service = PopularityService(top_n=10)
+    asyncio.run(service.refresh(FakeAsyncSession(_handler(state))))
+    engine = EnterpriseRecommendationEngine(popularity=service)
+
+    session = FakeAsyncSession(lambda sql, params: FakeResult([]))
+    products = asyncio.run(engine.get_popular_products(session, limit=2))
+
+    assert session.round_trips == 0
+    assert [product["product_id"] for product in products] == ["3", "1"]
+    assert products[0]["category"] and products[0]["rating"] == 4.5
+
+
+def test_trending_endpoint_treats_zero_category_as_unfiltered(monkeypatch):
+    from src.heimdall.api.endpoints import enterprise_recommendations
+
+    state = {"max_id": 0, "aggregated": [(3, 5.0)], "events": [], "catalog_loads": 0}
+    service = PopularityService(top_n=10)
+    asyncio.run(service.refresh(FakeAsyncSession(_handler(state))))
+    monkeypatch.setattr(enterprise_recommendations, "popularity_service", service)
+
+    session = FakeAsyncSession(lambda sql, params: FakeResult([]))
+    result = asyncio.run(enterprise_recommendations.get_trending_recommendations(
+        limit=3, category_id=0, db=session
+    ))
+
+    # 与数据库回退查询一致，不按类别过滤（而不是查找类别 0 得到空榜单）
+    assert [product["id"] for product in result["trending_products"]] == [3, 1, 2]
+    assert session.round_trips == 0
+
+
+def _loaded_service(rows, seed):
+    rng = random.Random(seed)
+    service = PopularityService()
+    counter = DecayedCounter(service.half_life_seconds)
+    for row in rows:
+        if rng.random() < 0.6:
+            counter.add(row[0], rng.choice([1.0, 1.5, 3.0]), time.time() - rng.uniform(0, 200) * HOUR)
+    service._counter = counter
+    service._snapshot = service.build_snapshot()
+    return service
+
+
+def test_vectorized_popularity_matches_scalar_with_behavior_popularity():
+    for seed in range(10):
+        rng = random.Random(seed)
+        rows = make_catalog_rows(rng.choice([25, 300]), seed=seed)
+        engine = HybridRecommendationEngine(popularity=_loaded_service(rows, seed))
+        intent_analysis = _random_intent(rng)
+        behavior_profile = _random_profile(rng)
+        strategy = rng.choice(STRATEGIES)
+        limit = rng.choice([5, 50])
+
+        def handler(sql, params):
+            if "FROM products" in sql:
+                return FakeResult(rows)
+            return FakeResult([])
+
+        async def fake_profile(user_id, db):
+            return behavior_profile
+
+        async def fake_intent(user_input, user_id=None):
+            return intent_analysis
+
+        engine.get_user_behavior_profile = fake_profile
+        engine.analyze_user_intent = fake_intent
+
+        products = asyncio.run(engine._get_all_products(FakeAsyncSession(handler)))
+        expected = _reference_recommendations(
+            engine, products, intent_analysis, behavior_profile, {}, limit, strategy
+        )
+        actual = asyncio.run(engine.get_hybrid_recommendations(
+            user_id="u1", user_input="我想买手机", db=FakeAsyncSession(handler), limit=limit, strategy=strategy
+        ))
+
+        assert actual == expected
+        # 热门度分数确实来自行为热度
+        assert any(
+            engine._calculate_popularity_score(product, None) != product["rating"] / 5.0 for product in products
+        )
@@ -0,0 +1,130 @@
+# 用户画像后台更新队列：同用户信号合并、并发上限、关闭时排空
+import asyncio
+from datetime import datetime
+
+from src.heimdall.services.profile_worker import ProfileRebuildWorker
+from tests.fakes import FakeAsyncSession, FakeResult
+
+
+class RecordingEngine:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.applied = []
+        self.rebuilt = []
+        self.active = 0
+        self.max_active = 0
+
+    async def _work(self):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        self.active -= 1
+
+    async def apply_behavior_events(self, user_id, events, db):
+        await self._work()
+        self.applied.append((user_id, [event[0] for event in events]))
+
+    async def build_user_profile(self, user_id, db):
+        await self._work()
+        self.rebuilt.append(user_id)
+
+
+def _session_factory():
+    return FakeAsyncSession(lambda sql, params: FakeResult([]))
+
+
+def _event(behavior_type):
+    return (behavior_type, {"category": "手机"}, datetime.now())
+
+
+def test_signals_for_same_user_are_coalesced():
+    engine = RecordingEngine()
+
+    async def scenario():
+        worker = ProfileRebuildWorker(engine, _session_factory, concurrency=2, coalesce_seconds=0.05)
+        worker.start()
+        for behavior_type in ("view", "click", "purchase"):
+            assert worker.mark_dirty("u1", _event(behavior_type))
+        worker.mark_dirty("u2", _event("view"))
+        await asyncio.sleep(0.2)
+        summary = worker.summary()
+        await worker.drain()
+        return summary
+
+    summary = asyncio.run(scenario())
+
+    assert sorted(engine.applied) == [("u1", ["view", "click", "purchase"]), ("u2", ["view"])]
+    assert summary["signals"] == 4
+    assert summary["coalesced"] == 2
+    assert summary["updates"] == 2
+    assert summary["queue_depth"] == 0
+
+
+def test_signal_without_event_triggers_full_rebuild():
+    engine = RecordingEngine()
+
+    async def scenario():
+        worker = ProfileRebuildWorker(engine, _session_factory, concurrency=1, coalesce_seconds=0.01)
+        worker.start()
+        worker.mark_dirty("u1", _event("view"))
+        worker.mark_dirty("u1")
+        await worker.drain()
+
+    asyncio.run(scenario())
+
+    assert engine.rebuilt == ["u1"]
+    assert engine.applied == []
+
+
+def test_concurrency_is_bounded_and_drain_flushes_pending_signals():
+    engine = RecordingEngine(delay=0.02)
+
+    async def scenario():
+        # 合并窗口很长：只有 drain 会放行这些待更新项
+        worker = ProfileRebuildWorker(engine, _session_factory, concurrency=3, coalesce_seconds=60)
+        worker.start()
+        for i in range(12):
+            worker.mark_dirty(f"u{i}", _event("view"))
+        assert worker.summary()["queue_depth"] == 12
+        await worker.drain(timeout=5)
+        return worker
+
+    worker = asyncio.run(scenario())
+
+    assert len(engine.applied) == 12
+    assert engine.max_active == 3
+    # 排空后不再接收信号，调用方回退为同步更新
+    assert not worker.running
+    assert worker.mark_dirty("u1", _event("view")) is False
+
+
+def test_batch_with_historical_events_requests_full_rebuild(monkeypatch):
+    from src.heimdall.api.endpoints import enterprise_recommendations
+
+    received_at = datetime(2026, 10, 17, 12, 0, 0)
+    records = [
+        ("u1", "s1", "view", {"category": "手机"}, received_at),
+        ("u2", "s2", "view", {"category": "手机"}, received_at),
+        ("u2", "s2", "click", {"category": "手机"}, datetime(2026, 9, 27, 12, 0, 0)),
+    ]
+    engine = RecordingEngine()
+
+    async def scenario():
+        worker = ProfileRebuildWorker(engine, _session_factory, concurrency=1, coalesce_seconds=0.01)
+        monkeypatch.setattr(enterprise_recommendations, "profile_rebuild_worker", worker)
+        worker.start()
+        await enterprise_recommendations._mark_recorded_profiles(records, received_at, _session_factory())
+        await worker.drain()
+
+    asyncio.run(scenario())
+
+    # 带客户端历史时间的事件不做增量更新，该用户改为全量重建
+    assert engine.applied == [("u1", ["view"])]
+    assert engine.rebuilt == ["u2"]
+
+    # 队列未运行时在请求中同步更新
+    stopped = RecordingEngine()
+    monkeypatch.setattr(enterprise_recommendations, "recommendation_engine", stopped)
+    asyncio.run(enterprise_recommendations._mark_recorded_profiles(records, received_at, _session_factory()))
+    assert stopped.applied == [("u1", ["view"])]
+    assert stopped.rebuilt == ["u2"]
@@ -0,0 +1,199 @@
+# 用户画像写缓冲：只保留最新版本、多行 upsert 批量刷写、关闭时全部落库
+import asyncio
+import json
+
+import pytest
+from sqlalchemy.exc import DataError
+
+from src.heimdall.services.profile_write_buffer import ProfileWriteBuffer
+from src.heimdall.services.recommendation_engine import EnterpriseRecommendationEngine
+from tests.fakes import FakeAsyncSession, FakeResult
+
+
+class SessionFactory:
+    def __init__(self, fail=False, reject=()):
+        self.sessions = []
+        self.fail = fail
+        self.reject = set(reject)
+        self.written = {}
+
+    def handler(self, sql, params):
+        if self.fail:
+            raise RuntimeError("数据库不可用")
+        if self.reject & set(params.values()):
+            raise DataError(sql, params, Exception("invalid input syntax for type json"))
+        for key, value in params.items():
+            if key.startswith("user_id_"):
+                self.written[value] = json.loads(params["profile_data_" + key[len("user_id_"):]])
+        return FakeResult([])
+
+    def __call__(self):
+        session = FakeAsyncSession(self.handler)
+        self.sessions.append(session)
+        return session
+
+
+def test_latest_profile_per_user_is_written_in_batched_statements():
+    factory = SessionFactory()
+
+    async def scenario():
+        buffer = ProfileWriteBuffer(flush_seconds=60, max_dirty=10000, batch_size=4)
+        buffer.start(factory)
+        for version in range(5):
+            for i in range(10):
+                assert buffer.put(f"u{i}", {"version": version})
+        await buffer.close()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    # 50 次保存只写入 10 行最新版本：3 条多行 upsert、1 次提交
+    assert factory.written == {f"u{i}": {"version": 4} for i in range(10)}
+    assert sum(session.round_trips for session in factory.sessions) == 3
+    assert sum(session.commits for session in factory.sessions) == 1
+    assert "EXCLUDED.profile_data" in factory.sessions[0].statements[0]
+    assert buffer.summary()["superseded"] == 40
+    assert not buffer.running
+
+
+def test_size_threshold_triggers_flush_before_timer():
+    factory = SessionFactory()
+
+    async def scenario():
+        buffer = ProfileWriteBuffer(flush_seconds=60, max_dirty=3, batch_size=100)
+        buffer.start(factory)
+        for i in range(3):
+            buffer.put(f"u{i}", {"i": i})
+        await asyncio.sleep(0.05)
+        written = dict(factory.written)
+        await buffer.close()
+        return written
+
+    assert len(asyncio.run(scenario())) == 3
+
+
+def test_failed_flush_keeps_profiles_without_overwriting_newer_versions():
+    factory = SessionFactory(fail=True)
+
+    async def scenario():
+        buffer = ProfileWriteBuffer(flush_seconds=60, max_dirty=100, batch_size=100)
+        buffer.start(factory)
+        buffer.put("u1", {"version": 1})
+        buffer.put("u2", {"version": 1})
+        flush = asyncio.ensure_future(buffer.flush())
+        await asyncio.sleep(0)
+        # 刷写进行中的画像仍可读取，新的保存进入下一批
+        buffer.put("u1", {"version": 2})
+        with pytest.raises(RuntimeError):
+            await flush
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    assert buffer.get("u1") == {"version": 2}
+    assert buffer.get("u2") == {"version": 1}
+    assert buffer.summary()["failures"] == 1
+
+
+def test_bad_row_is_dropped_without_blocking_the_batch():
+    factory = SessionFactory(reject={"u2"})
+
+    async def scenario():
+        buffer = ProfileWriteBuffer(flush_seconds=60, max_dirty=100, batch_size=100)
+        buffer.start(factory)
+        for i in range(4):
+            buffer.put(f"u{i}", {"price_range": {"min": float("inf"), "max": 0}})
+        written = await buffer.flush()
+        await buffer.close()
+        return buffer, written
+
+    buffer, written = asyncio.run(scenario())
+
+    # 整批失败后逐行重试：出错的一行丢弃，其余画像照常落库，不再重试
+    assert written == 3
+    assert sorted(factory.written) == ["u0", "u1", "u3"]
+    assert factory.written["u0"] == {"price_range": {"min": None, "max": 0}}
+    assert len(buffer) == 0
+    assert buffer.summary()["dropped"] == 1 and buffer.summary()["failures"] == 1
+
+
+def test_engine_reads_through_buffer_and_skips_per_profile_commits():
+    engine = EnterpriseRecommendationEngine()
+    factory = SessionFactory()
+
+    async def scenario():
+        engine.profile_write_buffer.start(factory)
+        db = FakeAsyncSession(lambda sql, params: FakeResult([]))
+        for behavior_type in ("view", "click", "purchase"):
+            await engine.apply_behavior_event("u1", behavior_type, {"category": "手机"}, db)
+        profile = await engine.get_user_profile("u1", db)
+        await engine.profile_write_buffer.close()
+        return db, profile
+
+    db, profile = asyncio.run(scenario())
+
+    # 仅首次从数据库读取画像，之后都读缓冲；请求会话上没有提交
+    assert db.round_trips == 1
+    assert db.commits == 0
+    assert profile["behavior_count"] == 3
+    assert factory.written["u1"]["behavior_count"] == 3
+    assert "u1" in engine.similar_user_index
+
+
+class SlowSessionFactory(SessionFactory):
+    """写入前等待 delay 秒的会话，用于在刷写进行中关闭或取消"""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.started = asyncio.Event()
+
+    def __call__(self):
+        factory = self
+        session = super().__call__()
+
+        async def slow_execute(statement, params=None):
+            factory.started.set()
+            await asyncio.sleep(factory.delay)
+            return await FakeAsyncSession.execute(session, statement, params)
+
+        session.execute = slow_execute
+        return session
+
+
+def test_close_during_flush_waits_for_in_flight_write():
+    async def scenario():
+        factory = SlowSessionFactory(delay=0.05)
+        buffer = ProfileWriteBuffer(flush_seconds=60, max_dirty=1, batch_size=100)
+        buffer.start(factory)
+        buffer.put("u1", {"version": 1})
+        await factory.started.wait()
+        buffer.put("u2", {"version": 1})
+        await buffer.close()
+        return factory, buffer
+
+    factory, buffer = asyncio.run(scenario())
+
+    assert factory.written == {"u1": {"version": 1}, "u2": {"version": 1}}
+    assert len(buffer) == 0 and not buffer.running
+
+
+def test_cancelled_flush_puts_profiles_back():
+    async def scenario():
+        factory = SlowSessionFactory(delay=10)
+        buffer = ProfileWriteBuffer(flush_seconds=60, max_dirty=100, batch_size=100)
+        buffer.start(factory)
+        buffer.put("u1", {"version": 1})
+        flush = asyncio.ensure_future(buffer.flush())
+        await factory.started.wait()
+        flush.cancel()
+        await asyncio.gather(flush, return_exceptions=True)
+        profile = buffer.get("u1")
+        factory.delay = 0
+        await buffer.close()
+        return factory, profile
+
+    factory, profile = asyncio.run(scenario())
+
+    assert profile == {"version": 1}
+    assert factory.written == {"u1": {"version": 1}}
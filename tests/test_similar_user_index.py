@@ -0,0 +1,128 @@
+# 相似用户 MinHash/LSH 索引：相对精确 calculate_similarity 的召回率与增量更新
+import asyncio
+import json
+import random
+import time
+
+from src.heimdall.services.recommendation_engine import EnterpriseRecommendationEngine
+from src.heimdall.services.similar_user_index import SimilarUserIndex
+from tests.fakes import BRANDS, CATEGORIES, FakeAsyncSession, FakeResult
+
+EXTRA_BRANDS = BRANDS + [f"品牌{i}" for i in range(40)]
+EXTRA_CATEGORIES = CATEGORIES + [f"类别{i}" for i in range(20)]
+
+
+def _random_profile(rng):
+    categories = rng.sample(EXTRA_CATEGORIES, rng.randint(1, 4))
+    brands = rng.sample(EXTRA_BRANDS, rng.randint(0, 5))
+    return {
+        "category_preferences": {category: rng.uniform(1, 10) for category in categories},
+        "brand_preferences": {brand: rng.uniform(1, 10) for brand in brands},
+    }
+
+
+def test_lsh_recall_against_exact_similarity():
+    rng = random.Random(3)
+    engine = EnterpriseRecommendationEngine()
+    index = engine.similar_user_index
+    profiles = {f"user{i}": _random_profile(rng) for i in range(3000)}
+    for user_id, profile in profiles.items():
+        index.upsert(user_id, profile)
+
+    k = 10
+    recalls = []
+    for query_id in rng.sample(sorted(profiles), 100):
+        query = profiles[query_id]
+        exact = sorted(
+            (engine.calculate_similarity(query, other) for user_id, other in profiles.items() if user_id != query_id),
+            reverse=True
+        )[:k]
+        approx = index.query(query, k, exclude=query_id)
+
+        # 返回的分数必须是精确相似度
+        for user_id, score in approx:
+            assert score == engine.calculate_similarity(query, profiles[user_id])
+        assert query_id not in {user_id for user_id, _ in approx}
+
+        # 按分数计算召回（同分用户可互换）
+        threshold = exact[-1]
+        hits = sum(1 for _, score in approx if score >= threshold)
+        recalls.append(min(hits, k) / k)
+
+    assert sum(recalls) / len(recalls) >= 0.9
+    # 只有少量候选用户需要精确打分
+    assert index.candidates_scored / index.queries < 0.2 * len(profiles)
+
+
+def test_upsert_replaces_previous_signature():
+    index = SimilarUserIndex(EnterpriseRecommendationEngine().calculate_similarity)
+    index.upsert("a", {"category_preferences": {"手机": 1}, "brand_preferences": {"华为": 1}})
+    index.upsert("b", {"category_preferences": {"手机": 1}, "brand_preferences": {"华为": 1}})
+    query = {"category_preferences": {"手机": 1}, "brand_preferences": {"华为": 1}}
+    assert index.query(query, 1, exclude="a") == [("b", 1.0)]
+
+    index.upsert("b", {"category_preferences": {"家居": 1}, "brand_preferences": {"Dyson": 1}})
+    assert index.query(query, 5, exclude="a") == [("b", 0.0)]
+    index.remove("b")
+    assert index.query(query, 5, exclude="a") == []
+
+
+def test_similar_users_query_loaded_index_and_update_on_save():
+    engine = EnterpriseRecommendationEngine()
+    stored = {
+        "u1": {"category_preferences": {"手机": 3}, "brand_preferences": {"华为": 2}},
+        "u2": {"category_preferences": {"手机": 1}, "brand_preferences": {"华为": 5}},
+        "u3": {"category_preferences": {"家居": 1}, "brand_preferences": {"Dyson": 1}},
+    }
+    full_scans = []
+
+    def handler(sql, params):
+        if "WHERE user_id = :user_id" in sql and "FROM user_profiles" in sql:
+            return FakeResult([(stored[params["user_id"]],)] if params["user_id"] in stored else [])
+        if "FROM user_profiles" in sql:
+            full_scans.append(sql)
+            return FakeResult([(user_id, json.dumps(profile)) for user_id, profile in stored.items()])
+        return FakeResult([])
+
+    db = FakeAsyncSession(handler)
+    # 后台刷新任务加载索引，请求路径只查询
+    asyncio.run(engine.similar_user_index.load(db))
+    first = asyncio.run(engine.get_similar_users_with_scores("u1", db, limit=2))
+    assert first == [("u2", 1.0), ("u3", 0.0)]
+
+    new_profile = {"category_preferences": {"手机": 1}, "brand_preferences": {"Apple": 1}}
+    asyncio.run(engine.save_user_profile("u4", new_profile, db))
+    second = asyncio.run(engine.get_similar_users("u1", db, limit=2))
+
+    assert second == ["u2", "u4"]
+    assert len(full_scans) == 1
+
+
+def test_reload_swaps_index_evicts_deleted_users_and_keeps_concurrent_saves():
+    index = SimilarUserIndex(EnterpriseRecommendationEngine().calculate_similarity)
+    phone = {"category_preferences": {"手机": 1}, "brand_preferences": {"华为": 1}}
+    stored = {"a": phone, "b": phone}
+
+    async def scenario():
+        db = FakeAsyncSession(lambda sql, params: FakeResult([(k, json.dumps(v)) for k, v in stored.items()]))
+        await index.load(db)
+        assert index.query(phone, 5, exclude="a") == [("b", 1.0)]
+
+        # b 被删除；重建过程中 c 保存了画像
+        del stored["b"]
+        original_build = index._build
+
+        def slow_build(rows):
+            time.sleep(0.05)
+            return original_build(rows)
+
+        async def save_during_build():
+            await asyncio.sleep(0.01)
+            index.upsert("c", phone)
+
+        index._build = slow_build
+        await asyncio.gather(index.load(db), save_during_build())
+        return index.query(phone, 5, exclude="a")
+
+    assert asyncio.run(scenario()) == [("c", 1.0)]
+    assert "b" not in index and index.summary()["reloads"] == 2